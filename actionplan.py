@@ -0,0 +1,225 @@
+#------------------------------------------------------------------------------------
+# Action plans: triage now, review, then apply later in one go.
+#
+# In plan mode a bot runs its whole sweep without asking anything, and writes
+# every item it has actions for to a plan file (YAML, one list entry per item,
+# with the comment text already filled in). A human reads the plan, deletes any
+# item or action they don't like (or edits a comment), and then the apply step
+# carries out what's left, several items at a time.
+#
+# Applying is safe to repeat. Before writing to an item we look at it again: its
+# labels are only replaced if they aren't already what the plan wants, a comment
+# is only posted if we haven't posted it since the plan was made, and an item
+# somebody else has commented on since the plan was made is left alone, since
+# our plan for it is out of date. So a failed item can simply be retried, and a whole
+# apply can be re-run after a crash.
+#------------------------------------------------------------------------------------
+
+import threading, time, random, json
+import yaml
+from fetchpool import ordered_map
+
+
+class PlanError(Exception):
+    pass
+
+#------------------------------------------------------------------------------------
+# Build the plan entry for one item. issue_url is the item's issue (for a PR, the
+# issue side of it); `text` renders a boilerplate name into its comment text, or
+# returns None if there's no such boilerplate.
+#------------------------------------------------------------------------------------
+def plan_entry(repo, number, html_url, issue_url, updated_at, labels, actions, text):
+    comments = {}
+    for action in actions:
+        if action.startswith('boilerplate: '):
+            name = action.split(': ')[-1]
+            comments[name] = text(name)
+    return {
+        'repo': repo,
+        'number': int(number),
+        'html_url': html_url,
+        'issue_url': issue_url,
+        'updated_at': updated_at,
+        'labels': list(labels),
+        'actions': list(actions),
+        'comments': comments,
+    }
+
+
+class PlanWriter(object):
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.f = open(path, 'w')
+        self.f.write('# Action plan written %s. Delete any item or action you don\'t want\n'
+                     '# taken (or edit its comment), then run again with --apply.\n' % time.ctime())
+        self.count = 0
+
+    #--------------------------------------------------------------------------------
+    # Each entry is dumped as a one-item YAML list, so the file is a valid list at
+    # every point, and a half-written plan can still be read.
+    #--------------------------------------------------------------------------------
+    def add(self, entry):
+        with self.lock:
+            self.f.write('\n')
+            yaml.safe_dump([entry], self.f, default_flow_style=False, allow_unicode=True,
+                           encoding='utf-8', width=1000)
+            self.f.flush()
+            self.count += 1
+
+    def close(self):
+        with self.lock:
+            self.f.close()
+
+#------------------------------------------------------------------------------------
+# Stands in for a PlanWriter where entries should be handed back to the caller
+# (e.g. a sharded sweep worker, which stores them in the work queue) instead of
+# going straight to a file.
+#------------------------------------------------------------------------------------
+class PlanCollector(object):
+
+    def __init__(self):
+        self.entries = []
+        self.count = 0
+        self.path = None
+
+    def add(self, entry):
+        self.entries.append(entry)
+        self.count += 1
+
+    def take(self):
+        entries, self.entries = self.entries, []
+        return entries
+
+    def close(self):
+        pass
+
+def load_plan(path):
+    f = open(path)
+    try:
+        entries = yaml.safe_load(f)
+    finally:
+        f.close()
+    if entries is None:
+        return []
+    if not isinstance(entries, list):
+        raise PlanError('%s: not an action plan' % path)
+    return entries
+
+#------------------------------------------------------------------------------------
+# Label actions are coalesced: rather than one request per newlabel/unlabel, we
+# work out the label set the item should end up with, and replace its labels
+# with that in a single call. Actions are taken in order, so a later action wins
+# over an earlier one on the same label, and anything that cancels out or is
+# already the case costs nothing.
+#------------------------------------------------------------------------------------
+def net_labels(labels, actions):
+    labels = list(labels)
+    for action in actions:
+        kind, name = action.split(': ', 1)
+        if (kind == 'unlabel') and (name in labels):
+            labels.remove(name)
+        elif (kind == 'newlabel') and (name not in labels):
+            labels.append(name)
+    return labels
+
+# The label changes that actually need making to get from labels to target, as
+# actions.
+def label_changes(labels, target):
+    changes = ['unlabel: ' + name for name in labels if name not in target]
+    changes += ['newlabel: ' + name for name in target if name not in labels]
+    return changes
+
+#------------------------------------------------------------------------------------
+# An item's labels as they are now. The PUT below replaces the whole set, so it
+# has to start from this, not from labels fetched earlier in the sweep: anything
+# a human changed since then would quietly be undone.
+#------------------------------------------------------------------------------------
+def current_labels(gh, issue_url):
+    r = gh.get(issue_url)
+    r.raise_for_status()
+    return [label['name'] for label in r.json()['labels']]
+
+# Replace an item's labels wholesale; this is a PUT, so it's safe to retry.
+def replace_labels(gh, labels_url, labels):
+    return gh.put(labels_url.split('{')[0], data=json.dumps(labels))
+
+#------------------------------------------------------------------------------------
+# Apply one plan entry. Returns a list of what was done (or skipped); raises on
+# anything that went wrong, having done whatever it safely could.
+#------------------------------------------------------------------------------------
+def apply_entry(gh, ghuser, entry):
+    issue = gh.get(entry['issue_url'])
+    issue.raise_for_status()
+    issue = issue.json()
+    if issue['state'] != 'open':
+        return ['skipped: no longer open']
+
+    # Everything said since the plan was made.
+    r = gh.get(issue['comments_url'], params={'since': entry['updated_at'], 'per_page': 100})
+    r.raise_for_status()
+    since = [c for c in r.json() if c['created_at'] > entry['updated_at']]
+    if [c for c in since if c['user']['login'] != ghuser]:
+        return ['skipped: commented on since the plan was made']
+    posted = set(c['body'] for c in since)
+
+    labels = [label['name'] for label in issue['labels']]
+    target = net_labels(labels, entry['actions'])
+    done = label_changes(labels, target)
+    if done:
+        r = replace_labels(gh, issue['labels_url'], target)
+        r.raise_for_status()
+
+    for action in entry['actions']:
+        kind, name = action.split(': ', 1)
+
+        if kind == 'boilerplate':
+            body = entry['comments'].get(name)
+            if body is None:
+                done.append('skipped %s: no text for it' % action)
+            elif body not in posted:
+                r = gh.post(issue['comments_url'], data=json.dumps({'body': body}))
+                r.raise_for_status()
+                posted.add(body)
+                done.append(action)
+
+        elif kind not in ('unlabel', 'newlabel'):
+            done.append('skipped %s: not something we apply' % action)
+
+    return done
+
+#------------------------------------------------------------------------------------
+# apply_plan: carry out a plan with up to `workers` items in flight. A failure on
+# one item doesn't stop the others; a failed item is retried (from the top,
+# which is safe, see above) up to `retries` more times. Returns the number of
+# items that still failed in the end.
+#------------------------------------------------------------------------------------
+def apply_plan(gh, ghuser, entries, workers=8, retries=2, backoff=2):
+
+    def attempt(entry):
+        for i in range(retries + 1):
+            try:
+                return entry, apply_entry(gh, ghuser, entry), None
+            except Exception as e:
+                error = e
+                if i < retries:
+                    time.sleep(random.uniform(0, backoff * (2 ** i)))
+        return entry, None, error
+
+    failed = 0
+    for entry, done, error in ordered_map(attempt, entries, workers=workers):
+        print " "
+        print entry['repo'], entry['number'], '---', entry['html_url']
+        if error is not None:
+            failed += 1
+            print "  FAILED:", error
+        elif not done:
+            print "  Nothing left to do"
+        else:
+            for action in done:
+                print "  ", action
+
+    print " "
+    print "Applied plan:", len(entries), "items,", failed, "failed"
+    return failed
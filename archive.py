@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------
+# Per-run archives of the raw API data triage saw.
+#
+# With --debug (or --archive), every item's raw JSON (the pull, the files in its
+# diff, the issue, each page of its comments as it's fetched, or the node a
+# GraphQL batch returned for it) goes into one archive file for the run,
+# instead of a loose pretty-printed file per item in /tmp. An item can have
+# several records; reading it back merges them. The archive is append-only JSON lines,
+# with each record compressed as a gzip member of its own: the file as a whole
+# is an ordinary .jsonl.gz (zcat reads it), and any one record can be read
+# without unpacking the others. Next to it, a small index (ARCHIVE.idx) records
+# where each item's record starts and how long it is, so one item's raw data
+# can be pulled out of a big sweep's archive straight away.
+#
+# Records are serialized, compressed and written by a background thread, so
+# archiving doesn't hold up fetching or triage; only close() waits for it.
+#
+# To look at an archive:
+#
+#   python archive.py ARCHIVE               # list what's in it
+#   python archive.py ARCHIVE NUMBER        # print one item's raw data
+#------------------------------------------------------------------------------------
+
+import json, os, threading, time, zlib
+from Queue import Queue
+
+# zlib's window bits for gzip framing.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def index_path(path):
+    return path + '.idx'
+
+#------------------------------------------------------------------------------------
+# A default archive path for a run: one new file per run, under the statedir,
+# so nothing collides between repos, bots or runs.
+#------------------------------------------------------------------------------------
+def run_archive_path(statedir, bot):
+    directory = os.path.join(statedir, 'archive')
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    return os.path.join(directory, '%s-%s-%d.jsonl.gz' % (bot, time.strftime('%Y%m%d-%H%M%S'), os.getpid()))
+
+def compress(record):
+    c = zlib.compressobj(6, zlib.DEFLATED, GZIP_WBITS)
+    return c.compress(json.dumps(record, separators=(',', ':')) + '\n') + c.flush()
+
+
+class ArchiveWriter(object):
+
+    def __init__(self, path, backlog=1000):
+        self.path = path
+        self.f = open(path, 'ab')
+        self.index = open(index_path(path), 'a')
+        self.offset = self.f.tell()
+        self.count = 0
+        self.error = None
+        # Bounded, so a writer that can't keep up slows fetching down rather
+        # than letting raw JSON pile up in memory.
+        self.queue = Queue(backlog)
+        self.thread = threading.Thread(target=self.work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    #--------------------------------------------------------------------------------
+    # Queue up one item's raw data. Safe to call from any thread.
+    #--------------------------------------------------------------------------------
+    def add(self, repo, number, **data):
+        record = dict(data, repo=repo, number=int(number), archived_at=time.time())
+        self.queue.put(record)
+
+    def work(self):
+        while True:
+            record = self.queue.get()
+            try:
+                if record is None:
+                    return
+                try:
+                    self.write(record)
+                except Exception as e:
+                    # Losing the archive mustn't stop triage; say so once.
+                    if self.error is None:
+                        print "WARN: archiving to", self.path, "failed:", e
+                    self.error = e
+            finally:
+                self.queue.task_done()
+
+    def write(self, record):
+        data = compress(record)
+        self.f.write(data)
+        self.f.flush()
+        self.index.write(json.dumps([record['repo'], record['number'], self.offset, len(data)]) + '\n')
+        self.index.flush()
+        self.offset += len(data)
+        self.count += 1
+
+    #--------------------------------------------------------------------------------
+    # Wrap an item's comment listing get_page, so that every page it fetches is
+    # archived too, as comment_pages[N] (or, for a listing of only the comments
+    # since some time, comment_pages['N since TIME']).
+    #--------------------------------------------------------------------------------
+    def comment_pages(self, repo, number, get_page, since=None):
+        def get_archived_page(page):
+            r = get_page(page)
+            key = str(page)
+            if since:
+                key += ' since ' + since
+            self.add(repo, number, comment_pages={key: r.json()})
+            return r
+        return get_archived_page
+
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+        self.f.close()
+        self.index.close()
+
+#------------------------------------------------------------------------------------
+# Reading archives back.
+#------------------------------------------------------------------------------------
+def load_index(path):
+    entries = []
+    f = open(index_path(path))
+    try:
+        for line in f:
+            if line.strip():
+                entries.append(json.loads(line))
+    finally:
+        f.close()
+    return entries
+
+def read_record(path, offset, length):
+    f = open(path, 'rb')
+    try:
+        f.seek(offset)
+        return json.loads(zlib.decompress(f.read(length), GZIP_WBITS))
+    finally:
+        f.close()
+
+#------------------------------------------------------------------------------------
+# An item's raw data, by number (and repo, if the archive has more than one),
+# with all its records merged: the comment pages are collected together, and
+# for anything else archived more than once in the run, the latest wins.
+# Returns None if it isn't in the archive.
+#------------------------------------------------------------------------------------
+def load_item(path, number, repo=None):
+    item = None
+    for entry_repo, entry_number, offset, length in load_index(path):
+        if (entry_number == int(number)) and (repo is None or entry_repo == repo):
+            record = read_record(path, offset, length)
+            if item is None:
+                item = {'comment_pages': {}}
+            item['comment_pages'].update(record.pop('comment_pages', {}))
+            item.update(record)
+    if (item is not None) and not item['comment_pages']:
+        del item['comment_pages']
+    return item
+
+if __name__ == '__main__':
+    import argparse, sys
+    parser = argparse.ArgumentParser(description='Look inside a triage run archive.')
+    parser.add_argument("archive", type=str, help="Archive file (.jsonl.gz)")
+    parser.add_argument("number", type=int, nargs='?', help="Print this item's raw data")
+    parser.add_argument('--repo', type=str, help="Repo the item is in, if the archive covers several")
+    args=parser.parse_args()
+
+    if args.number is None:
+        items = []
+        sizes = {}
+        for repo, number, offset, length in load_index(args.archive):
+            if (repo, number) not in sizes:
+                items.append((repo, number))
+                sizes[(repo, number)] = [0, 0]
+            sizes[(repo, number)][0] += 1
+            sizes[(repo, number)][1] += length
+        for repo, number in items:
+            print repo, number, "(%d records, %d bytes)" % tuple(sizes[(repo, number)])
+    else:
+        record = load_item(args.archive, args.number, args.repo)
+        if record is None:
+            print "Not in the archive:", args.number
+            sys.exit(1)
+        print json.dumps(record, ensure_ascii=True, indent=4, separators=(',', ': '), sort_keys=True)
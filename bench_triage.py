@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------
+# Benchmark for the PR triage rules (prrules.decide).
+#
+# Builds synthetic PR queues in memory and times how many triage decisions per
+# second the rules can make over them, with no network involved. Each suite is a
+# differently-shaped queue:
+#
+#   mixed:     random labels, files and between 0 and --max-comments comments
+#   chatty:    every PR has --max-comments comments, all from bystanders, so the
+#              comment walk never finds a reason to stop early (worst case)
+#   timeouts:  every PR ends on an old bot comment (the warning paths)
+#
+# We also report how far one pass pushed the process's peak memory (where the
+# resource module exists).
+#------------------------------------------------------------------------------------
+
+import argparse, random, time, gc
+import prrules
+from diffscan import DiffFile
+from prsnapshot import PullSnapshot, comment, interned
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+botlist = ['gregdek','robynbergeron']
+
+LABELS = ['community_review', 'core_review', 'needs_revision', 'needs_info',
+          'needs_rebase', 'shipit', 'new_plugin', 'P3', 'P4', 'cloud', 'bug_report']
+TOPDIRS = ['cloud', 'network', 'windows', 'system', 'files', 'packaging']
+USERS = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+PHRASES = ['shipit', 'needs_revision', 'ready_for_review', 'pending', 'thanks!',
+           'any update on this?', 'works for me']
+
+def timestamp(t):
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.localtime(t))
+
+#------------------------------------------------------------------------------------
+# Synthetic PRs. Maintainers are drawn from the same pool as submitters and
+# commenters, so every branch of the rules gets exercised.
+#------------------------------------------------------------------------------------
+def make_comment(rng, now, user=None, days_old=None, body=None):
+    if user is None:
+        user = rng.choice(USERS + botlist)
+    if days_old is None:
+        days_old = rng.uniform(0, 60)
+    if body is None:
+        body = rng.choice(PHRASES)
+    return comment({'user': {'login': user}, 'body': body, 'created_at': timestamp(now - days_old * 86400)})
+
+def make_pr(rng, number, now, ncomments, suite):
+    files = []
+    for i in range(rng.randint(1, 4)):
+        path = '%s/module_%d_%d.py' % (rng.choice(TOPDIRS), number, i)
+        files.append(DiffFile(path, new_file=(rng.random() < 0.2)))
+    maintainers = rng.sample(USERS + ['ansible'], rng.randint(1, 3))
+    submitter = rng.choice(USERS)
+
+    if suite == 'chatty':
+        comments = [make_comment(rng, now, user='bystander%d' % i) for i in range(ncomments)]
+    else:
+        comments = [make_comment(rng, now) for i in range(ncomments)]
+        if suite == 'timeouts':
+            comments.append(make_comment(rng, now, user=botlist[0], days_old=rng.uniform(15, 40)))
+
+    snapshot = PullSnapshot(
+        number=number,
+        labels=[interned(label) for label in rng.sample(LABELS, rng.randint(0, 3))],
+        files=tuple(files),
+        submitter=interned(submitter),
+        base_ref=rng.choice(['devel', 'devel', 'devel', 'stable-2.0']),
+        mergeable=rng.choice([True, True, False, None]),
+        comments=comments,
+    )
+    return snapshot, maintainers
+
+def make_queue(suite, prs, max_comments, seed, now):
+    rng = random.Random(seed)
+    queue = []
+    for number in range(1, prs + 1):
+        if suite == 'chatty':
+            ncomments = max_comments
+        else:
+            ncomments = rng.randint(0, max_comments)
+        queue.append(make_pr(rng, number, now, ncomments, suite))
+    return queue
+
+#------------------------------------------------------------------------------------
+# One pass of the rules over a whole queue. A PR the rules refuse to triage
+# (MissingMaintainers) still counts as a decision.
+#------------------------------------------------------------------------------------
+def run_queue(queue, now, verbose=False):
+    for snapshot, maintainers in queue:
+        try:
+            prrules.decide(snapshot, maintainers, botlist, now, verbose=verbose)
+        except prrules.MissingMaintainers:
+            pass
+
+def bench(queue, now, repeat, verbose=False):
+    best = None
+    gc.collect()
+    for i in range(repeat):
+        start = time.time()
+        run_queue(queue, now, verbose)
+        elapsed = time.time() - start
+        if (best is None) or (elapsed < best):
+            best = elapsed
+    return best
+
+#------------------------------------------------------------------------------------
+# How much one pass raised the peak resident size (in KiB, as Linux reports
+# ru_maxrss; None without the resource module). The peak only ever goes up, so
+# only the first pass over a queue moves it much.
+#------------------------------------------------------------------------------------
+def max_rss():
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def rss_growth(queue, now, verbose=False):
+    if resource is None:
+        return None
+    gc.collect()
+    rss_before = max_rss()
+    run_queue(queue, now, verbose)
+    return max_rss() - rss_before
+
+#------------------------------------------------------------------------------------
+# Here's the main flow.
+#------------------------------------------------------------------------------------
+parser = argparse.ArgumentParser(description='Benchmark the PR triage rules on synthetic queues.')
+parser.add_argument("--prs", type=int, default=10000, help="PRs per queue (default 10000)")
+parser.add_argument("--max-comments", type=int, default=500, help="Most comments on one PR (default 500)")
+parser.add_argument("--repeat", type=int, default=3, help="Passes over each queue; the best is reported (default 3)")
+parser.add_argument("--seed", type=int, default=1, help="Random seed, so runs are comparable (default 1)")
+parser.add_argument("--suite", action="append", choices=['mixed', 'chatty', 'timeouts'],
+                    help="Suite to run (repeatable; default all)")
+parser.add_argument("--verbose", action="store_true",
+                    help="Have the rules build their verbose-mode notes too, as prbot -v does")
+args=parser.parse_args()
+
+suites = args.suite or ['mixed', 'chatty', 'timeouts']
+now = time.time()
+
+print "Triage rules benchmark:", args.prs, "PRs per queue, up to", args.max_comments, "comments each"
+
+for suite in suites:
+    queue = make_queue(suite, args.prs, args.max_comments, args.seed, now)
+    ncomments = sum(len(snapshot.comments) for snapshot, maintainers in queue)
+
+    # Measured before the timed passes, so the first pass's growth shows.
+    rss = rss_growth(queue, now, args.verbose)
+
+    elapsed = bench(queue, now, args.repeat, args.verbose)
+    print " "
+    print suite + ":"
+    print "  comments in queue:  ", ncomments
+    print "  best pass:           %.3f s" % elapsed
+    print "  decisions/sec:       %.0f" % (len(queue) / elapsed)
+    print "  usec per decision:   %.1f" % (elapsed * 1e6 / len(queue))
+    if rss is not None:
+        print "  peak RSS growth:    ", rss, "KiB"
@@ -0,0 +1,133 @@
+#------------------------------------------------------------------------------------
+# Record/replay "cassettes" of GitHub traffic.
+#
+# In record mode, every HTTP exchange the client makes during a run is written to
+# a gzipped JSON-lines file. In replay mode the client never touches the network;
+# every request is answered from the cassette instead. That lets us re-run a
+# production-sized sweep offline, as many times as we like, and get the same
+# answers each time, which is what we want when profiling the triage pipeline.
+#
+# The first line of a cassette describes it (including when it was recorded, so
+# replays can judge comment ages as of the recording). Every other line is one
+# exchange.
+#------------------------------------------------------------------------------------
+
+import base64, gzip, json, threading, time
+from collections import deque
+import requests
+from ghcache import build_response
+
+CASSETTE_VERSION = 1
+
+
+class CassetteError(Exception):
+    pass
+
+#------------------------------------------------------------------------------------
+# Requests are matched on method, full url (query string included) and body.
+#------------------------------------------------------------------------------------
+def request_key(method, url, params=None, data=None):
+    url = requests.Request(method, url, params=params).prepare().url
+    if data is not None and not isinstance(data, basestring):
+        data = json.dumps(data, sort_keys=True)
+    return '%s %s %s' % (method.upper(), url, data or '')
+
+def encode_body(content):
+    try:
+        return {'text': content.decode('utf-8')}
+    except UnicodeDecodeError:
+        return {'base64': base64.b64encode(content)}
+
+def decode_body(entry):
+    if 'base64' in entry:
+        return base64.b64decode(entry['base64'])
+    return entry['text'].encode('utf-8')
+
+
+class Cassette(object):
+
+    def __init__(self, path, mode):
+        if mode not in ('record', 'replay'):
+            raise ValueError('cassette mode must be record or replay, not %r' % mode)
+        self.path = path
+        self.mode = mode
+        self.lock = threading.Lock()
+
+        if mode == 'record':
+            self.recorded_at = time.time()
+            self.f = gzip.open(path, 'wb')
+            self.write({'version': CASSETTE_VERSION, 'recorded_at': self.recorded_at})
+        else:
+            self.f = None
+            self.exchanges = {}
+            self.load()
+
+    @property
+    def replaying(self):
+        return self.mode == 'replay'
+
+    def write(self, entry):
+        self.f.write(json.dumps(entry, separators=(',', ':')) + '\n')
+
+    #--------------------------------------------------------------------------------
+    # Read a whole cassette in. Identical requests are answered in the order they
+    # were recorded; once we run out, the last answer keeps being used.
+    #--------------------------------------------------------------------------------
+    def load(self):
+        f = gzip.open(self.path, 'rb')
+        try:
+            header = json.loads(f.readline())
+            if header.get('version') != CASSETTE_VERSION:
+                raise CassetteError('%s: unsupported cassette version %r' % (self.path, header.get('version')))
+            self.recorded_at = header['recorded_at']
+            for line in f:
+                entry = json.loads(line)
+                self.exchanges.setdefault(entry['key'], deque()).append(entry)
+        finally:
+            f.close()
+
+    #--------------------------------------------------------------------------------
+    # Record mode: note down a real exchange. Reading r.content here means a
+    # streamed response is buffered, which is fine for a recording run.
+    #--------------------------------------------------------------------------------
+    def record(self, method, url, r, params=None, data=None, **ignored):
+        entry = {
+            'key': request_key(method, url, params, data),
+            'url': r.url,
+            'status': r.status_code,
+            'headers': dict(r.headers),
+            'encoding': r.encoding,
+        }
+        entry.update(encode_body(r.content))
+        with self.lock:
+            self.write(entry)
+
+    #--------------------------------------------------------------------------------
+    # Replay mode: answer a request from the cassette. Reads we never recorded
+    # are an error; writes we never recorded are acknowledged, but go nowhere.
+    #--------------------------------------------------------------------------------
+    def play(self, method, url, params=None, data=None, **ignored):
+        key = request_key(method, url, params, data)
+        with self.lock:
+            queue = self.exchanges.get(key)
+            if queue:
+                entry = queue[0]
+                if len(queue) > 1:
+                    queue.popleft()
+            else:
+                entry = None
+
+        if entry is None:
+            if method.upper() == 'GET':
+                raise CassetteError('%s: no recorded response for %s' % (self.path, key))
+            print "REPLAY: not sending", method.upper(), url
+            return build_response(url, 200, {}, 'utf-8', '{}')
+
+        return build_response(entry['url'], entry['status'], entry['headers'],
+                              entry['encoding'], decode_body(entry))
+
+    def close(self):
+        with self.lock:
+            if self.f is not None:
+                self.f.close()
+                self.f = None
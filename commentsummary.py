@@ -0,0 +1,106 @@
+#------------------------------------------------------------------------------------
+# Incremental comment summaries.
+#
+# Triage walks an item's comments newest-first and stops at the first one that
+# matters: the newest comment from a bot, a maintainer or the submitter. That is
+# always somebody's *latest* comment, so instead of the whole thread we keep, per
+# item, the latest comment from each commenter. We also keep the newest comment
+# naming a file ("[module: ...]" or "[filename: ...]"; see maintainers.mentions),
+# and the newest bot comment mentioning each @user (issuebot looks for those to
+# see who has been pinged). Handing that handful of comments, in order, to the
+# triage rules gives the same answers as the whole thread.
+#
+# The summary remembers the newest comment time it has seen (the cursor). Next
+# time round we only ask GitHub for comments since then, using the comments
+# API's `since` parameter. So a long-running PR with hundreds of comments costs
+# one small request to re-triage, rather than a page of comments per 30.
+#
+# Comments that are deleted (rather than edited) after we've seen them aren't
+# noticed; GitHub's `since` has no way of telling us about them.
+#------------------------------------------------------------------------------------
+
+import re
+import maintainers
+from fetchpool import paged_listing
+
+SUMMARY_VERSION = 2
+
+MENTION = re.compile(r'@([A-Za-z0-9][A-Za-z0-9-]*)')
+
+def empty_summary():
+    return {'version': SUMMARY_VERSION, 'cursor': None, 'latest': {}, 'module': None, 'pings': {}}
+
+def compact(comment):
+    return {'id': comment.get('id'),
+            'user': {'login': comment['user']['login']},
+            'body': comment['body'],
+            'created_at': comment['created_at'],
+            'updated_at': comment.get('updated_at', comment['created_at'])}
+
+def comment_key(comment):
+    if comment.get('id') is not None:
+        return comment['id']
+    return '%s %s' % (comment['created_at'], comment['user']['login'])
+
+# Keep `comment` in place of `kept` if it's newer, or is the same comment edited.
+def newer(comment, kept):
+    if kept is None:
+        return True
+    if comment_key(comment) == comment_key(kept):
+        return True
+    return comment['created_at'] > kept['created_at']
+
+#------------------------------------------------------------------------------------
+# Fold a batch of comments (in any order, and possibly ones we've already seen)
+# into a summary.
+#------------------------------------------------------------------------------------
+def merge(summary, comments, botlist):
+    for comment in comments:
+        comment = compact(comment)
+        login = comment['user']['login']
+
+        if newer(comment, summary['latest'].get(login)):
+            summary['latest'][login] = comment
+        if maintainers.mentions(comment['body']) and newer(comment, summary['module']):
+            summary['module'] = comment
+        if login in botlist:
+            for mentioned in MENTION.findall(comment['body']):
+                if newer(comment, summary['pings'].get(mentioned)):
+                    summary['pings'][mentioned] = comment
+
+        if (summary['cursor'] is None) or (comment['updated_at'] > summary['cursor']):
+            summary['cursor'] = comment['updated_at']
+    return summary
+
+#------------------------------------------------------------------------------------
+# The comments a summary stands for, oldest first, like the comments API.
+#------------------------------------------------------------------------------------
+def summary_comments(summary):
+    kept = {}
+    for comment in summary['latest'].values() + summary['pings'].values() + [summary['module']]:
+        if comment is not None:
+            kept[comment_key(comment)] = comment
+    return sorted(kept.values(), key=lambda comment: comment['created_at'])
+
+#------------------------------------------------------------------------------------
+# fetch_comments: bring an item's stored summary up to date and return its
+# comments. With no summary stored yet, this reads the whole thread (every
+# page of it) once. Given an archive, the pages fetched go into it.
+#------------------------------------------------------------------------------------
+def fetch_comments(gh, state, repo, number, comments_url, botlist, archive=None):
+    summary = state.get_summary(repo, number)
+    if (summary is None) or (summary.get('version') != SUMMARY_VERSION):
+        summary = empty_summary()
+
+    params = {'per_page': 100}
+    if summary['cursor']:
+        params['since'] = summary['cursor']
+
+    def get_page(page):
+        return gh.get(comments_url, params=dict(params, page=page))
+    if archive is not None:
+        get_page = archive.comment_pages(repo, number, get_page, since=summary['cursor'])
+
+    merge(summary, paged_listing(get_page, workers=1), botlist)
+    state.save_summary(repo, number, summary)
+    return summary_comments(summary)
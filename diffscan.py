@@ -0,0 +1,98 @@
+#------------------------------------------------------------------------------------
+# Streaming scanner for unified diffs (as served by a PR's diff_url).
+#
+# Triage only needs to know which files a PR touches, and whether each one is new
+# or deleted, so we read the diff a line at a time as it comes off the wire and
+# only look at the per-file headers. The diff itself is never held in memory, which
+# matters for PRs that vendor large files.
+#------------------------------------------------------------------------------------
+
+
+class DiffFile(object):
+    __slots__ = ('path', 'new_file', 'deleted')
+
+    def __init__(self, path, new_file=False, deleted=False):
+        self.path = path
+        self.new_file = new_file
+        self.deleted = deleted
+
+    def __repr__(self):
+        return 'DiffFile(%r, new_file=%r, deleted=%r)' % (self.path, self.new_file, self.deleted)
+
+#------------------------------------------------------------------------------------
+# Pull the b/ path out of a "diff --git a/foo b/foo" line. Paths with spaces make
+# this ambiguous, which is why the "+++ b/foo" line (if there is one) wins later.
+#------------------------------------------------------------------------------------
+def git_header_path(line):
+    rest = line[len('diff --git '):]
+    if ' b/' in rest:
+        return rest.split(' b/', 1)[1]
+    return rest.split(' ')[-1]
+
+#------------------------------------------------------------------------------------
+# scan_diff: walk the lines of a diff and return a DiffFile for every file it
+# touches, in diff order. Only header lines (between a "diff --git" line and the
+# first hunk) are inspected, so file content that happens to look like
+# "--- /dev/null" can't fool us.
+#------------------------------------------------------------------------------------
+def scan_diff(lines):
+    files = []
+    current = None
+    in_header = False
+
+    for line in lines:
+        if isinstance(line, str):
+            line = line.decode('utf-8', 'replace')
+        line = line.rstrip('\r\n')
+
+        if line.startswith('diff --git '):
+            current = DiffFile(git_header_path(line))
+            files.append(current)
+            in_header = True
+            continue
+
+        if not in_header:
+            continue
+
+        if line.startswith('@@'):
+            in_header = False
+        elif line.startswith('new file mode') or line == '--- /dev/null':
+            current.new_file = True
+        elif line.startswith('deleted file mode') or line == '+++ /dev/null':
+            current.deleted = True
+        elif line.startswith('+++ b/'):
+            current.path = line[len('+++ b/'):]
+        elif line.startswith('rename to '):
+            current.path = line[len('rename to '):]
+
+    return files
+
+#------------------------------------------------------------------------------------
+# Split a stream of chunks into lines (without their line endings), as
+# requests' iter_lines does.
+#------------------------------------------------------------------------------------
+def chunk_lines(chunks):
+    pending = ''
+    for chunk in chunks:
+        lines = (pending + chunk).split('\n')
+        pending = lines.pop()
+        for line in lines:
+            yield line
+    if pending:
+        yield pending
+
+#------------------------------------------------------------------------------------
+# Scan a streamed requests response (fetched with stream=True) without ever
+# holding the whole body. Given read, read(n) is called with the size of each
+# chunk as it comes in, so whoever's counting knows how big the body was.
+#------------------------------------------------------------------------------------
+def scan_response(r, chunk_size=16384, read=None):
+    def chunks():
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            if read is not None:
+                read(len(chunk))
+            yield chunk
+    try:
+        return scan_diff(chunk_lines(chunks()))
+    finally:
+        r.close()
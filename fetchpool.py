@@ -0,0 +1,139 @@
+#------------------------------------------------------------------------------------
+# Bounded-concurrency fetch helpers for the triage bots.
+#
+# Nearly all of a sweep is spent waiting on GitHub, so we hand the fetching to a
+# small pool of worker threads and keep the triage decisions themselves in the
+# main thread, in the original order.
+#------------------------------------------------------------------------------------
+
+import time, urlparse
+from collections import deque
+from multiprocessing.pool import ThreadPool
+
+# AsyncResult.get() without a timeout can't be interrupted with ^C on python 2,
+# so we always wait with a (very long) timeout instead.
+WAIT_FOREVER = 60 * 60 * 24
+
+#------------------------------------------------------------------------------------
+# ordered_map: like map(), but calls func on up to `workers` items at once.
+# Results are yielded in the same order as the input items, and at most
+# `window` results are held in memory ahead of the consumer, so a slow consumer
+# (e.g. one waiting on raw_input) doesn't make us buffer the whole queue. The
+# first `window` items are handed to the pool as soon as ordered_map is called,
+# not when the first result is asked for, so the caller can get on with
+# something else (e.g. entries it already has) while they're fetched.
+#------------------------------------------------------------------------------------
+def ordered_map(func, items, workers=8, window=None):
+    if workers <= 1:
+        return (func(item) for item in items)
+
+    if window is None:
+        window = workers * 2
+
+    pool = ThreadPool(workers)
+    items = iter(items)
+    pending = deque()
+
+    def fill():
+        for item in items:
+            pending.append(pool.apply_async(func, (item,)))
+            if len(pending) >= window:
+                return
+
+    def results():
+        try:
+            fill()
+            # Primed up to here below, so that the first items are under way
+            # straight away, and closing (or dropping) the results shuts the
+            # pool down, even if none were ever asked for.
+            yield
+            while pending:
+                result = pending.popleft().get(WAIT_FOREVER)
+                fill()
+                yield result
+        finally:
+            pool.terminate()
+
+    gen = results()
+    next(gen)
+    return gen
+
+#------------------------------------------------------------------------------------
+# Work out how many listing pages there are from the Link header. GitHub leaves
+# the 'last' link out entirely when everything fits on one page.
+#------------------------------------------------------------------------------------
+def last_page(response):
+    if 'last' not in response.links:
+        return 1
+    query = urlparse.urlparse(response.links['last']['url']).query
+    return int(urlparse.parse_qs(query)['page'][0])
+
+#------------------------------------------------------------------------------------
+# paged_listing: stream every entry of a paginated listing. get_page(n) must
+# return the response for page n. Page 1 tells us the page count; the remaining
+# pages are then fetched concurrently, starting before page 1's entries are
+# handed out, and entries are handed out in page order as soon as each page (and
+# the ones before it) has arrived.
+#------------------------------------------------------------------------------------
+def paged_listing(get_page, workers=8):
+    first = get_page(1)
+    rest = ordered_map(get_page, range(2, last_page(first) + 1), workers=workers)
+    try:
+        for entry in first.json():
+            yield entry
+
+        for r in rest:
+            for entry in r.json():
+                yield entry
+    finally:
+        rest.close()
+
+#------------------------------------------------------------------------------------
+# ReverseListing: a paginated listing (such as an item's comments) that can be
+# walked backwards, newest entry first, a page at a time. reversed() on it
+# starts from the last page (found through the Link header on page 1), and only
+# fetches an earlier page if the walk gets that far, so a walk that stops early
+# usually costs a page or two however long the listing is. The last page is
+# fetched up front, so that this can be built in a fetch worker and walked in
+# the main thread without any more waiting in the common case. Pages are kept
+# once fetched, so it can be walked more than once. convert(response) turns a
+# page's response into its list of entries; by default, the decoded JSON. A page
+# GitHub won't give us raises (requests' HTTPError) rather than being decoded,
+# and `fetching` adds up the time spent on pages fetched during walks.
+#------------------------------------------------------------------------------------
+class ReverseListing(object):
+
+    def __init__(self, get_page, convert=None):
+        self.get_page = get_page
+        self.convert = convert or (lambda r: r.json())
+        self.fetching = 0.0
+        first = get_page(1)
+        first.raise_for_status()
+        self.last = last_page(first)
+        self.pages = {1: self.convert(first)}
+        if self.last > 1:
+            self.pages[self.last] = self.fetch(self.last)
+
+    def fetch(self, n):
+        r = self.get_page(n)
+        r.raise_for_status()
+        return self.convert(r)
+
+    def page(self, n):
+        if n not in self.pages:
+            started = time.time()
+            try:
+                self.pages[n] = self.fetch(n)
+            finally:
+                self.fetching += time.time() - started
+        return self.pages[n]
+
+    def __reversed__(self):
+        for n in range(self.last, 0, -1):
+            for entry in reversed(self.page(n)):
+                yield entry
+
+    def __iter__(self):
+        for n in range(1, self.last + 1):
+            for entry in self.page(n):
+                yield entry
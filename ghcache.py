@@ -0,0 +1,113 @@
+#------------------------------------------------------------------------------------
+# An on-disk HTTP cache for GitHub responses, so repeated sweeps can use
+# conditional requests.
+#
+# For every successful GET we remember the body along with its ETag and
+# Last-Modified headers. Next time the client sends If-None-Match and
+# If-Modified-Since, and if GitHub answers 304 Not Modified we serve the body from
+# here. 304s don't count against the rate limit, so re-sweeping a quiet queue is
+# nearly free.
+#------------------------------------------------------------------------------------
+
+import json, os, sqlite3, threading
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+
+#------------------------------------------------------------------------------------
+# Build a requests Response from stored parts, for anything that answers a request
+# without going to the network.
+#------------------------------------------------------------------------------------
+def build_response(url, status_code, headers, encoding, content):
+    r = Response()
+    r.status_code = status_code
+    r.url = url
+    r.headers = CaseInsensitiveDict(headers)
+    r.encoding = encoding
+    r._content = content
+    r._content_consumed = True
+    return r
+
+
+class ResponseCache(object):
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS responses (
+                               url TEXT PRIMARY KEY,
+                               etag TEXT,
+                               last_modified TEXT,
+                               headers TEXT,
+                               encoding TEXT,
+                               body BLOB)''')
+        self.db.commit()
+        self.hits = 0
+        self.misses = 0
+
+    #--------------------------------------------------------------------------------
+    # The headers to make a GET conditional, if we've seen this url before.
+    #--------------------------------------------------------------------------------
+    def conditional_headers(self, url):
+        with self.lock:
+            row = self.db.execute('SELECT etag, last_modified FROM responses WHERE url = ?',
+                                  (url,)).fetchone()
+        headers = {}
+        if row:
+            if row[0]:
+                headers['If-None-Match'] = row[0]
+            if row[1]:
+                headers['If-Modified-Since'] = row[1]
+        return headers
+
+    #--------------------------------------------------------------------------------
+    # Remember a 200 response, as long as it carries something we can validate
+    # it with next time.
+    #--------------------------------------------------------------------------------
+    def store(self, url, r):
+        etag = r.headers.get('ETag')
+        last_modified = r.headers.get('Last-Modified')
+        if r.status_code != 200 or not (etag or last_modified):
+            return
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)',
+                            (url, etag, last_modified, json.dumps(dict(r.headers)),
+                             r.encoding, sqlite3.Binary(r.content)))
+            self.db.commit()
+
+    #--------------------------------------------------------------------------------
+    # Count a GET the cache couldn't answer (the client calls this; storing the
+    # response is a separate matter, and doesn't always happen).
+    #--------------------------------------------------------------------------------
+    def miss(self):
+        with self.lock:
+            self.misses += 1
+
+    #--------------------------------------------------------------------------------
+    # Turn a 304 back into the 200 we stored, so callers can't tell the
+    # difference. Returns None if we somehow don't have it any more.
+    #--------------------------------------------------------------------------------
+    def load(self, url, r304):
+        with self.lock:
+            row = self.db.execute('SELECT headers, encoding, body FROM responses WHERE url = ?',
+                                  (url,)).fetchone()
+            if not row:
+                return None
+            self.hits += 1
+
+        r = build_response(url, 200, json.loads(row[0]), row[1], bytes(row[2]))
+        # GitHub sends fresh rate limit headers even on a 304; keep those.
+        for name, value in r304.headers.items():
+            if name.lower().startswith('x-ratelimit'):
+                r.headers[name] = value
+        r.request = r304.request
+        r.from_cache = True
+        return r
+
+    def close(self):
+        with self.lock:
+            self.db.close()
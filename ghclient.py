@@ -0,0 +1,220 @@
+#------------------------------------------------------------------------------------
+# A small GitHub API client shared by prbot and issuebot.
+#
+# Every request goes through a requests.Session, so we keep connections (and TLS
+# handshakes) alive between calls instead of opening a new one each time. Each
+# thread gets its own session, so the client can be used from the fetch pools.
+# Requests get real connect/read deadlines, and failures are retried a bounded
+# number of times with exponential backoff and jitter. Given a ResponseCache (see
+# ghcache.py), GETs are made conditional and 304s are answered from the cache.
+# Hitting a rate limit means pausing until it resets rather than failing, and
+# given a RateLimiter (see ratelimit.py), requests also wait for their share of
+# the rate limit budget. Given a Cassette (see cassette.py), traffic is either
+# recorded to it or replayed from it. Given a Metrics (see metrics.py), calls,
+# bytes, retries, timeouts and cache hits are counted per endpoint.
+#------------------------------------------------------------------------------------
+
+import json, random, threading, time
+import requests
+from requests.adapters import HTTPAdapter
+
+# Status codes that usually mean "GitHub is having a moment", worth another go.
+RETRY_STATUSES = (500, 502, 503, 504)
+
+# Only these are safe to send twice.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+
+# An item GitHub says isn't there (deleted, transferred, or never was).
+class NotFound(Exception):
+    pass
+
+
+class GithubClient(object):
+
+    def __init__(self, ghuser, ghpass, connect_timeout=5, read_timeout=30,
+                 retries=5, backoff=0.5, max_backoff=30, pool_size=16, cache=None,
+                 ratelimit=None, cassette=None, metrics=None):
+        self.auth = (ghuser, ghpass)
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.pool_size = pool_size
+        self.cache = cache
+        self.ratelimit = ratelimit
+        self.cassette = cassette
+        self.metrics = metrics
+        self._local = threading.local()
+
+    #--------------------------------------------------------------------------------
+    # One keep-alive session per thread; requests doesn't promise that a single
+    # Session is safe to share between threads.
+    #--------------------------------------------------------------------------------
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            session.auth = self.auth
+            adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            self._local.session = session
+        return session
+
+    #--------------------------------------------------------------------------------
+    # Exponential backoff with "full jitter", so a pool of workers that all hit the
+    # same hiccup don't all come back at the same moment.
+    #--------------------------------------------------------------------------------
+    def delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff * (2 ** attempt)))
+
+    #--------------------------------------------------------------------------------
+    # Put one request on the wire (or, when replaying, pretend to).
+    #--------------------------------------------------------------------------------
+    def transport(self, method, url, **kwargs):
+        if (self.cassette is not None) and self.cassette.replaying:
+            return self.cassette.play(method, url, **kwargs)
+        start = time.time()
+        r = self.session().request(method, url, **kwargs)
+        if self.metrics is not None:
+            self.metrics.http_call(method, url, r, time.time() - start)
+        # A rate limit refusal we're about to wait out isn't part of the run, only
+        # the answer after it is; so a replay never has anything to wait for.
+        if (self.cassette is not None) and (self.rate_limit_wait(r) is None):
+            self.cassette.record(method, url, r, **kwargs)
+        return r
+
+    #--------------------------------------------------------------------------------
+    # Send a request, retrying timeouts, dropped connections and 5xx responses.
+    # Writes that aren't idempotent (POST, PATCH) are only retried when we never
+    # managed to connect, since otherwise GitHub may already have acted on them.
+    # Once we run out of retries the last error is raised (or, for a 5xx, the
+    # last response is returned). Callers that know better can say whether the
+    # request is idempotent, and whether it draws on the rate limit budget.
+    #--------------------------------------------------------------------------------
+    def send(self, method, url, idempotent=None, budget=True, **kwargs):
+        method = method.upper()
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = method in IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            if budget and (self.ratelimit is not None):
+                self.ratelimit.acquire(write=(method != 'GET'))
+            try:
+                r = self.transport(method, url, **kwargs)
+            except requests.exceptions.ConnectTimeout:
+                if self.metrics is not None:
+                    self.metrics.timeout(method, url)
+                if attempt >= self.retries:
+                    raise
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if (self.metrics is not None) and isinstance(e, requests.exceptions.Timeout):
+                    self.metrics.timeout(method, url)
+                if (not idempotent) or (attempt >= self.retries):
+                    raise
+            else:
+                if self.ratelimit is not None:
+                    self.ratelimit.update(r)
+                if self.rate_limited(r):
+                    # Doesn't count as a failed attempt; we just wait our turn.
+                    continue
+                if (r.status_code not in RETRY_STATUSES) or (not idempotent) or (attempt >= self.retries):
+                    return r
+
+            print "Request to", url, "failed, retrying..."
+            if self.metrics is not None:
+                self.metrics.retry(method, url)
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    #--------------------------------------------------------------------------------
+    # Did GitHub refuse this request for rate limit reasons? If so, how many
+    # seconds it asked us to wait (the secondary limits send Retry-After), or
+    # until the window resets; otherwise None.
+    #--------------------------------------------------------------------------------
+    def rate_limit_wait(self, r):
+        if r.status_code not in (403, 429):
+            return None
+        if 'Retry-After' in r.headers:
+            return int(r.headers['Retry-After'])
+        if r.headers.get('X-RateLimit-Remaining') == '0':
+            return max(1, int(r.headers.get('X-RateLimit-Reset', 0)) - time.time() + 1)
+        return None
+
+    #--------------------------------------------------------------------------------
+    # Wait out a rate limit refusal, and say so. When replaying there's nothing
+    # to wait for (and the cassette would only give the same answer again, for
+    # ever), so the refusal goes back to the caller like any other error.
+    #--------------------------------------------------------------------------------
+    def rate_limited(self, r):
+        wait = self.rate_limit_wait(r)
+        if wait is None:
+            return False
+        if (self.cassette is not None) and self.cassette.replaying:
+            print "WARN: replayed a rate limit refusal from", r.url
+            return False
+        if 'Retry-After' in r.headers:
+            print "Asked to back off by GitHub; pausing", wait, "seconds"
+        else:
+            print "Rate limit exhausted; pausing", int(wait), "seconds until it resets"
+        time.sleep(wait)
+        return True
+
+    #--------------------------------------------------------------------------------
+    # A GET that goes through the response cache. The cache is keyed on the full
+    # url, query string included.
+    #--------------------------------------------------------------------------------
+    def cached_get(self, url, **kwargs):
+        key = requests.Request('GET', url, params=kwargs.get('params')).prepare().url
+        headers = dict(kwargs.pop('headers', None) or {})
+
+        r = self.send('GET', url, headers=dict(headers, **self.cache.conditional_headers(key)), **kwargs)
+        if r.status_code == 304:
+            cached = self.cache.load(key, r)
+            if cached is not None:
+                if self.metrics is not None:
+                    self.metrics.cache_lookup(url, True)
+                return cached
+            # We've lost the body somehow, so ask again without conditions.
+            r = self.send('GET', url, headers=headers, **kwargs)
+
+        self.cache.miss()
+        if self.metrics is not None:
+            self.metrics.cache_lookup(url, False)
+        self.cache.store(key, r)
+        return r
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        if (self.cache is not None) and (method == 'GET') and (not kwargs.get('stream')):
+            return self.cached_get(url, **kwargs)
+        return self.send(method, url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    #--------------------------------------------------------------------------------
+    # A GraphQL query. It's a POST, but a read, so it's as safe to retry as a
+    # GET. GraphQL has its own rate limit, separate from the REST budget.
+    #--------------------------------------------------------------------------------
+    def graphql(self, url, query):
+        return self.send('POST', url, data=json.dumps({'query': query}), idempotent=True, budget=False)
+
+    #--------------------------------------------------------------------------------
+    # A search API query. Search has its own (much smaller) rate limit too, and
+    # its results change from minute to minute, so there's no point caching them.
+    #--------------------------------------------------------------------------------
+    def search(self, url, params):
+        return self.send('GET', url, params=params, budget=False)
@@ -0,0 +1,124 @@
+#------------------------------------------------------------------------------------
+# Batched GraphQL fetching of PR triage data.
+#
+# Over REST, triage needs about four calls per PR: the pull, its diff, its issue
+# and its comments. GraphQL lets us ask for everything triage looks at (labels,
+# base ref, mergeability, file paths and change types, and the comment thread)
+# for a whole batch of PRs in a single query. The results are turned into the
+# same PullSnapshots prbot's REST fetch_pr() produces, so triage() can't tell
+# the difference.
+#
+# Limits: we ask for the first 100 labels and files, and the newest 100 comments
+# of each PR. Triage walks comments newest-first and stops at the first
+# meaningful one, so the newest 100 are the ones that matter.
+#------------------------------------------------------------------------------------
+
+import json
+from diffscan import DiffFile
+from prsnapshot import snapshot, decode
+
+PR_FIELDS = '''
+      number
+      title
+      body
+      url
+      updatedAt
+      state
+      author { login }
+      baseRefName
+      mergeable
+      labels(first: 100) { nodes { name } }
+      files(first: 100) { nodes { path changeType } }
+      comments(last: 100) { nodes { author { login } body createdAt } }
+'''
+
+MERGEABLE = {'MERGEABLE': True, 'CONFLICTING': False, 'UNKNOWN': None}
+
+
+class GraphQLError(Exception):
+    pass
+
+#------------------------------------------------------------------------------------
+# Build one query for a batch of PR numbers. Each PR gets an alias (pr1234) so
+# they can all sit under the one repository.
+#------------------------------------------------------------------------------------
+def build_query(owner, name, numbers):
+    parts = ['query {', '  repository(owner: %s, name: %s) {' % (json.dumps(owner), json.dumps(name))]
+    for number in numbers:
+        parts.append('    pr%d: pullRequest(number: %d) {%s    }' % (int(number), int(number), PR_FIELDS))
+    parts.append('  }')
+    parts.append('}')
+    return '\n'.join(parts)
+
+def login(actor):
+    # Deleted accounts come back as a null author.
+    if actor is None:
+        return 'ghost'
+    return actor['login']
+
+#------------------------------------------------------------------------------------
+# Turn one pullRequest node into a PullSnapshot. The REST urls that triage
+# writes to are rebuilt from api_url.
+#------------------------------------------------------------------------------------
+def to_snapshot(node, owner, name, api_url):
+    issue_url = '%s/repos/%s/%s/issues/%d' % (api_url, owner, name, node['number'])
+    comments_url = issue_url + '/comments'
+
+    pull = {
+        'number': node['number'],
+        'title': node['title'],
+        'body': node['body'],
+        'html_url': node['url'],
+        'updated_at': node['updatedAt'],
+        'user': {'login': login(node['author'])},
+        'base': {'ref': node['baseRefName']},
+        'mergeable': MERGEABLE.get(node['mergeable']),
+        'issue_url': issue_url,
+        'comments_url': comments_url,
+    }
+    issue = {
+        'number': node['number'],
+        'labels': [{'name': label['name']} for label in node['labels']['nodes']],
+        'labels_url': issue_url + '/labels{/name}',
+        'updated_at': node['updatedAt'],
+        'state': node['state'].lower(),
+        'comments_url': comments_url,
+    }
+    files = []
+    for f in node['files']['nodes']:
+        files.append(DiffFile(f['path'],
+                              new_file=(f.get('changeType') == 'ADDED'),
+                              deleted=(f.get('changeType') == 'DELETED')))
+    comments = []
+    for c in node['comments']['nodes']:
+        comments.append({'user': {'login': login(c['author'])},
+                         'body': c['body'],
+                         'created_at': c['createdAt']})
+
+    return snapshot(owner + '/' + name, pull, issue, files, comments)
+
+#------------------------------------------------------------------------------------
+# fetch_pulls: one GraphQL round trip for a batch of PRs. Returns their snapshots
+# in the order the numbers were given; PRs GitHub couldn't find are left out.
+# Given an archive (an ArchiveWriter), each PR's raw node goes into it too.
+#------------------------------------------------------------------------------------
+def fetch_pulls(gh, graphql_url, owner, name, numbers, api_url='https://api.github.com', archive=None):
+    query = build_query(owner, name, numbers)
+    r = gh.graphql(graphql_url, query)
+    result = decode(r)
+
+    data = result.get('data') or {}
+    repository = data.get('repository')
+    if repository is None:
+        raise GraphQLError(result.get('errors') or result.get('message') or r.text)
+
+    snapshots = []
+    for number in numbers:
+        node = repository.get('pr%d' % int(number))
+        if node is None:
+            print "  WARN: GraphQL returned nothing for PR", number
+            continue
+        if archive is not None:
+            archive.add(owner + '/' + name, number, graphql=node)
+        snapshots.append(to_snapshot(node, owner, name, api_url))
+    return snapshots
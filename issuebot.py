@@ -22,16 +22,48 @@
 #
 # (Note: we can add timeouts later.)
 
-import requests, json, yaml, sys, argparse, time
+import requests, yaml, sys, argparse, time, os, atexit
+from fetchpool import ReverseListing
+from ghclient import GithubClient
+from ghcache import ResponseCache
+from ratelimit import RateLimiter
+from cassette import Cassette
+from statestore import TriageState
+from maintainers import load_index, mentions
+from commentsummary import fetch_comments
+from webhook import Listener
+from metrics import Metrics
+from archive import ArchiveWriter, run_archive_path
+from searchplan import candidate_queries, plan_candidates, SearchTooBroad
+from issuesweep import open_items, full_entry, kind_of
+from actionplan import PlanWriter, plan_entry, load_plan, apply_plan, net_labels, label_changes, current_labels, replace_labels
 
 parser = argparse.ArgumentParser(description='Triage various PR queues for Ansible. (NOTE: only useful if you have commit access to the repo in question.)')
 parser.add_argument("ghuser", type=str, help="Github username of triager")
 parser.add_argument("ghpass", type=str, help="Github password of triager")
 parser.add_argument("ghrepo", type=str, choices=['core','extras'], help="Repo to be triaged")
 parser.add_argument('--verbose', '-v', action='store_true', help="Verbose output")
-parser.add_argument('--debug', '-d', action='store_true', help="Debug output")
+parser.add_argument('--debug', '-d', action='store_true', help="Debug output (and archive every issue's raw API data, under the statedir)")
+parser.add_argument('--archive', type=str, metavar='ARCHIVE', help="Archive every issue's raw API data to this file")
 parser.add_argument('--pause', '-p', action='store_true', help="Always pause between issues")
 parser.add_argument('--issue', '-i', type=str, help="Triage only the specified issue")
+parser.add_argument('--workers', '-w', type=int, default=8, help="Number of listing pages to fetch in parallel")
+parser.add_argument('--statedir', type=str, default='~/.ansibullbot', help="Where to keep the bot's caches and state between runs")
+parser.add_argument('--no-cache', action='store_true', help="Don't use the on-disk HTTP response cache")
+parser.add_argument('--incremental', action='store_true', help="Skip issues that haven't changed since they were last triaged, and only fetch new comments")
+parser.add_argument('--search', action='store_true', help="Use the search API to pick out the issues that may need work, and only fetch those")
+parser.add_argument('--budget-share', type=float, default=0.5, help="Fraction of the hourly API rate limit this bot may use for reads")
+parser.add_argument('--api-url', type=str, default='https://api.github.com', help="GitHub API root (e.g. a local stand-in for testing)")
+parser.add_argument('--record', type=str, metavar='CASSETTE', help="Record all GitHub traffic from this run to a cassette file")
+parser.add_argument('--replay', type=str, metavar='CASSETTE', help="Run entirely from a recorded cassette, without the network")
+parser.add_argument('--write-reserve', type=int, default=200, help="API calls to hold back for writing labels and comments")
+parser.add_argument('--plan', type=str, metavar='PLANFILE', help="Don't ask or write anything; save all recommended actions to a plan file for review")
+parser.add_argument('--apply', type=str, metavar='PLANFILE', help="Carry out the actions in a (reviewed) plan file, instead of triaging")
+parser.add_argument('--listen', type=int, metavar='PORT', help="Wait for GitHub webhooks on this port, and triage each issue they name (needs --plan)")
+parser.add_argument('--webhook-secret', type=str, help="Secret that webhook deliveries must be signed with")
+parser.add_argument('--debounce', type=float, default=5, help="Seconds an issue must be quiet before a webhook triggers triage")
+parser.add_argument('--metrics', type=str, metavar='PREFIX', help="At the end of the run, write timings and API call counts to PREFIX.prom and PREFIX.json")
+parser.add_argument('--trace', type=str, metavar='TRACEFILE', help="Write a span for every phase of every issue's triage to this file")
 args=parser.parse_args()
 
 #------------------------------------------------------------------------------------
@@ -40,7 +72,8 @@ args=parser.parse_args()
 ghuser=args.ghuser
 ghpass=args.ghpass
 ghrepo=args.ghrepo
-repo_url = 'https://api.github.com/repos/ansible/ansible-modules-' + ghrepo + '/issues'
+api_url = args.api_url.rstrip('/')
+repo_url = api_url + '/repos/ansible/ansible-modules-' + ghrepo + '/issues'
 if args.issue:
     single_issue = args.issue
 else:
@@ -57,9 +90,65 @@ if args.pause:
     always_pause = 'true'
 else:
     always_pause = ''
-args = {'state':'open', 'page':1}
+workers = args.workers
+statedir = os.path.expanduser(args.statedir)
+if args.record:
+    cassette = Cassette(args.record, 'record')
+    atexit.register(cassette.close)
+elif args.replay:
+    cassette = Cassette(args.replay, 'replay')
+else:
+    cassette = None
+# The cache would make what goes over the wire depend on earlier runs, so it's
+# off while recording or replaying.
+if args.no_cache or cassette:
+    cache = None
+else:
+    cache = ResponseCache(os.path.join(statedir, 'httpcache.db'))
+ratelimit = RateLimiter(share=args.budget_share, reserve=args.write_reserve)
+# Metrics are cheap to keep, so we always keep them; they're only written out
+# if asked for.
+metrics = Metrics(trace=args.trace)
+atexit.register(metrics.close)
+if args.metrics:
+    atexit.register(metrics.export, args.metrics)
+gh = GithubClient(ghuser, ghpass, pool_size=workers, cache=cache, ratelimit=ratelimit,
+                  cassette=cassette, metrics=metrics)
+if args.incremental:
+    incremental = 'true'
+else:
+    incremental = ''
+# A replay didn't really happen, so it mustn't leave its triage, comment
+# summaries or sweep times in the real state; it gets a throwaway one.
+if args.replay:
+    state = TriageState(':memory:')
+else:
+    state = TriageState(os.path.join(statedir, 'triage.db'))
+if args.plan:
+    plan = PlanWriter(args.plan)
+    atexit.register(plan.close)
+else:
+    plan = None
+# Nobody is at the terminal to answer prompts for a listener, so its actions
+# go into a plan.
+if args.listen and not args.plan:
+    parser.error("--listen runs unattended, so it needs a --plan to write its actions to")
+if args.archive or debug:
+    archive = ArchiveWriter(args.archive or run_archive_path(statedir, 'issuebot'))
+    atexit.register(archive.close)
+    print "ARCHIVE: raw API data goes to", archive.path
+else:
+    archive = None
+repo_name = 'ansible/ansible-modules-' + ghrepo
+if ghrepo == "core":
+    maintainer_index = load_index('MAINTAINERS-CORE.txt', statedir)
+elif ghrepo == "extras":
+    maintainer_index = load_index('MAINTAINERS-EXTRAS.txt', statedir)
 botlist = ['gregdek','robynbergeron']
 
+# Roughly how many API calls it takes to triage one issue.
+calls_per_item = 2
+
 #------------------------------------------------------------------------------------
 # Here's the boilerplate text.
 #------------------------------------------------------------------------------------
@@ -69,38 +158,47 @@ boilerplate = {
 }
 
 #------------------------------------------------------------------------------------
-# Here's the triage function. It takes a PR id and does all of the necessary triage
-# stuff.
+# Here's the fetch function, for when all we have is an issue's number (a single
+# issue, a webhook, a search candidate). A sweep gets its issues from the
+# listing, and doesn't need it.
 #------------------------------------------------------------------------------------
 
-def triage(urlstring):
-    #----------------------------------------------------------------------------
-    # Get the more detailed PR data from the API:
-    #----------------------------------------------------------------------------
+def fetch_issue(number):
+    urlstring = repo_url + "/" + str(number)
     if verbose:
         print "URLSTRING: ", urlstring
-    issue = requests.get(urlstring, auth=(ghuser,ghpass)).json()
+    with metrics.phase('issue', repo_name + '#' + str(number)):
+        return gh.get(urlstring).json()
+
+#------------------------------------------------------------------------------------
+# Here's the triage function. It takes an issue and does all of the necessary
+# triage stuff. It hands back the actions it recommended (or None for pull
+# requests, which we don't do).
+#------------------------------------------------------------------------------------
+
+def triage(issue):
+    item = repo_name + '#' + str(issue['number'])
 
     #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    # DEBUG: Dump JSON to /tmp for analysis if needed
+    # DEBUG: Archive the raw JSON for analysis if needed
     #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    if debug:
-        debugfileid = '/tmp/issue-' + str(issue['number'])
-        print "DEBUG JSON TO: ", debugfileid
-        debugfile = open(debugfileid, 'w')
-        print >>debugfile, json.dumps(issue, ensure_ascii=True, indent=4, separators=(',', ': '))
-        debugfile.close()
+    if archive:
+        archive.add(repo_name, issue['number'], issue=issue)
 
     #----------------------------------------------------------------------------
     # Are we a pull request? If so, then break. We don't do pull requests.
     #----------------------------------------------------------------------------
-    try:
-        if issue['pull_request']:
-            print "Ignoring Pull Request ", issue['number']
-            return
-    except:
-        # noop
-        pass
+    if kind_of(issue) == 'pull':
+        print "Ignoring Pull Request ", issue['number']
+        return None
+
+    #----------------------------------------------------------------------------
+    # Closed since we last looked? (With --search, we may only have known about
+    # it from our own state.) Then there's nothing to do.
+    #----------------------------------------------------------------------------
+    if issue['state'] != 'open':
+        print "Ignoring closed issue ", issue['number']
+        return []
         
     #----------------------------------------------------------------------------
     # Pull the list of labels.
@@ -130,7 +228,20 @@ def triage(urlstring):
     # Get our comments, and set our empty actions list.
     #----------------------------------------------------------------------------
   
-    comments = requests.get(issue['comments_url'], auth=(ghuser,ghpass), verify=False)
+    # In incremental mode, only comments we haven't seen before are fetched.
+    # Otherwise triage walks the thread from the newest page back, fetching
+    # older pages only if it needs them. Any pages fetched are archived along
+    # with the issue.
+    with metrics.phase('comments', item):
+        if incremental:
+            comments = fetch_comments(gh, state, repo_name, issue['number'], issue['comments_url'], botlist,
+                                      archive=archive)
+        else:
+            get_page = lambda page: gh.get(issue['comments_url'], verify=False,
+                                           params={'per_page': 100, 'page': page})
+            if archive:
+                get_page = archive.comment_pages(repo_name, issue['number'], get_page)
+            comments = ReverseListing(get_page)
     actions = []
  
     #----------------------------------------------------------------------------
@@ -166,29 +277,31 @@ def triage(urlstring):
     #----------------------------------------------------------------------------
     # First pass: look for the presence of issue_filename. If not found, 
     # ask for help triaging and tag with "needs_triage". Note that most
-    # recent *always* wins, and it doesn't matter who entered it.
+    # recent *always* wins, and it doesn't matter who entered it. A comment
+    # may name more than one file ([module: foo] or [filename: foo], anywhere
+    # in the comment; see maintainers.mentions), and then it's about all of
+    # them.
     #----------------------------------------------------------------------------
 
-    issue_filename = ''
-    for comment in reversed(comments.json()):
+    issue_filenames = []
+    issue_maintainers = ''
+    for comment in reversed(comments):
             
         if verbose:
             print " " 
             print "==========>  Comment at ", comment['created_at'], " from: ", comment['user']['login']
             print comment['body']
 
-        if ('[module' in comment['body']):
-            # FIXME: this should be changed to a regex. We can't assume
-            # long-term that this text is alone in the comment.
-            issue_filename = (comment['body'].split(':')[-1]).rstrip()
-            print "  Filename found: ", issue_filename 
+        issue_filenames = mentions(comment['body'])
+        if issue_filenames:
+            print "  Filename(s) found: ", ' '.join(issue_filenames)
             break
 
     #----------------------------------------------------------------------------
     # No filename found? That means it needs to be triaged.
     #----------------------------------------------------------------------------
 
-    if (issue_filename == ''):
+    if not issue_filenames:
         actions.append('boilerplate: triage_needed')
         actions.append('label: triage_needed')    
 
@@ -198,21 +311,17 @@ def triage(urlstring):
 
     else:   
 
-        # Identify maintainers 
-
-        maintainers_found = ''
-        if ghrepo == "core":
-            f = open('MAINTAINERS-CORE.txt')
-        elif ghrepo == "extras":
-            f = open('MAINTAINERS-EXTRAS.txt')
-        for line in f:
-            if issue_filename in line:
-                issue_maintainers = (line.split(': ')[-1]).rstrip()
-                maintainers_found = 'True'
-                break
-        f.close()
-
-        if not maintainers_found:
+        # Identify maintainers (by path, filename or module name)
+
+        issue_maintainers_list = []
+        with metrics.phase('maintainers', item):
+            for issue_filename in issue_filenames:
+                for maintainer in maintainer_index.lookup_mention(issue_filename):
+                    if maintainer not in issue_maintainers_list:
+                        issue_maintainers_list.append(maintainer)
+        issue_maintainers = ' '.join(issue_maintainers_list)
+
+        if not issue_maintainers:
             print "  WARNING: no maintainers found for this file"
             issue_maintainers = ''
 
@@ -225,14 +334,16 @@ def triage(urlstring):
             #--------------------------------------------------------------------
 
             maintainer_pinged = ''
-            for comment in reversed(comments.json()):
+            for comment in reversed(comments):
                 if (comment['user']['login'] in botlist):
-                    for maintainer in issue_maintainers:
-                        if maintainer in comment['body']:
+                    for maintainer in issue_maintainers_list:
+                        if ('@' + maintainer) in comment['body']:
                             maintainer_pinged = 'yes'
+                if maintainer_pinged:
+                    break
 
-            if maintainer_pinged:
-                actions.append('boilerplate: ping_maintainer')    
+            if not maintainer_pinged:
+                actions.append('boilerplate: ping')    
 
     #----------------------------------------------------------------------------
     # OK, triage is done! Now let's print out the list of actions we tallied.
@@ -253,6 +364,22 @@ def triage(urlstring):
 
     print " "
 
+    #----------------------------------------------------------------------------
+    # In plan mode, we don't ask; the actions go into the plan for review, with
+    # the comments written out in full.
+    #----------------------------------------------------------------------------
+    if plan:
+        if actions:
+            def text(name):
+                if name not in boilerplate:
+                    return None
+                # A hack to make the @ signs line up for multiple maintainers
+                return boilerplate[name].format(m=issue_maintainers.replace(' ', ' @'), s=issue_submitter)
+            plan.add(plan_entry(repo_name, issue['number'], issue['html_url'], issue['url'], issue['updated_at'],
+                                issue_labels, actions, text))
+            print "Added to plan."
+        return actions
+
     cont = ''
 
     # If there are actions, ask if we should take them. Otherwise, skip.
@@ -264,36 +391,27 @@ def triage(urlstring):
         #------------------------------------------------------------------------
         # Now we start actually writing to the issue itself.
         #------------------------------------------------------------------------
+        writes_started = time.time()
         print "LABELS_URL: ", issue['labels_url']
         print "COMMENTS_URL: ", issue['comments_url']
-        for action in actions:
 
-            if "unlabel" in action:
-                oldlabel = action.split(': ')[-1]
-                # Don't remove it if it isn't there
-                if oldlabel in issue_labels:
-                    issue_actionurl = issue['labels_url'].split("{")[0] + "/" + oldlabel
-                    # print "URL for DELETE: ", issue_actionurl
-                    try:
-                        r = requests.delete(issue_actionurl, auth=(ghuser,ghpass))
-                        # print r.text
-                    except requests.exceptions.RequestException as e:
-                        print e
-                        sys.exit(1)
-
-            if "newlabel" in action:
-                newlabel = action.split(': ')[-1]
-                if newlabel not in issue_labels:
-                    issue_actionurl = issue['labels_url'].split("{")[0]
-                    payload = '["' + newlabel +'"]'
-                    # print "URL for POST: ", issue_actionurl
-                    # print "  PAYLOAD: ", payload
-                    try:
-                        r = requests.post(issue_actionurl, data=payload, auth=(ghuser, ghpass))
-                        # print r.text
-                    except requests.exceptions.RequestException as e:
-                        print e
-                        sys.exit(1)
+        #------------------------------------------------------------------------
+        # All the label actions come down to one new set of labels, which
+        # goes out in a single call (if anything needs changing at all). That
+        # call replaces the lot, so it starts from the labels as they are now;
+        # the listing we triaged from may be hours old by the time anyone says y.
+        #------------------------------------------------------------------------
+        try:
+            labels_now = current_labels(gh, issue['url'])
+            new_labels = net_labels(labels_now, actions)
+            if label_changes(labels_now, new_labels):
+                r = replace_labels(gh, issue['labels_url'], new_labels)
+                # print r.text
+        except requests.exceptions.RequestException as e:
+            print e
+            sys.exit(1)
+
+        for action in actions:
 
             if "boilerplate" in action:
                 # A hack to make the @ signs line up for multiple maintainers
@@ -306,52 +424,139 @@ def triage(urlstring):
                 # print "URL for POST: ", issue_actionurl
                 # print "  PAYLOAD: ", payload
                 try:
-                    r = requests.post(issue_actionurl, data=payload, auth=(ghuser, ghpass))
+                    r = gh.post(issue_actionurl, data=payload)
                     # print r.text
                 except requests.exceptions.RequestException as e:
                     print e
                     sys.exit(1)
+
+        metrics.observe('writes', time.time() - writes_started, item, writes_started)
                         
     else:
         print "Skipping."
 
+    return actions
+
+
+#------------------------------------------------------------------------------------
+# Triage and record a single issue, by number.
+#------------------------------------------------------------------------------------
+
+def triage_one(number):
+    issue = fetch_issue(number)
+    actions = triage(issue)
+    if actions is not None:
+        state.record(repo_name, issue['number'], issue['updated_at'], actions, kind='issue')
+
+
+#------------------------------------------------------------------------------------
+# The open issues to sweep: every one in the /issues listing (leaving out the
+# PRs in it, which are prbot's; see issuesweep.py), or with --search, only the
+# ones the search API (and our own state) say may need work; see searchplan.py.
+# Searching needs an earlier full sweep to go on, and a search that isn't too
+# broad to trust; otherwise we list everything after all.
+#------------------------------------------------------------------------------------
+
+def listed_issues():
+    return open_items(gh, api_url, repo_name, 'issue', workers=workers)
+
+def open_issues():
+    if not args.search:
+        return listed_issues()
+    since = state.last_sweep(repo_name, 'issue')
+    if since is None:
+        print "SEARCH: no earlier sweep of", repo_name, "to go on; listing every open issue"
+        return listed_issues()
+    try:
+        candidates = plan_candidates(gh, api_url, candidate_queries(repo_name, 'issue', since),
+                                     state.outstanding(repo_name, 'issue'))
+    except SearchTooBroad as e:
+        print "SEARCH:", e, "; listing every open issue"
+        return listed_issues()
+    print "SEARCH:", len(candidates), "issues in", repo_name, "may need work"
+    return candidates
+
+
+#------------------------------------------------------------------------------------
+# Tell the user how far the current rate limit budget will go.
+#------------------------------------------------------------------------------------
+
+def report_budget():
+    items = ratelimit.items_left(calls_per_item)
+    if items is not None:
+        print "RATE LIMIT: budget left for about", items, "more issues (resets at %s)" % time.ctime(ratelimit.reset)
+
 
 #====================================================================================
 # MAIN CODE START, EH?
 #====================================================================================
 
 
+#------------------------------------------------------------------------------------
+# If we've been handed a reviewed plan, carry it out, and that's all.
+#------------------------------------------------------------------------------------
+if args.apply:
+    if apply_plan(gh, ghuser, load_plan(args.apply), workers=workers):
+        sys.exit(1)
+
 #------------------------------------------------------------------------------------
 # If we're running in single PR mode, run triage on the single PR.
 #------------------------------------------------------------------------------------
-if single_issue:
-    single_issue_url = "https://api.github.com/repos/ansible/ansible-modules-" + ghrepo + "/issues/" + single_issue
-    triage(single_issue_url)
+elif single_issue:
+    triage_one(single_issue)
+
+#------------------------------------------------------------------------------------
+# If we're listening for webhooks, triage each issue they tell us about, as they
+# tell us about it.
+#------------------------------------------------------------------------------------
+elif args.listen:
+    def wanted(item):
+        repo, number, is_pull = item
+        return (repo == repo_name) and not is_pull
+
+    if not args.webhook_secret:
+        print "WARN: no --webhook-secret given; accepting unsigned webhooks"
+    Listener(args.listen, args.webhook_secret, lambda item: triage_one(item[1]), wanted,
+             debounce=args.debounce, verbose=verbose).run()
 
 #------------------------------------------------------------------------------------
 # Otherwise, go get all open PRs and run through them.
 #------------------------------------------------------------------------------------
 else:
-    # First, get number of pages using pagination in Link Headers. Thanks 
-    # requests library for making this relatively easy!
-    r = requests.get(repo_url, params=args, auth=(ghuser,ghpass))
-    lastpage = int(str(r.links['last']['url']).split('=')[-1])
-
-    # Set range for 1..2 for testing only
-    # for page in range(1,2):
-
-    for page in range(1,lastpage):
-        issue_args = {'state':'open', 'page':page}
-        r = requests.get(repo_url, params=issue_args, auth=(ghuser,ghpass))
-
-        #----------------------------------------------------------------------------
-        # For every open PR:
-        #----------------------------------------------------------------------------
-        for shortissue in r.json():
- 
-            # Do some nifty triage!
-            triage(shortissue['url'])
+    # Asking about the rate limit is free, so see where we stand first.
+    gh.get(api_url + '/rate_limit')
+    report_budget()
+
+    #----------------------------------------------------------------------------
+    # For every open issue (all listing pages are fetched at once, and issues
+    # come back in order as the pages arrive). Issues from the listing are
+    # triaged as they are; search results can lag behind the issues themselves,
+    # so those are fetched first. A sweep that got through everything is
+    # remembered, for --search.
+    #----------------------------------------------------------------------------
+    started = time.time()
+    for shortissue in open_issues():
+
+        if incremental and not state.needs_triage(repo_name, shortissue['number'], shortissue['updated_at']):
+            if verbose:
+                print "UNCHANGED ", shortissue['number']
+            continue
+
+        if full_entry(shortissue):
+            issue = shortissue
+        else:
+            issue = fetch_issue(shortissue['number'])
+
+        # Do some nifty triage!
+        actions = triage(issue)
+        if actions is not None:
+            state.record(repo_name, issue['number'], issue['updated_at'], actions, kind='issue')
+    state.record_sweep(repo_name, 'issue', started)
+
+    report_budget()
 
+if plan:
+    print "PLAN:", plan.count, "issues with actions written to", plan.path
 
 #====================================================================================
 # That's all, folks!
@@ -0,0 +1,50 @@
+#------------------------------------------------------------------------------------
+# The /issues listing, shared by both bots.
+#
+# A repo's /issues listing has every open issue and every open PR in it, and
+# each entry is the full issue object: number, title, labels, submitter, state,
+# the comments and labels urls, and (for PRs only) a pull_request marker. That
+# is everything issue triage needs, and everything a PR snapshot takes from the
+# issue. So both bots sweep this one listing and route each entry on the
+# marker: issuebot triages the issues straight from the listing, with no GET
+# per issue (and no GET at all for the PRs it used to fetch only to skip), and
+# prbot takes the PRs, using the listing entry in place of a GET of each PR's
+# issue.
+#
+# Both bots ask for exactly the same pages, so with the response cache on, the
+# second bot to sweep a repo gets the listing back as 304s, which don't count
+# against the rate limit.
+#------------------------------------------------------------------------------------
+
+from fetchpool import paged_listing
+
+def issues_url(api_url, repo_name):
+    return api_url + '/repos/' + repo_name + '/issues'
+
+#------------------------------------------------------------------------------------
+# What an /issues entry is: a 'pull' or an 'issue' (the kinds the triage state
+# uses too).
+#------------------------------------------------------------------------------------
+def kind_of(entry):
+    if entry.get('pull_request'):
+        return 'pull'
+    return 'issue'
+
+#------------------------------------------------------------------------------------
+# Is this a full issue object we can triage from, or only a stand-in for one
+# (such as searchplan's candidates, which carry just the number)?
+#------------------------------------------------------------------------------------
+def full_entry(entry):
+    return 'labels_url' in entry
+
+#------------------------------------------------------------------------------------
+# Every open entry of one kind in a repo, in listing order (newest number
+# first). All the listing pages are fetched at once; see paged_listing.
+#------------------------------------------------------------------------------------
+def open_items(gh, api_url, repo_name, kind, workers=8):
+    url = issues_url(api_url, repo_name)
+    def get_page(page):
+        return gh.get(url, params={'state': 'open', 'per_page': 100, 'page': page})
+    for entry in paged_listing(get_page, workers=workers):
+        if kind_of(entry) == kind:
+            yield entry
@@ -0,0 +1,195 @@
+#------------------------------------------------------------------------------------
+# Maintainer lookups for the MAINTAINERS-*.txt files.
+#
+# Each line of a maintainers file looks like
+#
+#     cloud/amazon/ec2.py: ansible
+#     cloud/cloudstack/: resmo
+#
+# i.e. a file (or, with a trailing slash, a whole directory) and the people who
+# maintain it. We parse the file once into a trie keyed on path components, so a
+# lookup is a longest-prefix match on the path rather than a substring test
+# against every line (which used to let ec2.py claim ec2_ami.py and friends). A
+# basename map handles lookups by bare filename, such as "ec2.py", and a module
+# map lookups by module name, such as "ec2". A deprecated module's file has a
+# leading underscore (_ec2_ami_search.py), but people still call it by its old
+# name, so it's in the module map under both.
+#
+# Issues name the file they're about with a mention in a comment, such as
+# [module: ec2] or [filename: cloud/amazon/ec2.py]; mentions() picks those out.
+#
+# Parsing is cheap, but we still cache the parsed index in the state directory
+# and only rebuild it when the maintainers file changes.
+#------------------------------------------------------------------------------------
+
+import cPickle, os, re
+
+# Bump this whenever the pickled layout of MaintainerIndex changes.
+INDEX_VERSION = 2
+
+MENTION = re.compile(r'\[\s*(?:module|filename)\s*:([^\]]*)\]', re.IGNORECASE)
+NAME_SEPARATORS = re.compile(r'[\s,]+')
+
+#------------------------------------------------------------------------------------
+# Tidy a path up for lookup: no stray whitespace, leading ./ or slashes.
+#------------------------------------------------------------------------------------
+def split_path(path):
+    return [part for part in path.strip().split('/') if part not in ('', '.')]
+
+#------------------------------------------------------------------------------------
+# The module names a file goes by: its basename without .py, and for a
+# deprecated module, that without the leading underscore too.
+#------------------------------------------------------------------------------------
+def module_names(name):
+    name = name.strip()
+    if name.endswith('.py'):
+        name = name[:-3]
+    names = [name]
+    if name.startswith('_') and name.lstrip('_'):
+        names.append(name.lstrip('_'))
+    return names
+
+#------------------------------------------------------------------------------------
+# The names mentioned in a comment, as [module: NAME] or [filename: NAME], in
+# the order they appear. One mention can name several, as [module: a.py, b.py].
+#------------------------------------------------------------------------------------
+def mentions(text):
+    names = []
+    for found in MENTION.findall(text or ''):
+        names.extend(name for name in NAME_SEPARATORS.split(found) if name)
+    return names
+
+
+class MaintainerIndex(object):
+
+    def __init__(self):
+        # Trie nodes are dicts of path component -> child node. A node that an
+        # entry ends on also has a None key holding that entry's maintainers.
+        self.trie = {}
+        self.basenames = {}
+        self.modules = {}
+
+    #--------------------------------------------------------------------------------
+    # Build an index from the lines of a maintainers file.
+    #--------------------------------------------------------------------------------
+    @classmethod
+    def parse(cls, lines):
+        index = cls()
+        for line in lines:
+            if ': ' not in line:
+                continue
+            path, owners = line.split(': ', 1)
+            index.add(path, owners.split())
+        return index
+
+    def add(self, path, maintainers):
+        parts = split_path(path)
+        if not parts:
+            return
+        node = self.trie
+        for part in parts:
+            node = node.setdefault(part, {})
+        node[None] = list(maintainers)
+        # Directory entries have no basename worth looking up.
+        if not path.strip().endswith('/'):
+            self.basenames.setdefault(parts[-1], []).append(list(maintainers))
+            for name in module_names(parts[-1]):
+                self.modules.setdefault(name, []).append(list(maintainers))
+
+    #--------------------------------------------------------------------------------
+    # Maintainers of a repo path, from the longest entry that is a prefix of it
+    # (so a directory entry covers everything below it). Returns [] if nothing
+    # covers the path.
+    #--------------------------------------------------------------------------------
+    def lookup_path(self, path):
+        found = []
+        node = self.trie
+        for part in split_path(path):
+            node = node.get(part)
+            if node is None:
+                break
+            if None in node:
+                found = node[None]
+        return list(found)
+
+    #--------------------------------------------------------------------------------
+    # Maintainers of a bare filename. Only answers if the name is unambiguous.
+    #--------------------------------------------------------------------------------
+    def lookup_basename(self, name):
+        matches = self.basenames.get(name.strip(), [])
+        if len(matches) != 1:
+            return []
+        return list(matches[0])
+
+    #--------------------------------------------------------------------------------
+    # Maintainers of a module, by name ("ec2", or "ec2.py" for a deprecated
+    # module's old filename). Only answers if the name is unambiguous.
+    #--------------------------------------------------------------------------------
+    def lookup_module(self, name):
+        matches = self.modules.get(module_names(name)[0], [])
+        if len(matches) != 1:
+            return []
+        return list(matches[0])
+
+    #--------------------------------------------------------------------------------
+    # The general lookup: a full path if we were given one, otherwise a bare
+    # filename.
+    #--------------------------------------------------------------------------------
+    def lookup(self, name):
+        found = self.lookup_path(name)
+        if not found and len(split_path(name)) == 1:
+            found = self.lookup_basename(name)
+        return found
+
+    #--------------------------------------------------------------------------------
+    # The lookup for a name somebody typed into a mention: as lookup(), but a
+    # bare name may also be a module name.
+    #--------------------------------------------------------------------------------
+    def lookup_mention(self, name):
+        found = self.lookup(name)
+        if not found and len(split_path(name)) == 1:
+            found = self.lookup_module(name)
+        return found
+
+#------------------------------------------------------------------------------------
+# Load the index for a maintainers file, from the cache in cachedir if the file
+# hasn't changed since it was built (going by mtime and size).
+#------------------------------------------------------------------------------------
+def load_index(filename, cachedir=None):
+    st = os.stat(filename)
+    stamp = (INDEX_VERSION, st.st_mtime, st.st_size)
+
+    cachefile = None
+    if cachedir:
+        cachefile = os.path.join(cachedir, os.path.basename(filename) + '.index')
+        try:
+            f = open(cachefile, 'rb')
+            try:
+                cached_stamp, index = cPickle.load(f)
+            finally:
+                f.close()
+            if cached_stamp == stamp:
+                return index
+        except Exception:
+            # Missing, stale or unreadable; just rebuild it.
+            pass
+
+    f = open(filename)
+    try:
+        index = MaintainerIndex.parse(f)
+    finally:
+        f.close()
+
+    if cachefile:
+        if not os.path.isdir(cachedir):
+            os.makedirs(cachedir)
+        # Write then rename, so another bot never reads a half-written index.
+        tmpfile = '%s.%d' % (cachefile, os.getpid())
+        f = open(tmpfile, 'wb')
+        try:
+            cPickle.dump((stamp, index), f, cPickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmpfile, cachefile)
+
+    return index
@@ -0,0 +1,82 @@
+#------------------------------------------------------------------------------------
+# Re-polling PRs whose mergeability GitHub hasn't worked out yet.
+#
+# GitHub works out whether a PR is mergeable lazily, in the background, once
+# something asks; until then the pull comes back with "mergeable": null, and
+# triage can't tell whether it needs_rebase. Rather than triage such a PR
+# without knowing, or sleep on it in the middle of the sweep, the sweep hands
+# it to a MergeQueue and carries on. The queue re-polls each one from its own
+# threads, backing off between tries, and hands the PR back once the answer is
+# in (or it has given up), for the sweep to triage then.
+#
+# A replay (see cassette.py) has nothing to wait for, and must triage in the same
+# order every time, whatever the threads get up to. So when replaying, the queue
+# doesn't back off, and every PR comes back from drain(), in the order it went in.
+#------------------------------------------------------------------------------------
+
+import random, time
+from multiprocessing.pool import ThreadPool
+from fetchpool import WAIT_FOREVER
+
+# Seconds to wait before each re-poll (less some jitter); about half a minute
+# in all. GitHub usually has an answer within a few seconds.
+BACKOFF = (1, 2, 4, 8, 16)
+
+
+class MergeQueue(object):
+
+    #--------------------------------------------------------------------------------
+    # refresh(pr) asks GitHub again, and returns the PR's mergeable (True, False,
+    # or still None). It's called from the queue's threads.
+    #--------------------------------------------------------------------------------
+    def __init__(self, refresh, workers=4, backoff=BACKOFF, replaying=False):
+        self.refresh = refresh
+        self.backoff = backoff
+        self.replaying = replaying
+        self.pool = ThreadPool(workers)
+        self.pending = []
+
+    def poll(self, pr):
+        for delay in self.backoff:
+            if not self.replaying:
+                time.sleep(random.uniform(delay / 2.0, delay))
+            try:
+                mergeable = self.refresh(pr)
+            except Exception as e:
+                print "WARN: checking whether", pr, "is mergeable failed:", e.__class__.__name__, e
+                break
+            if mergeable is not None:
+                pr.mergeable = mergeable
+                break
+        return pr
+
+    #--------------------------------------------------------------------------------
+    # Hand a PR over to be re-polled. Until it comes back, it's the queue's; the
+    # caller mustn't touch it.
+    #--------------------------------------------------------------------------------
+    def defer(self, pr):
+        self.pending.append(self.pool.apply_async(self.poll, (pr,)))
+
+    def __len__(self):
+        return len(self.pending)
+
+    #--------------------------------------------------------------------------------
+    # The PRs that have come back so far, in the order they went in, without
+    # waiting for the rest. (None, when replaying; they all wait for drain().)
+    #--------------------------------------------------------------------------------
+    def ready(self):
+        if self.replaying:
+            return []
+        done = [result for result in self.pending if result.ready()]
+        self.pending = [result for result in self.pending if result not in done]
+        return [result.get(WAIT_FOREVER) for result in done]
+
+    #--------------------------------------------------------------------------------
+    # All the PRs still out, waiting for each in turn.
+    #--------------------------------------------------------------------------------
+    def drain(self):
+        while self.pending:
+            yield self.pending.pop(0).get(WAIT_FOREVER)
+
+    def close(self):
+        self.pool.terminate()
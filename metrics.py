@@ -0,0 +1,253 @@
+#------------------------------------------------------------------------------------
+# Run metrics and traces for the triage bots.
+#
+# Metrics collects, for one run:
+#   - a latency histogram per phase of triage (fetching the pull, the diff, the
+#     issue, the comments; the maintainer lookup; the rules; the writes)
+#   - HTTP calls, response bytes and status codes per endpoint, plus retries
+#     and timeouts per endpoint, from the GitHub client
+#   - response cache hits and misses per endpoint
+# and exports them at the end of the run, both as Prometheus text (for the
+# node exporter's textfile collector, or pushgateway) and as a JSON summary.
+#
+# Endpoints are urls with the variable parts taken out, so that all the PRs'
+# diffs count together: /repos/ansible/ansible-modules-core/pulls/1234 becomes
+# /repos/:owner/:repo/pulls/:n.
+#
+# Given a trace file, every timed phase is also written out as a span (which
+# item, which phase, when, and for how long), one JSON object per line, so a
+# single slow PR can be picked apart afterwards.
+#------------------------------------------------------------------------------------
+
+import json, re, threading, time, urlparse
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds, in seconds.
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+#------------------------------------------------------------------------------------
+# Reduce a url to its endpoint.
+#------------------------------------------------------------------------------------
+def endpoint(url):
+    path = urlparse.urlparse(url).path
+    path = re.sub(r'^/repos/[^/]+/[^/]+', '/repos/:owner/:repo', path)
+    path = re.sub(r'/labels/[^/]+$', '/labels/:name', path)
+    return re.sub(r'/\d+(?=/|$)', '/:n', path) or '/'
+
+
+class Histogram(object):
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                break
+        else:
+            i = len(BUCKETS)
+        self.counts[i] += 1
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+
+    #--------------------------------------------------------------------------------
+    # Estimate a quantile from the buckets (the upper bound of the bucket it
+    # falls in); good enough to tell a 50ms phase from a 5s one.
+    #--------------------------------------------------------------------------------
+    def quantile(self, q):
+        if not self.count:
+            return None
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= q * self.count:
+                if i < len(BUCKETS):
+                    return min(BUCKETS[i], self.max)
+                return self.max
+        return self.max
+
+    def summary(self):
+        return {'count': self.count,
+                'total': round(self.total, 6),
+                'mean': round(self.total / self.count, 6) if self.count else None,
+                'p50': self.quantile(0.5),
+                'p95': self.quantile(0.95),
+                'max': round(self.max, 6)}
+
+
+class Metrics(object):
+
+    def __init__(self, trace=None):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.phases = {}
+        self.http = {}
+        self.statuses = {}
+        self.retries = {}
+        self.timeouts = {}
+        self.cache = {}
+        self.trace = None
+        if trace:
+            self.trace = open(trace, 'w')
+
+    def count(self, table, key, n=1):
+        with self.lock:
+            table[key] = table.get(key, 0) + n
+
+    #--------------------------------------------------------------------------------
+    # Time a phase of work on an item: with metrics.phase('diff', item): ...
+    #--------------------------------------------------------------------------------
+    @contextmanager
+    def phase(self, name, item=None):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, item, start)
+
+    def observe(self, name, elapsed, item=None, start=None):
+        with self.lock:
+            if name not in self.phases:
+                self.phases[name] = Histogram()
+            self.phases[name].observe(elapsed)
+            if self.trace is not None:
+                span = {'item': item, 'phase': name,
+                        'start': round(start or time.time() - elapsed, 6), 'duration': round(elapsed, 6),
+                        'thread': threading.current_thread().name}
+                self.trace.write(json.dumps(span) + '\n')
+
+    #--------------------------------------------------------------------------------
+    # Hooks for the GitHub client.
+    #--------------------------------------------------------------------------------
+    def http_call(self, method, url, r, elapsed):
+        key = (method, endpoint(url))
+        # Streamed bodies haven't been read yet; their readers count them (see
+        # body_reader).
+        if getattr(r, '_content_consumed', True):
+            size = len(r.content or '')
+        else:
+            size = 0
+        with self.lock:
+            calls = self.http.setdefault(key, {'calls': 0, 'bytes': 0, 'seconds': 0.0})
+            calls['calls'] += 1
+            calls['bytes'] += size
+            calls['seconds'] += elapsed
+            status = key + (r.status_code,)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    #--------------------------------------------------------------------------------
+    # For a streamed response, a read(n) to call with the size of each chunk of
+    # its body as that's read, e.g. scan_response(r, read=...); the bytes count
+    # towards the endpoint the request went to. None if the body has been read
+    # already (say, from a cassette), as it was counted then.
+    #--------------------------------------------------------------------------------
+    def body_reader(self, method, url, r):
+        if getattr(r, '_content_consumed', True):
+            return None
+        key = (method, endpoint(url))
+        def read(n):
+            with self.lock:
+                calls = self.http.setdefault(key, {'calls': 0, 'bytes': 0, 'seconds': 0.0})
+                calls['bytes'] += n
+        return read
+
+    def retry(self, method, url):
+        self.count(self.retries, (method, endpoint(url)))
+
+    def timeout(self, method, url):
+        self.count(self.timeouts, (method, endpoint(url)))
+
+    def cache_lookup(self, url, hit):
+        self.count(self.cache, (endpoint(url), hit and 'hit' or 'miss'))
+
+    #--------------------------------------------------------------------------------
+    # Exports.
+    #--------------------------------------------------------------------------------
+    def prometheus(self):
+        lines = []
+        with self.lock:
+            lines.append('# HELP triage_phase_seconds Time spent in each phase of triage.')
+            lines.append('# TYPE triage_phase_seconds histogram')
+            for name in sorted(self.phases):
+                h = self.phases[name]
+                cumulative = 0
+                for i, bound in enumerate(BUCKETS):
+                    cumulative += h.counts[i]
+                    lines.append('triage_phase_seconds_bucket{phase="%s",le="%s"} %d' % (name, bound, cumulative))
+                lines.append('triage_phase_seconds_bucket{phase="%s",le="+Inf"} %d' % (name, h.count))
+                lines.append('triage_phase_seconds_sum{phase="%s"} %f' % (name, h.total))
+                lines.append('triage_phase_seconds_count{phase="%s"} %d' % (name, h.count))
+
+            lines.append('# HELP github_http_requests_total HTTP requests made, by endpoint and status.')
+            lines.append('# TYPE github_http_requests_total counter')
+            for (method, path, status), n in sorted(self.statuses.items()):
+                lines.append('github_http_requests_total{method="%s",endpoint="%s",status="%d"} %d' % (method, path, status, n))
+            lines.append('# HELP github_http_response_bytes_total Response body bytes, by endpoint.')
+            lines.append('# TYPE github_http_response_bytes_total counter')
+            for (method, path), calls in sorted(self.http.items()):
+                lines.append('github_http_response_bytes_total{method="%s",endpoint="%s"} %d' % (method, path, calls['bytes']))
+            lines.append('# HELP github_http_seconds_total Time spent waiting on requests, by endpoint.')
+            lines.append('# TYPE github_http_seconds_total counter')
+            for (method, path), calls in sorted(self.http.items()):
+                lines.append('github_http_seconds_total{method="%s",endpoint="%s"} %f' % (method, path, calls['seconds']))
+
+            for metric, table, what in (('github_http_retries_total', self.retries, 'Requests retried'),
+                                        ('github_http_timeouts_total', self.timeouts, 'Requests that timed out')):
+                lines.append('# HELP %s %s, by endpoint.' % (metric, what))
+                lines.append('# TYPE %s counter' % metric)
+                for (method, path), n in sorted(table.items()):
+                    lines.append('%s{method="%s",endpoint="%s"} %d' % (metric, method, path, n))
+
+            lines.append('# HELP github_cache_lookups_total Response cache lookups, by endpoint and result.')
+            lines.append('# TYPE github_cache_lookups_total counter')
+            for (path, result), n in sorted(self.cache.items()):
+                lines.append('github_cache_lookups_total{endpoint="%s",result="%s"} %d' % (path, result, n))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        with self.lock:
+            endpoints = {}
+            for (method, path), calls in self.http.items():
+                entry = dict(calls, seconds=round(calls['seconds'], 6), statuses={},
+                             retries=self.retries.get((method, path), 0),
+                             timeouts=self.timeouts.get((method, path), 0))
+                endpoints['%s %s' % (method, path)] = entry
+            for (method, path, status), n in self.statuses.items():
+                endpoints['%s %s' % (method, path)]['statuses'][str(status)] = n
+
+            cache = {}
+            for (path, result), n in self.cache.items():
+                cache.setdefault(path, {'hit': 0, 'miss': 0})[result] = n
+            for counts in cache.values():
+                counts['hit_ratio'] = round(float(counts['hit']) / (counts['hit'] + counts['miss']), 4)
+
+            return {'started': self.started,
+                    'elapsed': round(time.time() - self.started, 3),
+                    'phases': dict((name, h.summary()) for name, h in self.phases.items()),
+                    'endpoints': endpoints,
+                    'http_calls': sum(calls['calls'] for calls in self.http.values()),
+                    'http_bytes': sum(calls['bytes'] for calls in self.http.values()),
+                    'retries': sum(self.retries.values()),
+                    'timeouts': sum(self.timeouts.values()),
+                    'cache': cache}
+
+    #--------------------------------------------------------------------------------
+    # Write PREFIX.prom and PREFIX.json, and close the trace.
+    #--------------------------------------------------------------------------------
+    def export(self, prefix):
+        f = open(prefix + '.prom', 'w')
+        f.write(self.prometheus())
+        f.close()
+        f = open(prefix + '.json', 'w')
+        json.dump(self.summary(), f, indent=2, sort_keys=True)
+        f.close()
+
+    def close(self):
+        with self.lock:
+            if self.trace is not None:
+                self.trace.close()
+                self.trace = None
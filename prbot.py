@@ -10,27 +10,62 @@
 # Useful! https://developer.github.com/v3/pulls/
 # Useful! https://developer.github.com/v3/issues/comments/
 
-import requests, json, yaml, sys, argparse, time, signal
-
-# Here's a nasty hack to get around the occasional ssl handshake
-# timeout.  Thanks, ssl!
-
-def handler(signum, frame):
-    print 'Signal handler called with signal', signum
-    raise IOError("Oops, SSL sucks!")
-
-# Set up the signal handler
-signal.signal(signal.SIGALRM, handler)
+import requests, yaml, sys, argparse, time, os, atexit, subprocess
+from fetchpool import ordered_map, ReverseListing
+from ghclient import GithubClient, NotFound
+from ghcache import ResponseCache
+from ratelimit import RateLimiter
+from cassette import Cassette
+from statestore import TriageState
+from maintainers import load_index
+from actionplan import PlanWriter, PlanCollector, plan_entry, load_plan, apply_plan, net_labels, label_changes, current_labels, replace_labels
+from diffscan import scan_response
+from commentsummary import fetch_comments
+from ghgraphql import fetch_pulls
+from webhook import Listener
+from workqueue import WorkQueue, worker_id
+from metrics import Metrics
+from prsnapshot import snapshot, decode, comment_page
+from archive import ArchiveWriter, run_archive_path
+from searchplan import candidate_queries, plan_candidates, SearchTooBroad
+from issuesweep import open_items, full_entry
+from mergequeue import MergeQueue
+import prrules
 
 parser = argparse.ArgumentParser(description='Triage various PR queues for Ansible. (NOTE: only useful if you have commit access to the repo in question.)')
 parser.add_argument("ghuser", type=str, help="Github username of triager")
 parser.add_argument("ghpass", type=str, help="Github password of triager")
-parser.add_argument("ghrepo", type=str, choices=['core','extras'], help="Repo to be triaged")
+parser.add_argument("ghrepo", type=str, nargs='+', choices=['core','extras'], help="Repo(s) to be triaged")
 parser.add_argument('--verbose', '-v', action='store_true', help="Verbose output")
-parser.add_argument('--debug', '-d', action='store_true', help="Debug output")
+parser.add_argument('--debug', '-d', action='store_true', help="Debug output (and archive every PR's raw API data, under the statedir)")
+parser.add_argument('--archive', type=str, metavar='ARCHIVE', help="Archive every PR's raw API data to this file")
 parser.add_argument('--pause', '-p', action='store_true', help="Always pause between PRs")
 parser.add_argument('--pr', type=str, help="Triage only the specified pr")
 parser.add_argument('--startat', type=str, help="Start triage at the specified pr")
+parser.add_argument('--workers', '-w', type=int, default=8, help="Number of PRs to fetch in parallel")
+parser.add_argument('--statedir', type=str, default='~/.ansibullbot', help="Where to keep the bot's caches and state between runs")
+parser.add_argument('--no-cache', action='store_true', help="Don't use the on-disk HTTP response cache")
+parser.add_argument('--incremental', action='store_true', help="Skip PRs that haven't changed since they were last triaged, and only fetch new comments")
+parser.add_argument('--search', action='store_true', help="Use the search API to pick out the PRs that may need work, and only fetch those")
+parser.add_argument('--budget-share', type=float, default=0.5, help="Fraction of the hourly API rate limit this bot may use for reads")
+parser.add_argument('--graphql', action='store_true', help="Fetch PR data in batches through the GraphQL API")
+parser.add_argument('--batch-size', type=int, default=50, help="PRs per GraphQL query")
+parser.add_argument('--api-url', type=str, default='https://api.github.com', help="GitHub API root (e.g. a local stand-in for testing)")
+parser.add_argument('--record', type=str, metavar='CASSETTE', help="Record all GitHub traffic from this run to a cassette file")
+parser.add_argument('--replay', type=str, metavar='CASSETTE', help="Run entirely from a recorded cassette, without the network")
+parser.add_argument('--write-reserve', type=int, default=200, help="API calls to hold back for writing labels and comments")
+parser.add_argument('--plan', type=str, metavar='PLANFILE', help="Don't ask or write anything; save all recommended actions to a plan file for review")
+parser.add_argument('--apply', type=str, metavar='PLANFILE', help="Carry out the actions in a (reviewed) plan file, instead of triaging")
+parser.add_argument('--listen', type=int, metavar='PORT', help="Wait for GitHub webhooks on this port, and triage each PR they name (needs --plan)")
+parser.add_argument('--webhook-secret', type=str, help="Secret that webhook deliveries must be signed with")
+parser.add_argument('--debounce', type=float, default=5, help="Seconds a PR must be quiet before a webhook triggers triage")
+parser.add_argument('--schedule', action='store_true', help="Stay running, and re-triage each PR when a 14-day warning on it comes due (needs --plan)")
+parser.add_argument('--queue', type=str, metavar='QUEUEFILE', help="Work queue for a sharded sweep (see --shards, --worker and --report)")
+parser.add_argument('--shards', type=int, help="Queue up all open PRs, triage them with this many worker processes, and report")
+parser.add_argument('--worker', action='store_true', help="Triage PRs from the work queue (e.g. to help out from another host)")
+parser.add_argument('--report', action='store_true', help="Report on the work queue's results (with --plan, also write them out as a plan)")
+parser.add_argument('--metrics', type=str, metavar='PREFIX', help="At the end of the run, write timings and API call counts to PREFIX.prom and PREFIX.json")
+parser.add_argument('--trace', type=str, metavar='TRACEFILE', help="Write a span for every phase of every PR's triage to this file")
 args=parser.parse_args()
 
 #------------------------------------------------------------------------------------
@@ -38,8 +73,11 @@ args=parser.parse_args()
 #------------------------------------------------------------------------------------
 ghuser=args.ghuser
 ghpass=args.ghpass
-ghrepo=args.ghrepo
-repo_url = 'https://api.github.com/repos/ansible/ansible-modules-' + ghrepo + '/pulls'
+ghrepos = []
+for ghrepo in args.ghrepo:
+    if ghrepo not in ghrepos:
+        ghrepos.append(ghrepo)
+api_url = args.api_url.rstrip('/')
 if args.startat:
     startat = args.startat
 else:
@@ -60,9 +98,99 @@ if args.pause:
     always_pause = 'true'
 else:
     always_pause = ''
-args = {'state':'open', 'page':1}
+workers = args.workers
+if args.graphql:
+    graphql = 'true'
+else:
+    graphql = ''
+batch_size = args.batch_size
+graphql_url = api_url + '/graphql'
+statedir = os.path.expanduser(args.statedir)
+if args.record:
+    cassette = Cassette(args.record, 'record')
+    atexit.register(cassette.close)
+elif args.replay:
+    cassette = Cassette(args.replay, 'replay')
+else:
+    cassette = None
+# Comment ages are judged against this clock. A replay uses the time the cassette
+# was recorded, so it comes to the same decisions every time.
+if args.replay:
+    clock = lambda: cassette.recorded_at
+else:
+    clock = time.time
+# The cache would make what goes over the wire depend on earlier runs, so it's
+# off while recording or replaying.
+if args.no_cache or cassette:
+    cache = None
+else:
+    cache = ResponseCache(os.path.join(statedir, 'httpcache.db'))
+ratelimit = RateLimiter(share=args.budget_share, reserve=args.write_reserve)
+# Metrics are cheap to keep, so we always keep them; they're only written out
+# if asked for.
+metrics = Metrics(trace=args.trace)
+atexit.register(metrics.close)
+if args.metrics:
+    atexit.register(metrics.export, args.metrics)
+gh = GithubClient(ghuser, ghpass, pool_size=workers, cache=cache, ratelimit=ratelimit,
+                  cassette=cassette, metrics=metrics)
+if args.incremental:
+    incremental = 'true'
+else:
+    incremental = ''
+# A replay didn't really happen, so it mustn't leave its triage, comment
+# summaries or sweep times in the real state; it gets a throwaway one.
+if args.replay:
+    state = TriageState(':memory:')
+else:
+    state = TriageState(os.path.join(statedir, 'triage.db'))
+if args.worker:
+    # Workers never ask; the actions go back to the queue with the results.
+    plan = PlanCollector()
+elif args.plan:
+    plan = PlanWriter(args.plan)
+    atexit.register(plan.close)
+else:
+    plan = None
+if args.archive or debug:
+    archive = ArchiveWriter(args.archive or run_archive_path(statedir, 'prbot'))
+    atexit.register(archive.close)
+    print "ARCHIVE: raw API data goes to", archive.path
+else:
+    archive = None
+if args.queue:
+    queue = WorkQueue(args.queue)
+elif args.shards or args.worker or args.report:
+    parser.error("--shards, --worker and --report need a --queue")
+if single_pr and (len(ghrepos) > 1):
+    parser.error("--pr needs a single repo")
+# Nobody is at the terminal to answer prompts for a listener or the scheduler,
+# so their actions go into a plan.
+if args.listen and not args.plan:
+    parser.error("--listen runs unattended, so it needs a --plan to write its actions to")
+if args.schedule and not args.plan:
+    parser.error("--schedule runs unattended, so it needs a --plan to write its actions to")
+
+#------------------------------------------------------------------------------------
+# The repos we triage, each with its maintainers. We name a repo by its full
+# name (ansible/ansible-modules-core) from here on.
+#------------------------------------------------------------------------------------
+maintainer_files = {'core': 'MAINTAINERS-CORE.txt', 'extras': 'MAINTAINERS-EXTRAS.txt'}
+repo_names = []
+maintainer_indexes = {}
+for ghrepo in ghrepos:
+    repo_name = 'ansible/ansible-modules-' + ghrepo
+    repo_names.append(repo_name)
+    maintainer_indexes[repo_name] = load_index(maintainer_files[ghrepo], statedir)
+
+def pulls_url(repo_name):
+    return api_url + '/repos/' + repo_name + '/pulls'
+
 botlist = ['gregdek','robynbergeron']
 
+# Roughly how many API calls it takes to triage one PR.
+calls_per_item = 3
+
 #------------------------------------------------------------------------------------
 # Here's the boilerplate text.
 #------------------------------------------------------------------------------------
@@ -82,83 +210,106 @@ boilerplate = {
 }
 
 #------------------------------------------------------------------------------------
-# Here's the triage function. It takes a PR id and does all of the necessary triage
-# stuff.
+# Here's the fetch function. It takes a repo and a PR url in it, and pulls down
+# everything triage needs (the pull, the files in its diff, its issue and its
+# comments) into one compact PullSnapshot (see prsnapshot.py); the raw JSON is
+# dropped once that's built. If we already have the PR's issue (from the
+# /issues listing), it isn't fetched again. It runs in worker threads, so it
+# must not touch anything triage() changes.
 #------------------------------------------------------------------------------------
 
-def triage(urlstring):
+def fetch_pr(repo_name, urlstring, issue=None):
     #----------------------------------------------------------------------------
     # Get the more detailed PR data from the API:
     #----------------------------------------------------------------------------
     if verbose:
         print "URLSTRING: ", urlstring
 
-    signal.alarm(5)
-    while True:
-        try:
-            pull = requests.get(urlstring, auth=(ghuser,ghpass)).json()
-            break # because pull worked
-        except:
-            print "Timeout, retrying..."
-    signal.alarm(0)
+    item = repo_name + '#' + urlstring.split('/')[-1]
+    with metrics.phase('pull', item):
+        r = gh.get(urlstring)
+        if r.status_code == 404:
+            raise NotFound('%s: GitHub has no such PR' % item)
+        pull = decode(r)
+
+    #----------------------------------------------------------------------------
+    # Now stream the diff, keeping only the list of files it touches.
+    #----------------------------------------------------------------------------
+    with metrics.phase('diff', item):
+        r = gh.get(pull['diff_url'], verify=False, stream=True)
+        files = scan_response(r, read=metrics.body_reader('GET', pull['diff_url'], r))
+
+    #----------------------------------------------------------------------------
+    # The issue (for labels), unless the listing gave it to us, and the comments.
+    #----------------------------------------------------------------------------
+    if issue is None:
+        with metrics.phase('issue', item):
+            issue = decode(gh.get(pull['issue_url']))
 
     #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    # DEBUG: Dump JSON to /tmp for analysis if needed
+    # DEBUG: Archive the raw JSON for analysis if needed
     #++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++++
-    if debug:
-        debugfileid = '/tmp/pull-' + str(pull['number'])
-        print "DEBUG JSON TO: ", debugfileid
-        debugfile = open(debugfileid, 'w')
-        print >>debugfile, json.dumps(pull, ensure_ascii=True, indent=4, separators=(',', ': '))
-        debugfile.close()
-        
+    if archive:
+        archive.add(repo_name, pull['number'], pull=pull, issue=issue,
+                    files=[{'path': f.path, 'new_file': f.new_file, 'deleted': f.deleted} for f in files])
+    # In incremental mode, only comments we haven't seen before are fetched.
+    # Otherwise triage walks the thread from the newest page back, fetching
+    # older pages only if it needs them (so those count towards the rules).
+    # (The listing holds on to just the url, not the whole pull.) Any pages
+    # fetched are archived along with the rest.
+    comments_url = pull['comments_url']
+    with metrics.phase('comments', item):
+        if incremental:
+            comments = fetch_comments(gh, state, repo_name, pull['number'], comments_url, botlist,
+                                      archive=archive)
+        else:
+            get_page = lambda page: gh.get(comments_url, verify=False, params={'per_page': 100, 'page': page})
+            if archive:
+                get_page = archive.comment_pages(repo_name, pull['number'], get_page)
+            comments = ReverseListing(get_page, convert=comment_page)
+
+    return snapshot(repo_name, pull, issue, files, comments)
+
+#------------------------------------------------------------------------------------
+# Here's the GraphQL version of the fetch function. It takes a repo and a list of
+# PR numbers in it, and pulls down the same snapshots as fetch_pr() for all of
+# them in one query.
+#------------------------------------------------------------------------------------
+
+def fetch_pr_batch(repo_name, numbers):
+    if verbose:
+        print "GRAPHQL BATCH: ", numbers
+    owner, name = repo_name.split('/')
+    with metrics.phase('graphql_batch', '%s#%s' % (repo_name, ','.join(str(n) for n in numbers))):
+        return fetch_pulls(gh, graphql_url, owner, name, numbers, api_url=api_url, archive=archive)
+
+#------------------------------------------------------------------------------------
+# Here's the triage function. It takes a snapshot from fetch_pr() and does all of
+# the necessary triage stuff. It hands back the actions it recommended, and when
+# (if ever) a timeout rule will next come due for this PR.
+#------------------------------------------------------------------------------------
+
+def triage(pr):
+    repo_name = pr.repo
+    files = pr.files
+    item = repo_name + '#' + str(pr.number)
+
     #----------------------------------------------------------------------------
     # Initialize an empty local list of PR labels; we'll need it later.
     #----------------------------------------------------------------------------
     pr_labels = []
-    
+
     #----------------------------------------------------------------------------
-    # Pull the list of files being edited so we can find maintainers.
-    # (Warn if there's more than one; we can't handle that case yet.)
+    # Go through the list of files being edited so we can find maintainers.
+    # (Warn if there's more than one python file; we don't have a real policy
+    # for that case yet, so for now everyone who maintains any of the files
+    # counts as a maintainer of the PR.)
     #----------------------------------------------------------------------------
-    # Now pull the text of the diff.
-
-    signal.alarm(5)
-    while True:
-        try:
-            diff = requests.get(pull['diff_url'], auth=(ghuser,ghpass), verify=False).text
-            break # because pull worked
-        except:
-            print "Timeout, retrying..."
-    signal.alarm(0)
-
-    if debug:
-        debugfileid = '/tmp/diff-' + str(pull['number'])
-        print "DEBUG DIFF TO: ", debugfileid
-        debugfile = open(debugfileid, 'w')
-        print >>debugfile, json.dumps(diff, ensure_ascii=True, indent=4, separators=(',', ': '))
-        debugfile.close()
- 
-    # Grep the diff for affected files.
-    pr_contains_new_file = ''
+    pr_files = [f.path for f in files]
     pyfilecounter = 0
-    for line in diff.split('\n'):
-        #------------------------------------------------------------------------
-        # If there's a line that contains "--- /dev/null" then we know this PR
-        # contains a new file. Set that so we can handle properly later.
-        #------------------------------------------------------------------------
-        if '--- /dev/null' in line:
-            pr_contains_new_file = 'True'
-        #------------------------------------------------------------------------
-        # If there's a "diff git", that contains the file name being edited.
-        #------------------------------------------------------------------------
-        if 'diff --git' in line:
-            # This split gives us the file name.
-            pr_filename = line.split(' b/')[1]
-            # Another split gives us the extension.
-            pr_fileextension = pr_filename.split('.')[-1]
-            if pr_fileextension == 'py':
-                pyfilecounter += 1
+    for f in files:
+        if f.path.split('.')[-1] == 'py':
+            pyfilecounter += 1
     # if multiple .py files are included in the diff, complain.
     if pyfilecounter == 0:
         if verbose:
@@ -167,311 +318,72 @@ def triage(urlstring):
         if verbose:
             print "  WARN: multiple python files in this PR"
     if verbose:
-        print "  Filename:", pr_filename
+        print "  Filename(s):", pr_files
 
     #----------------------------------------------------------------------------
     # Look up the files in the local DB to see who maintains them.
-    # (Warn if there's more than one; we can't handle that case yet.)
     #----------------------------------------------------------------------------
     pr_maintainers_list = []
-    if ghrepo == "core":
-        f = open('MAINTAINERS-CORE.txt')
-    elif ghrepo == "extras":
-        f = open('MAINTAINERS-EXTRAS.txt')
-    for line in f:
-        owner_space = (line.split(': ')[0]).strip()
-        if owner_space in pr_filename:
-            maintainers_string = (line.split(': ')[-1]).strip()
-            for maintainer in maintainers_string.split(' '):
-                pr_maintainers_list.append(maintainer)
-    f.close()
-
+    with metrics.phase('maintainers', item):
+        for pr_filename in pr_files:
+            for maintainer in maintainer_indexes[repo_name].lookup(pr_filename):
+                if maintainer not in pr_maintainers_list:
+                    pr_maintainers_list.append(maintainer)
     pr_maintainers = ' '.join(pr_maintainers_list)
 
     #----------------------------------------------------------------------------
     # Pull the list of labels on this PR and shove them into pr_labels.
     #----------------------------------------------------------------------------
-    signal.alarm(5)
-    while True:
-        try:
-            issue = requests.get(pull['issue_url'], auth=(ghuser,ghpass)).json()
-            break # because pull worked
-        except:
-            print "Timeout, retrying..."
-    signal.alarm(0)
-
     # Print labels for now, so we know whether we're doing the right things
-    for label in issue['labels']:
-        pr_labels.append(label['name'])
+    for label in pr.labels:
+        pr_labels.append(label)
 
     #----------------------------------------------------------------------------
     # Get and print key info about the PR.
     #----------------------------------------------------------------------------
     print " "
     print "****************************************************"
-    print pull['number'], '---', pull['title']
-    pr_submitter = pull['user']['login']
+    print pr.number, '---', pr.title
+    pr_submitter = pr.submitter
     print "  Labels: ", pr_labels
     print "  Submitter: ", pr_submitter
     print "  Maintainer(s): ", pr_maintainers
-    print "  Filename(s): ", pr_filename
+    print "  Filename(s): ", ' '.join(pr_files)
     print " "
     if verbose:
-        print pull['body']
-
-    #----------------------------------------------------------------------------
-    # NOW: We have everything we need to do actual triage. In triage, we 
-    # assess the actions that need to be taken and push them into a list. 
-    # Get our comments, and set our empty actions list.
-    #----------------------------------------------------------------------------
-    signal.alarm(5)
-    while True:
-        try:
-            comments = requests.get(pull['comments_url'], auth=(ghuser,ghpass), verify=False)
-            break # because pull worked
-        except:
-            print "Timeout, retrying..."
-    signal.alarm(0)
-
-    actions = []
- 
-    #----------------------------------------------------------------------------
-    # Kill all P3-P5 tags, every time. No more low priority tags.
-    #----------------------------------------------------------------------------
-    if ('P3') in pr_labels:
-        actions.append("unlabel: P3")
-    if ('P4') in pr_labels:
-        actions.append("unlabel: P4")
-    if ('P5') in pr_labels:
-        actions.append("unlabel: P5")
+        print pr.body
 
     #----------------------------------------------------------------------------
-    # Now, we handle the "no triaged labels" case: i.e. if none of the 
-    # following labels are present: community_review, core_review, needs_revision,
-    # needs_rebase, shipit.
+    # NOW: We have everything we need to do actual triage. The rules themselves
+    # live in prrules; they hand back the actions to take, plus any notes worth
+    # showing in verbose mode.
     #----------------------------------------------------------------------------
-
-    if (('community_review' not in pr_labels)
-      and ('core_review' not in pr_labels)
-      and ('needs_revision' not in pr_labels)
-      and ('needs_info' not in pr_labels)
-      and ('needs_rebase' not in pr_labels)
-      and ('shipit' not in pr_labels)):
-        if ('stable' in pull['base']['ref']):
-            actions.append("newlabel: core_review")
-            actions.append("newlabel: backport")
-            actions.append("boilerplate: backport")
-        elif ('ansible' in pr_maintainers):
-            actions.append("newlabel: core_review")
-            actions.append("boilerplate: core_review_existing")
-        elif (pr_maintainers == '') and (pr_contains_new_file):
-            actions.append("newlabel: community_review")
-            actions.append("newlabel: new_plugin")
-            actions.append("boilerplate: community_review_new")
-        elif (pr_maintainers == '') and (not pr_contains_new_file):
-            print "FATAL: existing file without reviewer found! Please add to CONTRIBUTORS file."
-            sys.exit(1)
-        elif (pr_submitter in pr_maintainers):
-            actions.append("newlabel: shipit")
-            actions.append("newlabel: owner_pr")
-            actions.append("boilerplate: shipit_owner_pr")
-        else:
-            actions.append("newlabel: community_review")
-            actions.append("boilerplate: community_review_existing")
- 
-    #------------------------------------------------------------------------
-    # Does this PR need to be (newly) rebased? If so, label and boilerplate.
-    #------------------------------------------------------------------------
-    if (pull['mergeable'] == False):
+    if (pr.mergeable == False):
         print "WARN: not mergeable!"
-        if ('needs_rebase' not in pr_labels):
-            actions.append("newlabel: needs_rebase")
-            actions.append("unlabel: community_review")
-            actions.append("unlabel: core_review")
-            actions.append("boilerplate: needs_rebase")
-
-    #------------------------------------------------------------------------
-    # Has PR been rebased at our request? If so, remove needs_rebase
-    # label and put into the appropriate review state.
-    #------------------------------------------------------------------------
-    if ((pull['mergeable'] == True)
-      and ('needs_rebase' in pr_labels)):
-        actions.append("unlabel: needs_rebase")
-        if ('ansible' in pr_maintainers):
-            actions.append("newlabel: core_review")
-            actions.append("boilerplate: core_review_existing")
-        elif (pr_maintainers == '') and (pr_contains_new_file):
-            actions.append("newlabel: community_review")
-            actions.append("boilerplate: community_review_new")
-        else:
-            actions.append("newlabel: community_review")
-            actions.append("boilerplate: community_review_existing")
+    elif (pr.mergeable is None):
+        print "WARN: GitHub hasn't said whether this is mergeable yet; will check again later"
 
     #----------------------------------------------------------------------------
-    # Now let's add filename-based labels: cloud, windows, networking.
-    # label and put into the appropriate review state.
+    # Over REST, the rules may walk back into older comment pages, which are
+    # only fetched then; that time counts towards the comments, not the rules.
+    # A page that can't be fetched raises (a RequestException) out of here.
     #----------------------------------------------------------------------------
-    if (pr_filename.split('/')[0] == 'cloud') and ('cloud' not in pr_labels):
-        actions.append("newlabel: cloud")
-    if (pr_filename.split('/')[0] == 'network') and ('networking' not in pr_labels):
-        actions.append("newlabel: networking")
-    if (pr_filename.split('/')[0] == 'windows') and ('windows' not in pr_labels):
-        actions.append("newlabel: windows")
-
-    #----------------------------------------------------------------------------
-    # OK, now we start walking through comment-based actions, and push whatever
-    # we find into the action list. 
-    #
-    # NOTE: we walk through comments MOST RECENT FIRST. Whenever we find a
-    # meaningful state change from the comments, we break; thus, we are always
-    # acting on what we perceive to be the most recent meaningful comment, and
-    # we ignore all older comments.
-    #----------------------------------------------------------------------------
-    for comment in reversed(comments.json()):
-            
-        if verbose:
-            print " " 
-            print "==========>  Comment at ", comment['created_at'], " from: ", comment['user']['login']
-            print comment['body']
-
-        #------------------------------------------------------------------------
-        # Is the last useful comment from a bot user?  Then we've got a potential 
-        # timeout case.  Let's explore!
-        #------------------------------------------------------------------------
-        if (comment['user']['login'] in botlist):
-
-            #--------------------------------------------------------------------
-            # Let's figure out how old this comment is, exactly.
-            #--------------------------------------------------------------------
-            comment_time = time.mktime((time.strptime(comment['created_at'], "%Y-%m-%dT%H:%M:%SZ")))
-            comment_days_old = (time.time()-comment_time)/86400
-
-            #--------------------------------------------------------------------
-            # Is it more than 14 days old? That kinda sucks; we should do
-            # something about it!
-            #--------------------------------------------------------------------
-
-            if comment_days_old > 14:
-
-                #----------------------------------------------------------------
-                # We know we've hit a timeout threshhold. Which one? 
-                #----------------------------------------------------------------
-
-                #----------------------------------------------------------------
-                # If it's in core review, we just leave it be and break.
-                # (We'll set a different threshhold for core_review PRs
-                # in the future.)
-                #----------------------------------------------------------------
-                if 'core_review' in pr_labels:
-                    break
-             
-                #----------------------------------------------------------------
-                # If it's in needs_review or needs_rebase and no previous 
-                # warnings have been issued, warn submitter and break.
-                #----------------------------------------------------------------
-                elif (('pending' not in comment['body']) 
-                  and (('needs_revision' in pr_labels) or ('needs_rebase' in pr_labels))):
-                    actions.append("boilerplate: submitter_first_warning")
-                    break 
-
-                #----------------------------------------------------------------
-                # If it's in community_review and no previous # warnings have 
-                # been issued, and it's not a new module (we let new modules
-                # stay in review indefinitely), warn maintainer and break.
-                #----------------------------------------------------------------
-                elif (('pending' not in comment['body']) 
-                  and ('community_review' in pr_labels)
-                  and ('new_plugin' not in pr_labels)):
-                    actions.append("boilerplate: maintainer_first_warning")
-                    break 
-                
-                #----------------------------------------------------------------
-                # If it's in needs_revision or needs_rebase and a previous 
-                # warning has been issued, place in pending_action, give the
-                # submitter a second warning, and break.
-                #----------------------------------------------------------------
-                elif (('pending' in comment['body']) 
-                  and (('needs_revision' in pr_labels) or ('needs_rebase' in pr_labels))):
-                    actions.append("boilerplate: submitter_second_warning")
-                    actions.append("label: pending_action")
-                    break 
-
-                #----------------------------------------------------------------
-                # If it's in community_review, not new_plugin, and a previous 
-                # warning has been issued, place in pending_action, give the 
-                # maintainer a second warning, and break.
-                #----------------------------------------------------------------
-                elif (('pending' in comment['body']) 
-                  and ('community_review' in pr_labels)
-                  and ('new_plugin' not in pr_labels)):
-                    actions.append("boilerplate: maintainer_second_warning")
-                    actions.append("label: pending_action")
-                    break 
-                        
-            if verbose:
-                print "  STATUS: no useful state change since last pass (", comment['user']['login'], ")"
-                print "  Days since last bot comment: ", comment_days_old
-
-            break
-
-        #------------------------------------------------------------------------
-        # Has maintainer said 'shipit'? Then label/boilerplate/break.
-        #------------------------------------------------------------------------
-        if ((comment['user']['login'] in pr_maintainers)
-          and ('shipit' in comment['body'])):
-            actions.append("unlabel: community_review")
-            actions.append("unlabel: core_review")
-            actions.append("unlabel: needs_info")
-            actions.append("unlabel: needs_revision")
-            actions.append("unlabel: pending_action")
-            actions.append("newlabel: shipit")
-            actions.append("boilerplate: shipit")
-            break
-
-        #------------------------------------------------------------------------
-        # Has maintainer said 'needs_revision'? Then label/boilerplate/break.
-        #------------------------------------------------------------------------
-        if ((comment['user']['login'] in pr_maintainers)
-          and ('needs_revision' in comment['body'])):
-            actions.append("unlabel: community_review")
-            actions.append("unlabel: core_review")
-            actions.append("unlabel: needs_info")
-            actions.append("unlabel: shipit")
-            actions.append("unlabel: pending_action")
-            actions.append("newlabel: needs_revision")
-            actions.append("boilerplate: needs_revision")
-            break
+    fetching = getattr(pr.comments, 'fetching', 0.0)
+    rules_started = time.time()
+    try:
+        actions, warning_due, notes = prrules.decide(pr, pr_maintainers_list, botlist, clock(), verbose=verbose)
+    except prrules.MissingMaintainers, e:
+        print "FATAL:", e
+        sys.exit(1)
+    finally:
+        fetching = getattr(pr.comments, 'fetching', 0.0) - fetching
+        if fetching:
+            metrics.observe('comments', fetching, item)
+        metrics.observe('rules', time.time() - rules_started - fetching, item, rules_started)
 
-        #------------------------------------------------------------------------
-        # Has submitter said 'ready_for_review'? Then label/boilerplate/break.
-        #------------------------------------------------------------------------
-        if ((comment['user']['login'] == pr_submitter)
-          and ('ready_for_review' in comment['body'])):
-            actions.append("unlabel: needs_revision")
-            actions.append("unlabel: needs_info")
-            actions.append("unlabel: pending_action")
-            if ('ansible' in pr_maintainers):
-                actions.append("newlabel: core_review")
-                actions.append("boilerplate: core_review_existing")
-            elif (pr_maintainers == ''):
-                actions.append("newlabel: community_review")
-                actions.append("boilerplate: community_review_new")
-            else:
-                actions.append("newlabel: community_review")
-                actions.append("boilerplate: community_review_existing")
-            break
-
-        #------------------------------------------------------------------------
-        # Have submitter or maintainer said something else? Then they're 
-        # likely discussing issues with the PR; that makes this comment 
-        # "useful", so we'll break here so as not to trigger the timeout
-        # workflow.
-        #------------------------------------------------------------------------
-        if ((comment['user']['login'] in pr_maintainers)
-          or (comment['user']['login'] == pr_submitter)):
-            if verbose:
-                print "  Conversation about this PR onging"
-            break
+    if verbose:
+        for note in notes:
+            print note
 
     #----------------------------------------------------------------------------
     # OK, this PR is done! Now let's print out the list of actions we tallied.
@@ -483,7 +395,7 @@ def triage(urlstring):
     #----------------------------------------------------------------------------
 
     print " "
-    print "RECOMMENDED ACTIONS for ", pull['html_url']
+    print "RECOMMENDED ACTIONS for ", pr.html_url
     if actions == []:
         print "  None required"
     else:
@@ -492,6 +404,22 @@ def triage(urlstring):
 
     print " "
 
+    #----------------------------------------------------------------------------
+    # In plan mode, we don't ask; the actions go into the plan for review, with
+    # the comments written out in full.
+    #----------------------------------------------------------------------------
+    if plan:
+        if actions:
+            def text(name):
+                if name not in boilerplate:
+                    return None
+                # A hack to make the @ signs line up for multiple maintainers
+                return boilerplate[name].format(m=pr_maintainers.replace(' ', ' @'), s=pr_submitter)
+            plan.add(plan_entry(repo_name, pr.number, pr.html_url, pr.issue_url, pr.updated_at,
+                                pr_labels, actions, text))
+            print "Added to plan."
+        return actions, warning_due
+
     cont = ''
 
     # If there are actions, ask if we should take them. Otherwise, skip.
@@ -503,36 +431,27 @@ def triage(urlstring):
         #------------------------------------------------------------------------
         # Now we start actually writing to the issue itself.
         #------------------------------------------------------------------------
-        print "LABELS_URL: ", issue['labels_url']
-        print "COMMENTS_URL: ", pull['comments_url']
-        for action in actions:
+        writes_started = time.time()
+        print "LABELS_URL: ", pr.labels_url
+        print "COMMENTS_URL: ", pr.comments_url
 
-            if "unlabel" in action:
-                oldlabel = action.split(': ')[-1]
-                # Don't remove it if it isn't there
-                if oldlabel in pr_labels:
-                    pr_actionurl = issue['labels_url'].split("{")[0] + "/" + oldlabel
-                    # print "URL for DELETE: ", pr_actionurl
-                    try:
-                        r = requests.delete(pr_actionurl, auth=(ghuser,ghpass))
-                        # print r.text
-                    except requests.exceptions.RequestException as e:
-                        print e
-                        sys.exit(1)
-
-            if "newlabel" in action:
-                newlabel = action.split(': ')[-1]
-                if newlabel not in pr_labels:
-                    pr_actionurl = issue['labels_url'].split("{")[0]
-                    payload = '["' + newlabel +'"]'
-                    # print "URL for POST: ", pr_actionurl
-                    # print "  PAYLOAD: ", payload
-                    try:
-                        r = requests.post(pr_actionurl, data=payload, auth=(ghuser, ghpass))
-                        # print r.text
-                    except requests.exceptions.RequestException as e:
-                        print e
-                        sys.exit(1)
+        #------------------------------------------------------------------------
+        # All the label actions come down to one new set of labels, which
+        # goes out in a single call (if anything needs changing at all). That
+        # call replaces the lot, so it starts from the labels as they are now;
+        # the ones we triaged on may be hours old by the time anyone says y.
+        #------------------------------------------------------------------------
+        try:
+            labels_now = current_labels(gh, pr.issue_url)
+            new_labels = net_labels(labels_now, actions)
+            if label_changes(labels_now, new_labels):
+                r = replace_labels(gh, pr.labels_url, new_labels)
+                # print r.text
+        except requests.exceptions.RequestException as e:
+            print e
+            sys.exit(1)
+
+        for action in actions:
 
             if "boilerplate" in action:
                 # A hack to make the @ signs line up for multiple maintainers
@@ -541,65 +460,495 @@ def triage(urlstring):
                 boilerout = action.split(': ')[-1]
                 newcomment = boilerplate[boilerout].format(m=mtext,s=stext)
                 payload = '{"body": "' + newcomment + '"}'
-                pr_actionurl = issue['comments_url']
+                pr_actionurl = pr.comments_url
                 # print "URL for POST: ", pr_actionurl
                 # print "  PAYLOAD: ", payload
                 try:
-                    signal.alarm(5)
-                    r = requests.post(pr_actionurl, data=payload, auth=(ghuser, ghpass))
-                    signal.alarm(0)
+                    r = gh.post(pr_actionurl, data=payload)
                     # print r.text
                 except requests.exceptions.RequestException as e:
                     print e
                     sys.exit(1)
+
+        metrics.observe('writes', time.time() - writes_started, item, writes_started)
                         
     else:
         print "Skipping."
 
+    return actions, warning_due
+
+
+#------------------------------------------------------------------------------------
+# Remember the result of triaging a PR. If we never found out whether it's
+# mergeable, it may need a rebase we couldn't see, so we set a timer to look at
+# it again before long rather than waiting for it to change.
+#------------------------------------------------------------------------------------
+
+MERGEABLE_RECHECK = 60 * 60
+
+def record(pr, actions, due):
+    if pr.mergeable is None:
+        recheck = time.time() + MERGEABLE_RECHECK
+        if (due is None) or (recheck < due):
+            due = recheck
+    state.record(pr.repo, pr.number, pr.updated_at, actions, due, kind='pull')
+
+#------------------------------------------------------------------------------------
+# Fetch, triage and record a single PR, by number. There's nothing else to get on
+# with meanwhile, so if GitHub hasn't worked out whether it's mergeable yet, we
+# wait here while it's asked again (see mergequeue.py).
+#------------------------------------------------------------------------------------
+
+def fetch_one(repo_name, number):
+    if graphql:
+        prs = fetch_pr_batch(repo_name, [number])
+        if not prs:
+            raise NotFound('%s#%s: GitHub has no such PR' % (repo_name, number))
+        return prs[0]
+    return fetch_pr(repo_name, pulls_url(repo_name) + "/" + str(number))
+
+def triage_one(repo_name, number):
+    pr = fetch_one(repo_name, number)
+    if pr.mergeable is None:
+        if verbose:
+            print "MERGEABLE UNKNOWN ", pr.number, "; asking again"
+        mergeq.poll(pr)
+    actions, due = triage(pr)
+    record(pr, actions, due)
+    return pr, actions
+
+#------------------------------------------------------------------------------------
+# Triage and record a PR during a sweep. Older comment pages can still be
+# fetched while the rules run (see triage()); if one can't be, the PR is
+# reported and left unrecorded on the sweep's `failed` list, just like one that
+# failed to fetch in the first place.
+#------------------------------------------------------------------------------------
+
+def triage_in_sweep(pr, failed):
+    try:
+        actions, due = triage(pr)
+    except requests.exceptions.RequestException as e:
+        print "FAILED", pr.repo, pr.number, ":", e.__class__.__name__, e
+        failed.append(pr.number)
+        return
+    record(pr, actions, due)
+
+#------------------------------------------------------------------------------------
+# Ask GitHub again whether a PR is mergeable (for the MergeQueue; see
+# mergequeue.py). The pull is all it takes.
+#------------------------------------------------------------------------------------
+
+def refresh_mergeable(pr):
+    with metrics.phase('mergeable', '%s#%s' % (pr.repo, pr.number)):
+        return decode(gh.get(pulls_url(pr.repo) + "/" + str(pr.number)))['mergeable']
+
+#------------------------------------------------------------------------------------
+# Walk a repo's /issues listing (all the pages at once) and hand back every open
+# PR we want, as its issue entry; see issuesweep.py. With --search, only the
+# PRs the search API (and our own state) say may need work are handed back
+# instead; see searchplan.py. That needs an earlier full sweep to go on, and a
+# search that isn't too broad to trust; otherwise we list everything after all.
+#------------------------------------------------------------------------------------
+
+def listed_pulls(repo_name):
+    return open_items(gh, api_url, repo_name, 'pull', workers=workers)
+
+def searched_pulls(repo_name):
+    since = state.last_sweep(repo_name, 'pull')
+    if since is None:
+        print "SEARCH: no earlier sweep of", repo_name, "to go on; listing every open PR"
+        return listed_pulls(repo_name)
+    try:
+        candidates = plan_candidates(gh, api_url, candidate_queries(repo_name, 'pr', since),
+                                     state.outstanding(repo_name, 'pull'))
+    except SearchTooBroad as e:
+        print "SEARCH:", e, "; listing every open PR"
+        return listed_pulls(repo_name)
+    print "SEARCH:", len(candidates), "PRs in", repo_name, "may need work"
+    return candidates
+
+def open_pulls(repo_name):
+    if args.search:
+        shortpulls = searched_pulls(repo_name)
+    else:
+        shortpulls = listed_pulls(repo_name)
+
+    for shortpull in shortpulls:
+        if (int(shortpull['number']) > int(startat)):
+            print "SKIPPING ", shortpull['number']
+        elif incremental and not state.needs_triage(repo_name, shortpull['number'], shortpull['updated_at']):
+            if verbose:
+                print "UNCHANGED ", shortpull['number']
+        else:
+            yield shortpull
+
+#------------------------------------------------------------------------------------
+# Fetch all the open PRs we want from a repo, several at a time, and hand back
+# their snapshots in listing order. In GraphQL mode, the PRs are grouped into
+# batches, and each batch is fetched with one query. Over REST, a PR that came
+# from the listing brings its issue with it. (Search results can lag behind
+# the PRs themselves, so a PR that came from a search has its issue fetched.)
+# A PR (or batch) that fails to fetch is reported and left out, and its number
+# goes on the `failed` list; the sweep carries on with the rest. Each snapshot's
+# updated_at is the one its listing entry gave, so that what we record is just
+# what the next --incremental sweep compares it with (see open_pulls).
+#------------------------------------------------------------------------------------
+
+def open_pull_batches(shortpulls):
+    batch = []
+    for shortpull in shortpulls:
+        batch.append(shortpull['number'])
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def fetched_pulls(repo_name, failed):
+    listed = {}
+    def shortpulls():
+        for shortpull in open_pulls(repo_name):
+            listed[int(shortpull['number'])] = shortpull['updated_at']
+            yield shortpull
+
+    if graphql:
+        def fetch(numbers):
+            try:
+                return numbers, fetch_pr_batch(repo_name, numbers), None
+            except Exception as e:
+                return numbers, [], e
+        results = ordered_map(fetch, open_pull_batches(shortpulls()), workers=workers)
+    else:
+        def fetch(shortpull):
+            issue = None
+            if full_entry(shortpull):
+                issue = shortpull
+            url = pulls_url(repo_name) + "/" + str(shortpull['number'])
+            try:
+                return [shortpull['number']], [fetch_pr(repo_name, url, issue)], None
+            except Exception as e:
+                return [shortpull['number']], [], e
+        results = ordered_map(fetch, shortpulls(), workers=workers)
+
+    for numbers, prs, e in results:
+        if e is not None:
+            for number in numbers:
+                print "FAILED", repo_name, number, ":", e.__class__.__name__, e
+            failed.extend(numbers)
+        for pr in prs:
+            pr.updated_at = listed.pop(int(pr.number), pr.updated_at)
+            yield pr
+
+#------------------------------------------------------------------------------------
+# Sharded sweeps. The coordinator queues up every open PR we want, from all the
+# repos, and starts worker processes: copies of this run, with --worker in
+# place of --shards, each taking an even part of the rate limit budget, and each
+# logging to a file next to the queue. Workers triage PRs from the queue until
+# it's empty, and the results are reported on together at the end. Like a
+# sweep, a worker puts aside PRs whose mergeability GitHub doesn't know yet,
+# carries on claiming others, and triages them as the answers come in; it holds
+# on to (and keeps renewing) their leases meanwhile, and waits for the last of
+# them before it goes looking for more work.
+#------------------------------------------------------------------------------------
+
+def queue_items():
+    for repo_name in repo_names:
+        for shortpull in open_pulls(repo_name):
+            yield repo_name, shortpull['number'], shortpull['updated_at']
+
+def worker_argv(n):
+    argv = [sys.executable, sys.argv[0]]
+    skip = 0
+    for arg in sys.argv[1:]:
+        if skip:
+            skip -= 1
+        elif arg in ('--shards', '--plan', '--metrics', '--trace', '--archive'):
+            skip = 1
+        elif arg.split('=')[0] in ('--shards', '--plan', '--metrics', '--trace', '--archive', '--report'):
+            pass
+        else:
+            argv.append(arg)
+    # Each worker keeps its own metrics, trace and archive.
+    if args.metrics:
+        argv += ['--metrics', '%s.worker%d' % (args.metrics, n)]
+    if args.trace:
+        argv += ['--trace', '%s.worker%d' % (args.trace, n)]
+    if args.archive:
+        argv += ['--archive', '%s.worker%d' % (args.archive, n)]
+    return argv + ['--worker', '--budget-share', str(args.budget_share / args.shards)]
+
+def run_shards():
+    count = queue.fill(queue_items())
+    print "QUEUE:", count, "PRs queued in", queue.path
+
+    procs = []
+    for n in range(args.shards):
+        log = open('%s.worker%d.log' % (queue.path, n), 'w')
+        procs.append(subprocess.Popen(worker_argv(n), stdout=log, stderr=subprocess.STDOUT))
+        log.close()
+    print "QUEUE: started", len(procs), "workers; their output is in", queue.path + ".worker*.log"
+    for proc in procs:
+        proc.wait()
+
+def work_queue():
+    owner = worker_id()
+    # The lease renewals for the PRs we hold, by (repo, number); see WorkQueue.keep.
+    leases = {}
+
+    def release(repo_name, number):
+        leases.pop((repo_name, int(number)))()
+
+    def failed(repo_name, number, e):
+        plan.take()
+        print "FAILED", repo_name, number, ":", e.__class__.__name__, e
+        queue.fail(repo_name, number, owner, '%s: %s' % (e.__class__.__name__, e))
+        release(repo_name, number)
+
+    def finish(pr):
+        try:
+            actions, due = triage(pr)
+            record(pr, actions, due)
+        except (Exception, SystemExit) as e:
+            failed(pr.repo, pr.number, e)
+            return
+        result = {'title': pr.title, 'html_url': pr.html_url,
+                  'actions': actions, 'plan': plan.take()}
+        if not queue.finish(pr.repo, pr.number, owner, result):
+            print "WARN: lost the lease on", pr.repo, pr.number, "; somebody else has it now"
+        release(pr.repo, pr.number)
+
+    while True:
+        claimed = queue.claim(owner)
+        if claimed is None:
+            # Ours first; then others may still be working (or have died), so
+            # wait to see which.
+            if len(mergeq):
+                print "MERGEABLE: waiting on", len(mergeq), "PRs GitHub is still checking"
+            for ready_pr in mergeq.drain():
+                finish(ready_pr)
+            if not queue.unfinished():
+                break
+            time.sleep(5)
+            continue
+
+        repo_name, number = claimed
+        leases[(repo_name, int(number))] = queue.keep(repo_name, number, owner)
+        try:
+            pr = fetch_one(repo_name, number)
+        except (Exception, SystemExit) as e:
+            failed(repo_name, number, e)
+            continue
+        # As a sweep does, record what the listing said; see fetched_pulls.
+        pr.updated_at = queue.updated_at(repo_name, number) or pr.updated_at
+
+        if pr.mergeable is None:
+            if verbose:
+                print "MERGEABLE UNKNOWN ", pr.number, "; asking again in the background"
+            mergeq.defer(pr)
+        else:
+            finish(pr)
+
+        for ready_pr in mergeq.ready():
+            finish(ready_pr)
+
+def report_queue():
+    counts = queue.counts()
+    print " "
+    print "QUEUE REPORT:", counts['done'], "done,", counts['failed'], "failed,", \
+          counts['pending'] + counts['leased'], "unfinished"
+    for item in queue.items():
+        result = item['result']
+        if item['status'] == 'failed':
+            print " "
+            print item['repo'], item['number'], "FAILED after", item['attempts'], "attempts:", item['error']
+        elif (item['status'] == 'done') and result['actions']:
+            print " "
+            print item['repo'], item['number'], '---', result['title']
+            print "  ", result['html_url']
+            for action in result['actions']:
+                print "  ", action
+            if plan:
+                for entry in result['plan']:
+                    plan.add(entry)
+
+
+#------------------------------------------------------------------------------------
+# The warning scheduler. Every triage records when (if ever) a 14-day warning
+# will next come due on a PR, and the triage state keeps those times indexed.
+# Rather than sweeping the whole queue to catch them, the scheduler sleeps until
+# the next one, and re-triages just the PRs whose time has come. Sweeps and the
+# listener keep setting timers as they go, so we look again at least every
+# SCHEDULE_RECHECK seconds to pick up any that come sooner.
+#------------------------------------------------------------------------------------
+
+SCHEDULE_RECHECK = 15 * 60
+SCHEDULE_RETRY = 10 * 60
+
+def run_schedule():
+    announced = None
+    while True:
+        for repo_name, number in state.expired(repo_names):
+            try:
+                pr = fetch_one(repo_name, number)
+                if pr.state != 'open':
+                    print "SCHEDULE:", repo_name, number, "is no longer open; dropping its timer"
+                    state.set_due(repo_name, number, None)
+                    continue
+                actions, due = triage(pr)
+                record(pr, actions, due)
+            except NotFound as e:
+                print "SCHEDULE:", e, "; dropping its timer"
+                state.set_due(repo_name, number, None)
+            except (Exception, SystemExit) as e:
+                print "SCHEDULE: triaging", repo_name, number, "failed:", e.__class__.__name__, e
+                state.set_due(repo_name, number, time.time() + SCHEDULE_RETRY)
+
+        due = state.next_due(repo_names)
+        wait = SCHEDULE_RECHECK
+        if due is not None:
+            wait = min(wait, max(0, due - time.time()))
+            if due != announced:
+                print "SCHEDULE: next warning due at", time.ctime(due)
+                announced = due
+        time.sleep(wait)
+
+#------------------------------------------------------------------------------------
+# Tell the user how far the current rate limit budget will go.
+#------------------------------------------------------------------------------------
+
+def report_budget():
+    items = ratelimit.items_left(calls_per_item)
+    if items is not None:
+        print "RATE LIMIT: budget left for about", items, "more PRs (resets at %s)" % time.ctime(ratelimit.reset)
+
 
 #====================================================================================
 # MAIN CODE START, EH?
 #====================================================================================
 
 
+#------------------------------------------------------------------------------------
+# PRs whose mergeability GitHub hasn't worked out yet are asked about again
+# through this; see mergequeue.py.
+#------------------------------------------------------------------------------------
+mergeq = MergeQueue(refresh_mergeable, workers=workers, replaying=bool(args.replay))
+atexit.register(mergeq.close)
+
+#------------------------------------------------------------------------------------
+# If we've been handed a reviewed plan, carry it out, and that's all.
+#------------------------------------------------------------------------------------
+if args.apply:
+    if apply_plan(gh, ghuser, load_plan(args.apply), workers=workers):
+        sys.exit(1)
+
+#------------------------------------------------------------------------------------
+# Sharded sweeps: report on the queue, work on it, or do the whole thing.
+#------------------------------------------------------------------------------------
+elif args.report:
+    report_queue()
+
+elif args.worker:
+    work_queue()
+
+elif args.shards:
+    started = time.time()
+    run_shards()
+    report_queue()
+    # Only a sweep that triaged everything counts, for --search.
+    counts = queue.counts()
+    if (counts['done'] == sum(counts.values())) and not args.startat:
+        for repo_name in repo_names:
+            state.record_sweep(repo_name, 'pull', started)
+
 #------------------------------------------------------------------------------------
 # If we're running in single PR mode, run triage on the single PR.
 #------------------------------------------------------------------------------------
-if single_pr:
-    single_pr_url = "https://api.github.com/repos/ansible/ansible-modules-" + ghrepo + "/pulls/" + single_pr
-    triage(single_pr_url)
+elif single_pr:
+    try:
+        triage_one(repo_names[0], single_pr)
+    except NotFound as e:
+        print "FATAL:", e
+        sys.exit(1)
+
+#------------------------------------------------------------------------------------
+# If we're listening for webhooks, triage each PR they tell us about, as they
+# tell us about it.
+#------------------------------------------------------------------------------------
+elif args.listen:
+    def wanted(item):
+        repo, number, is_pull = item
+        return (repo in repo_names) and is_pull
+
+    if not args.webhook_secret:
+        print "WARN: no --webhook-secret given; accepting unsigned webhooks"
+    Listener(args.listen, args.webhook_secret, lambda item: triage_one(item[0], item[1]), wanted,
+             debounce=args.debounce, verbose=verbose).run()
+
+#------------------------------------------------------------------------------------
+# If we're scheduling, wait for each PR's warnings to come due, and triage it
+# then.
+#------------------------------------------------------------------------------------
+elif args.schedule:
+    try:
+        run_schedule()
+    except KeyboardInterrupt:
+        print "Stopping the scheduler"
 
 #------------------------------------------------------------------------------------
 # Otherwise, go get all open PRs and run through them.
 #------------------------------------------------------------------------------------
 else:
-    # First, get number of pages using pagination in Link Headers. Thanks 
-    # requests library for making this relatively easy!
-    signal.alarm(5)
-    r = requests.get(repo_url, params=args, auth=(ghuser,ghpass))
-    signal.alarm(0)
-    lastpage = int(str(r.links['last']['url']).split('=')[-1])
-
-    # Set range for 1..2 for testing only
-    # for page in range(1,2):
-
-    for page in range(1,lastpage):
-        pull_args = {'state':'open', 'page':page}
-        signal.alarm(5)
-        r = requests.get(repo_url, params=pull_args, auth=(ghuser,ghpass))
-        signal.alarm(0)
-
-        #----------------------------------------------------------------------------
-        # For every open PR:
-        #----------------------------------------------------------------------------
-        for shortpull in r.json():
- 
-            # Do some nifty triage!
-            if (int(shortpull['number']) <= int(startat)):
-                triage(shortpull['url'])
+    # Asking about the rate limit is free, so see where we stand first.
+    gh.get(api_url + '/rate_limit')
+    report_budget()
+
+    #--------------------------------------------------------------------------------
+    # For every open PR in every repo: fetch in parallel, but triage one at a
+    # time, in the order the listing gave them to us (newest PR number first).
+    # PRs that GitHub doesn't know the mergeability of yet are put aside to be
+    # asked about again in the background, and triaged as their answers come
+    # in; the sweep carries on meanwhile, and waits for the last of them at the
+    # end. A sweep that got through everything is remembered, for --search; one
+    # with PRs that failed to fetch (up front, or older comment pages during
+    # triage) didn't, and they're left for the next one.
+    #--------------------------------------------------------------------------------
+    for repo_name in repo_names:
+        started = time.time()
+        failed = []
+        for pr in fetched_pulls(repo_name, failed):
+
+            # A PR we only knew about from our own state may have closed since.
+            if pr.state != 'open':
+                print "CLOSED ", pr.number
+                state.record(repo_name, pr.number, pr.updated_at, [], kind='pull')
+                continue
+
+            if pr.mergeable is None:
+                if verbose:
+                    print "MERGEABLE UNKNOWN ", pr.number, "; asking again in the background"
+                mergeq.defer(pr)
             else:
-                print "SKIPPING ", shortpull['number']
+                # Do some nifty triage!
+                triage_in_sweep(pr, failed)
+
+            # Then any put aside earlier that GitHub has answered for meanwhile.
+            for ready_pr in mergeq.ready():
+                triage_in_sweep(ready_pr, failed)
+
+        if len(mergeq):
+            print "MERGEABLE: waiting on", len(mergeq), "PRs GitHub is still checking"
+        for ready_pr in mergeq.drain():
+            triage_in_sweep(ready_pr, failed)
+
+        if failed:
+            print "FAILED: could not fetch", len(failed), "PRs:", ", ".join(str(n) for n in failed)
+        elif not args.startat:
+            state.record_sweep(repo_name, 'pull', started)
+
+    report_budget()
 
+if plan and plan.path:
+    print "PLAN:", plan.count, "PRs with actions written to", plan.path
 
 #====================================================================================
 # That's all, folks!
@@ -0,0 +1,295 @@
+#------------------------------------------------------------------------------------
+# The PR triage rules, with no I/O.
+#
+# decide() takes a snapshot of an already-fetched PR (a PullSnapshot, see
+# prsnapshot.py), plus its maintainers, and works out the list of actions prbot
+# should recommend: the label state machine, the walk back through the
+# comments, and the 14-day timeouts. It doesn't fetch, print or prompt, so the
+# rules can be run (and timed) on their own, e.g. over a whole recorded or
+# synthetic queue; see bench_triage.py. (The one exception: prbot hands it REST
+# comments as a ReverseListing, which fetches older pages if the walk reaches
+# them; prbot counts that as fetching, and handles its failures.)
+#------------------------------------------------------------------------------------
+
+# The labels that mean a PR has already been triaged into some state.
+TRIAGED_LABELS = ('community_review', 'core_review', 'needs_revision',
+                  'needs_info', 'needs_rebase', 'shipit')
+
+
+class MissingMaintainers(Exception):
+    pass
+
+#------------------------------------------------------------------------------------
+# decide: run the rules over one PR snapshot.
+#
+# Returns (actions, warning_due, notes):
+#   - actions: the recommended actions, in order
+#   - warning_due: when a timeout warning will next come due, if the comment walk
+#     ended on a bot comment that isn't old enough yet, on a PR whose labels
+#     let it be warned (else None)
+#   - notes: lines worth showing in verbose mode (only built when verbose is
+#     set; otherwise empty, as formatting them for every comment walked adds up)
+#
+# Raises MissingMaintainers for an existing file nobody maintains; a human has
+# to fix the maintainers file before we can triage that PR.
+#------------------------------------------------------------------------------------
+def decide(snapshot, maintainers, botlist, now, verbose=False):
+    pr_labels = snapshot.labels
+    pr_files = [f.path for f in snapshot.files]
+    pr_submitter = snapshot.submitter
+    pr_maintainers = ' '.join(maintainers)
+    mergeable = snapshot.mergeable
+
+    pr_contains_new_file = False
+    for f in snapshot.files:
+        if f.new_file:
+            pr_contains_new_file = True
+
+    actions = []
+    notes = []
+
+    #----------------------------------------------------------------------------
+    # Kill all P3-P5 tags, every time. No more low priority tags.
+    #----------------------------------------------------------------------------
+    if ('P3') in pr_labels:
+        actions.append("unlabel: P3")
+    if ('P4') in pr_labels:
+        actions.append("unlabel: P4")
+    if ('P5') in pr_labels:
+        actions.append("unlabel: P5")
+
+    #----------------------------------------------------------------------------
+    # Now, we handle the "no triaged labels" case: i.e. if none of the
+    # following labels are present: community_review, core_review, needs_revision,
+    # needs_rebase, shipit.
+    #----------------------------------------------------------------------------
+    triaged = False
+    for label in TRIAGED_LABELS:
+        if label in pr_labels:
+            triaged = True
+
+    if not triaged:
+        if ('stable' in snapshot.base_ref):
+            actions.append("newlabel: core_review")
+            actions.append("newlabel: backport")
+            actions.append("boilerplate: backport")
+        elif ('ansible' in pr_maintainers):
+            actions.append("newlabel: core_review")
+            actions.append("boilerplate: core_review_existing")
+        elif (pr_maintainers == '') and (pr_contains_new_file):
+            actions.append("newlabel: community_review")
+            actions.append("newlabel: new_plugin")
+            actions.append("boilerplate: community_review_new")
+        elif (pr_maintainers == '') and (not pr_contains_new_file):
+            raise MissingMaintainers("existing file without reviewer found! Please add to CONTRIBUTORS file.")
+        elif (pr_submitter in pr_maintainers):
+            actions.append("newlabel: shipit")
+            actions.append("newlabel: owner_pr")
+            actions.append("boilerplate: shipit_owner_pr")
+        else:
+            actions.append("newlabel: community_review")
+            actions.append("boilerplate: community_review_existing")
+
+    #------------------------------------------------------------------------
+    # Does this PR need to be (newly) rebased? If so, label and boilerplate.
+    #------------------------------------------------------------------------
+    if (mergeable == False):
+        if ('needs_rebase' not in pr_labels):
+            actions.append("newlabel: needs_rebase")
+            actions.append("unlabel: community_review")
+            actions.append("unlabel: core_review")
+            actions.append("boilerplate: needs_rebase")
+
+    #------------------------------------------------------------------------
+    # Has PR been rebased at our request? If so, remove needs_rebase
+    # label and put into the appropriate review state.
+    #------------------------------------------------------------------------
+    if ((mergeable == True)
+      and ('needs_rebase' in pr_labels)):
+        actions.append("unlabel: needs_rebase")
+        if ('ansible' in pr_maintainers):
+            actions.append("newlabel: core_review")
+            actions.append("boilerplate: core_review_existing")
+        elif (pr_maintainers == '') and (pr_contains_new_file):
+            actions.append("newlabel: community_review")
+            actions.append("boilerplate: community_review_new")
+        else:
+            actions.append("newlabel: community_review")
+            actions.append("boilerplate: community_review_existing")
+
+    #----------------------------------------------------------------------------
+    # Now let's add filename-based labels: cloud, windows, networking.
+    #----------------------------------------------------------------------------
+    pr_topdirs = [pr_filename.split('/')[0] for pr_filename in pr_files]
+    if ('cloud' in pr_topdirs) and ('cloud' not in pr_labels):
+        actions.append("newlabel: cloud")
+    if ('network' in pr_topdirs) and ('networking' not in pr_labels):
+        actions.append("newlabel: networking")
+    if ('windows' in pr_topdirs) and ('windows' not in pr_labels):
+        actions.append("newlabel: windows")
+
+    #----------------------------------------------------------------------------
+    # OK, now we start walking through comment-based actions, and push whatever
+    # we find into the action list.
+    #
+    # NOTE: we walk through comments MOST RECENT FIRST. Whenever we find a
+    # meaningful state change from the comments, we break; thus, we are always
+    # acting on what we perceive to be the most recent meaningful comment, and
+    # we ignore all older comments.
+    #
+    # If the walk ends on a bot comment that is too young to time out, we note
+    # when it will be old enough (warning_due), so incremental sweeps know when
+    # to look at this PR again. Only PRs in a state that gets warnings (see the
+    # branches below) need that; the rest would just be fetched again for
+    # nothing.
+    #----------------------------------------------------------------------------
+    can_warn = (('core_review' not in pr_labels)
+                and (('needs_revision' in pr_labels) or ('needs_rebase' in pr_labels)
+                     or (('community_review' in pr_labels) and ('new_plugin' not in pr_labels))))
+    warning_due = None
+    for comment in reversed(snapshot.comments):
+        commenter = comment.login
+        body = comment.body
+
+        if verbose:
+            notes.append(" ")
+            notes.append("==========>  Comment at  %s  from:  %s" % (comment.created_at, commenter))
+            notes.append(body)
+
+        #------------------------------------------------------------------------
+        # Is the last useful comment from a bot user?  Then we've got a potential
+        # timeout case.  Let's explore!
+        #------------------------------------------------------------------------
+        if (commenter in botlist):
+
+            #--------------------------------------------------------------------
+            # Let's figure out how old this comment is, exactly.
+            #--------------------------------------------------------------------
+            comment_time = comment.created
+            comment_days_old = (now-comment_time)/86400
+            if (comment_days_old <= 14) and can_warn:
+                warning_due = comment_time + (14 * 86400)
+
+            #--------------------------------------------------------------------
+            # Is it more than 14 days old? That kinda sucks; we should do
+            # something about it!
+            #--------------------------------------------------------------------
+
+            if comment_days_old > 14:
+
+                #----------------------------------------------------------------
+                # If it's in core review, we just leave it be and break.
+                # (We'll set a different threshhold for core_review PRs
+                # in the future.)
+                #----------------------------------------------------------------
+                if 'core_review' in pr_labels:
+                    break
+
+                #----------------------------------------------------------------
+                # If it's in needs_review or needs_rebase and no previous
+                # warnings have been issued, warn submitter and break.
+                #----------------------------------------------------------------
+                elif (('pending' not in body)
+                  and (('needs_revision' in pr_labels) or ('needs_rebase' in pr_labels))):
+                    actions.append("boilerplate: submitter_first_warning")
+                    break
+
+                #----------------------------------------------------------------
+                # If it's in community_review and no previous # warnings have
+                # been issued, and it's not a new module (we let new modules
+                # stay in review indefinitely), warn maintainer and break.
+                #----------------------------------------------------------------
+                elif (('pending' not in body)
+                  and ('community_review' in pr_labels)
+                  and ('new_plugin' not in pr_labels)):
+                    actions.append("boilerplate: maintainer_first_warning")
+                    break
+
+                #----------------------------------------------------------------
+                # If it's in needs_revision or needs_rebase and a previous
+                # warning has been issued, place in pending_action, give the
+                # submitter a second warning, and break.
+                #----------------------------------------------------------------
+                elif (('pending' in body)
+                  and (('needs_revision' in pr_labels) or ('needs_rebase' in pr_labels))):
+                    actions.append("boilerplate: submitter_second_warning")
+                    actions.append("label: pending_action")
+                    break
+
+                #----------------------------------------------------------------
+                # If it's in community_review, not new_plugin, and a previous
+                # warning has been issued, place in pending_action, give the
+                # maintainer a second warning, and break.
+                #----------------------------------------------------------------
+                elif (('pending' in body)
+                  and ('community_review' in pr_labels)
+                  and ('new_plugin' not in pr_labels)):
+                    actions.append("boilerplate: maintainer_second_warning")
+                    actions.append("label: pending_action")
+                    break
+
+            if verbose:
+                notes.append("  STATUS: no useful state change since last pass ( %s )" % commenter)
+                notes.append("  Days since last bot comment:  %s" % comment_days_old)
+            break
+
+        #------------------------------------------------------------------------
+        # Has maintainer said 'shipit'? Then label/boilerplate/break.
+        #------------------------------------------------------------------------
+        if ((commenter in pr_maintainers)
+          and ('shipit' in body)):
+            actions.append("unlabel: community_review")
+            actions.append("unlabel: core_review")
+            actions.append("unlabel: needs_info")
+            actions.append("unlabel: needs_revision")
+            actions.append("unlabel: pending_action")
+            actions.append("newlabel: shipit")
+            actions.append("boilerplate: shipit")
+            break
+
+        #------------------------------------------------------------------------
+        # Has maintainer said 'needs_revision'? Then label/boilerplate/break.
+        #------------------------------------------------------------------------
+        if ((commenter in pr_maintainers)
+          and ('needs_revision' in body)):
+            actions.append("unlabel: community_review")
+            actions.append("unlabel: core_review")
+            actions.append("unlabel: needs_info")
+            actions.append("unlabel: shipit")
+            actions.append("unlabel: pending_action")
+            actions.append("newlabel: needs_revision")
+            actions.append("boilerplate: needs_revision")
+            break
+
+        #------------------------------------------------------------------------
+        # Has submitter said 'ready_for_review'? Then label/boilerplate/break.
+        #------------------------------------------------------------------------
+        if ((commenter == pr_submitter)
+          and ('ready_for_review' in body)):
+            actions.append("unlabel: needs_revision")
+            actions.append("unlabel: needs_info")
+            actions.append("unlabel: pending_action")
+            if ('ansible' in pr_maintainers):
+                actions.append("newlabel: core_review")
+                actions.append("boilerplate: core_review_existing")
+            elif (pr_maintainers == ''):
+                actions.append("newlabel: community_review")
+                actions.append("boilerplate: community_review_new")
+            else:
+                actions.append("newlabel: community_review")
+                actions.append("boilerplate: community_review_existing")
+            break
+
+        #------------------------------------------------------------------------
+        # Have submitter or maintainer said something else? Then they're
+        # likely discussing issues with the PR; that makes this comment
+        # "useful", so we'll break here so as not to trigger the timeout
+        # workflow.
+        #------------------------------------------------------------------------
+        if ((commenter in pr_maintainers)
+          or (commenter == pr_submitter)):
+            if verbose:
+                notes.append("  Conversation about this PR onging")
+            break
+
+    return actions, warning_due, notes
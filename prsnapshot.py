@@ -0,0 +1,111 @@
+#------------------------------------------------------------------------------------
+# Compact PR snapshots.
+#
+# The API hands us a lot more about a PR than triage ever looks at: the pull
+# alone carries the submitter's user object, both the head and base repo objects
+# (with a hundred-odd urls each) and a pile of links. A PullSnapshot keeps just
+# the dozen or so fields triage uses, in __slots__ objects, with each comment cut
+# down to who said it, what they said and when (with the time also parsed, once,
+# into epoch seconds). Labels and logins come from small vocabularies, so
+# they're interned, and thousands of PRs share one copy of "community_review"
+# or "gregdek".
+#
+# Snapshots are built straight from the API responses, and the raw JSON is
+# dropped as soon as that's done. If ujson is installed, responses are decoded
+# with it, which is several times faster than the standard library's decoder on
+# big comment pages; without it, we fall back to requests' own decoding.
+#------------------------------------------------------------------------------------
+
+import time
+# time.strptime imports _strptime the first time it's called, and on python 2
+# that import can fail when the first calls come from several fetch threads at
+# once; importing it up front avoids that.
+import _strptime
+
+try:
+    import ujson as fastjson
+except ImportError:
+    fastjson = None
+
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+# Shared copies of label names and logins.
+_interned = {}
+
+def interned(s):
+    return _interned.setdefault(s, s)
+
+#------------------------------------------------------------------------------------
+# Decode a response's JSON body, with the fast decoder if we have one.
+#------------------------------------------------------------------------------------
+def decode(r):
+    if fastjson is not None:
+        return fastjson.loads(r.content)
+    return r.json()
+
+# Comment times are read the same way the triage rules always have.
+def parse_time(timestamp):
+    return time.mktime(time.strptime(timestamp, TIME_FORMAT))
+
+
+class Comment(object):
+    __slots__ = ('login', 'body', 'created', 'created_at')
+
+    def __init__(self, login, body, created_at):
+        self.login = login
+        self.body = body
+        self.created_at = created_at
+        self.created = parse_time(created_at)
+
+    def __repr__(self):
+        return 'Comment(%r, %r, %r)' % (self.login, self.body, self.created_at)
+
+def comment(c):
+    return Comment(interned(c['user']['login']), c['body'], c['created_at'])
+
+# A page of the comments API, as Comments; for ReverseListing.
+def comment_page(r):
+    return [comment(c) for c in decode(r)]
+
+
+class PullSnapshot(object):
+    __slots__ = ('repo', 'number', 'title', 'body', 'html_url', 'issue_url', 'comments_url',
+                 'labels_url', 'updated_at', 'state', 'submitter', 'base_ref', 'mergeable',
+                 'labels', 'files', 'comments')
+
+    def __init__(self, **fields):
+        for name in self.__slots__:
+            setattr(self, name, fields.get(name))
+
+    def __repr__(self):
+        return '<PullSnapshot %s#%s>' % (self.repo, self.number)
+
+#------------------------------------------------------------------------------------
+# Build a snapshot from the decoded pull and issue, the pull's files (from
+# diffscan), and its comments: either a list of comment dicts, oldest first, or
+# a listing that already yields Comments (see comment_page). Works the same for
+# the REST responses and for the stand-ins ghgraphql builds. updated_at is the
+# issue's, as the /issues listing (which incremental sweeps go by) has it; the
+# pull's can differ.
+#------------------------------------------------------------------------------------
+def snapshot(repo, pull, issue, files, comments):
+    if isinstance(comments, list):
+        comments = [comment(c) for c in comments]
+    return PullSnapshot(
+        repo=repo,
+        number=pull['number'],
+        title=pull['title'],
+        body=pull['body'],
+        html_url=pull['html_url'],
+        issue_url=pull['issue_url'],
+        comments_url=issue['comments_url'],
+        labels_url=issue['labels_url'],
+        updated_at=issue['updated_at'],
+        state=issue['state'],
+        submitter=interned(pull['user']['login']),
+        base_ref=pull['base']['ref'],
+        mergeable=pull['mergeable'],
+        labels=[interned(label['name']) for label in issue['labels']],
+        files=tuple(files),
+        comments=comments,
+    )
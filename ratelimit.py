@@ -0,0 +1,96 @@
+#------------------------------------------------------------------------------------
+# Rate limit budgeting for the GitHub client.
+#
+# GitHub tells us on every API response how many calls we have left
+# (X-RateLimit-Remaining) and when the hourly window resets (X-RateLimit-Reset).
+# prbot and issuebot run as the same user, so they share that budget. Each bot
+# gets a share of it for its reads, and a reserve is held back for writes, so a
+# big read sweep can't leave us unable to act on what it found. When a bot runs
+# out, it pauses until the window resets instead of hammering GitHub.
+#------------------------------------------------------------------------------------
+
+import threading, time
+
+
+class RateLimiter(object):
+
+    def __init__(self, share=1.0, reserve=100):
+        self.share = share
+        self.reserve = reserve
+        self.lock = threading.Lock()
+        self.limit = None
+        self.remaining = None
+        self.reset = None
+        self.used = 0
+
+    #--------------------------------------------------------------------------------
+    # Take note of the rate limit headers on a response. Only calls that GitHub
+    # actually charged us for (so not 304s) count towards our share, and only the
+    # core REST budget is tracked; GraphQL and search have their own.
+    #--------------------------------------------------------------------------------
+    def update(self, r):
+        if 'X-RateLimit-Remaining' not in r.headers:
+            return
+        if r.headers.get('X-RateLimit-Resource', 'core') != 'core':
+            return
+        with self.lock:
+            reset = int(r.headers.get('X-RateLimit-Reset', 0))
+            if (self.reset is None) or (reset > self.reset + 60):
+                # A new window; everyone starts again from scratch.
+                self.used = 0
+            self.reset = reset
+            self.limit = int(r.headers.get('X-RateLimit-Limit', self.limit or 0))
+            self.remaining = int(r.headers['X-RateLimit-Remaining'])
+            if r.status_code != 304:
+                self.used += 1
+
+    #--------------------------------------------------------------------------------
+    # How many more reads this bot may make in the current window: the smaller of
+    # what's left of its share, and what's left overall once the write reserve
+    # is set aside. None if we haven't heard from GitHub yet.
+    #--------------------------------------------------------------------------------
+    def allowance(self):
+        if self.remaining is None:
+            return None
+        mine = int(self.share * max(0, self.limit - self.reserve)) - self.used
+        return max(0, min(mine, self.remaining - self.reserve))
+
+    #--------------------------------------------------------------------------------
+    # How long to wait before the next request may go out (0 for "go now").
+    # Writes may dig into the reserve; reads may not.
+    #--------------------------------------------------------------------------------
+    def wait_time(self, write=False, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            if (self.remaining is None) or (now >= self.reset):
+                return 0
+            if write:
+                ok = self.remaining > 0
+            else:
+                ok = self.allowance() > 0
+            if ok:
+                return 0
+            return self.reset - now + 1
+
+    #--------------------------------------------------------------------------------
+    # Block until the budget allows another request.
+    #--------------------------------------------------------------------------------
+    def acquire(self, write=False):
+        while True:
+            wait = self.wait_time(write)
+            if wait <= 0:
+                return
+            print "Rate limit budget used up; pausing", int(wait), "seconds until it resets"
+            time.sleep(wait)
+
+    #--------------------------------------------------------------------------------
+    # Roughly how many more items we can triage in this window, if each one costs
+    # `cost` API calls.
+    #--------------------------------------------------------------------------------
+    def items_left(self, cost):
+        with self.lock:
+            allowance = self.allowance()
+        if allowance is None:
+            return None
+        return allowance // cost
@@ -0,0 +1,88 @@
+#------------------------------------------------------------------------------------
+# Search-driven sweeps: only fetch the items that may need work.
+#
+# On a mostly triaged queue, nearly every item a sweep fetches comes back "None
+# required". The triage rules only ever act on an item that is:
+#   - untriaged (none of the triaged labels yet; PRs only)
+#   - carrying a P3, P4 or P5 label
+#   - updated since the last sweep (new comments, pushes, label changes)
+#   - one we recommended actions for last time, which weren't taken
+#   - one with a 14-day warning timer that has come due
+# The first three are search API queries; the last two come from the triage
+# state. Only the union of those gets fetched in full.
+#
+# What search can't see: a PR that stops being mergeable because its base
+# branch moved on isn't "updated", so a needs_rebase it would now get waits for
+# the next full sweep. Run one of those now and then.
+#------------------------------------------------------------------------------------
+
+import time
+from fetchpool import last_page
+from prrules import TRIAGED_LABELS
+
+LOW_PRIORITY_LABELS = ('P3', 'P4', 'P5')
+
+# The search API won't go past the first 1000 results of a query.
+SEARCH_LIMIT = 1000
+
+# Look back a little before the last sweep started, for clock skew between us
+# and GitHub.
+OVERLAP = 10 * 60
+
+
+class SearchTooBroad(Exception):
+    pass
+
+def search_time(t):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+#------------------------------------------------------------------------------------
+# The queries for a repo's open pulls ('pr') or issues ('issue') that may need
+# work, given when the last sweep started.
+#------------------------------------------------------------------------------------
+def candidate_queries(repo, kind, since):
+    base = 'repo:%s is:%s is:open' % (repo, kind)
+    queries = []
+    if kind == 'pr':
+        queries.append(base + ' ' + ' '.join('-label:' + label for label in TRIAGED_LABELS))
+    for label in LOW_PRIORITY_LABELS:
+        queries.append('%s label:%s' % (base, label))
+    queries.append('%s updated:>=%s' % (base, search_time(since - OVERLAP)))
+    return queries
+
+#------------------------------------------------------------------------------------
+# Every item matching a query, a page at a time. The search rate limit is about
+# 30 calls a minute, so pages are fetched one after another, not all at once.
+#------------------------------------------------------------------------------------
+def search_items(gh, api_url, query):
+    def get_page(page):
+        r = gh.search(api_url + '/search/issues', {'q': query, 'per_page': 100, 'page': page})
+        r.raise_for_status()
+        return r
+
+    first = get_page(1)
+    result = first.json()
+    if (result['total_count'] > SEARCH_LIMIT) or result.get('incomplete_results'):
+        raise SearchTooBroad('%d results for "%s", more than search will hand back' % (result['total_count'], query))
+    for item in result['items']:
+        yield item
+    for page in range(2, last_page(first) + 1):
+        for item in get_page(page).json()['items']:
+            yield item
+
+#------------------------------------------------------------------------------------
+# The candidates: listing-style entries ({'number', 'updated_at'}), newest
+# number first, like the listing they stand in for. `outstanding` is the
+# triage state's (number, updated_at) list of items to look at regardless.
+# Raises SearchTooBroad if a query matches more than search will return; the
+# caller should fall back to listing everything.
+#------------------------------------------------------------------------------------
+def plan_candidates(gh, api_url, queries, outstanding):
+    candidates = {}
+    for query in queries:
+        for item in search_items(gh, api_url, query):
+            candidates[item['number']] = {'number': item['number'], 'updated_at': item['updated_at']}
+    for number, updated_at in outstanding:
+        if number not in candidates:
+            candidates[number] = {'number': number, 'updated_at': updated_at}
+    return [candidates[number] for number in sorted(candidates, reverse=True)]
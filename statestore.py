@@ -0,0 +1,172 @@
+#------------------------------------------------------------------------------------
+# Local triage state, kept in SQLite between runs.
+#
+# For every item we triage we remember the updated_at GitHub reported, the
+# actions triage came up with, and (if there is one) the time at which a timeout
+# rule such as the 14-day warnings will next come due. With that, an incremental
+# sweep can skip every item that hasn't changed since we last looked at it.
+# The due times are indexed, so they double as a timer list: a scheduler can
+# ask when the next one is, and which have come due, without looking at any
+# other item.
+# We also keep a summary of each item's comments, so that they can be fetched
+# incrementally, and when each repo was last swept, so that a search sweep (see
+# searchplan.py) knows what "updated since" means.
+#------------------------------------------------------------------------------------
+
+import json, os, sqlite3, threading, time
+
+
+class TriageState(object):
+
+    def __init__(self, path):
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS triage (
+                               repo TEXT,
+                               number INTEGER,
+                               updated_at TEXT,
+                               triaged_at REAL,
+                               actions TEXT,
+                               due REAL,
+                               PRIMARY KEY (repo, number))''')
+        # Whether an item is a pull or an issue; state from before we kept it
+        # has none.
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(triage)')]
+        if 'kind' not in columns:
+            self.db.execute('ALTER TABLE triage ADD COLUMN kind TEXT')
+        self.db.execute('CREATE INDEX IF NOT EXISTS triage_due ON triage (due)')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS sweeps (
+                               repo TEXT,
+                               kind TEXT,
+                               started_at REAL,
+                               PRIMARY KEY (repo, kind))''')
+        self.db.execute('''CREATE TABLE IF NOT EXISTS comment_summary (
+                               repo TEXT,
+                               number INTEGER,
+                               summary TEXT,
+                               PRIMARY KEY (repo, number))''')
+        self.db.commit()
+
+    #--------------------------------------------------------------------------------
+    # What we remembered last time, as a dict, or None if we've never seen it.
+    #--------------------------------------------------------------------------------
+    def get(self, repo, number):
+        with self.lock:
+            row = self.db.execute('''SELECT updated_at, triaged_at, actions, due FROM triage
+                                     WHERE repo = ? AND number = ?''', (repo, int(number))).fetchone()
+        if not row:
+            return None
+        return {'updated_at': row[0], 'triaged_at': row[1],
+                'actions': json.loads(row[2]), 'due': row[3]}
+
+    #--------------------------------------------------------------------------------
+    # Does this item need triage again? Only if:
+    #   - we've never triaged it, or
+    #   - it has been updated since, or
+    #   - last time we recommended actions (which evidently weren't taken), or
+    #   - a timeout rule has come due.
+    #--------------------------------------------------------------------------------
+    def needs_triage(self, repo, number, updated_at, now=None):
+        last = self.get(repo, number)
+        if last is None:
+            return True
+        if last['updated_at'] != updated_at:
+            return True
+        if last['actions']:
+            return True
+        if now is None:
+            now = time.time()
+        return (last['due'] is not None) and (now >= last['due'])
+
+    #--------------------------------------------------------------------------------
+    # Remember the result of triaging an item.
+    #--------------------------------------------------------------------------------
+    def record(self, repo, number, updated_at, actions, due=None, kind=None):
+        with self.lock:
+            self.db.execute('''INSERT OR REPLACE INTO triage (repo, number, updated_at, triaged_at, actions, due, kind)
+                               VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                            (repo, int(number), updated_at, time.time(), json.dumps(actions), due, kind))
+            self.db.commit()
+
+    #--------------------------------------------------------------------------------
+    # Items of a kind that need another look whether or not they've changed: the
+    # ones we last recommended actions for, and the ones with a timer come due.
+    # As (number, updated_at), newest number first.
+    #--------------------------------------------------------------------------------
+    def outstanding(self, repo, kind, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self.db.execute('''SELECT number, updated_at FROM triage
+                                      WHERE repo = ? AND kind = ? AND (actions != '[]' OR due <= ?)
+                                      ORDER BY number DESC''', (repo, kind, now)).fetchall()
+
+    #--------------------------------------------------------------------------------
+    # When the last complete sweep of a repo's pulls or issues started, or None.
+    #--------------------------------------------------------------------------------
+    def last_sweep(self, repo, kind):
+        with self.lock:
+            row = self.db.execute('SELECT started_at FROM sweeps WHERE repo = ? AND kind = ?',
+                                  (repo, kind)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    def record_sweep(self, repo, kind, started_at):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO sweeps VALUES (?, ?, ?)', (repo, kind, started_at))
+            self.db.commit()
+
+    #--------------------------------------------------------------------------------
+    # Timers. Items whose due time has come, soonest first, as (repo, number); and
+    # the next due time still to come (or None). Both only look at the given repos.
+    #--------------------------------------------------------------------------------
+    def expired(self, repos, now=None):
+        if now is None:
+            now = time.time()
+        with self.lock:
+            return self.db.execute('''SELECT repo, number FROM triage
+                                      WHERE due <= ? AND repo IN (%s)
+                                      ORDER BY due''' % ','.join('?' * len(repos)),
+                                   [now] + list(repos)).fetchall()
+
+    def next_due(self, repos):
+        with self.lock:
+            row = self.db.execute('''SELECT due FROM triage
+                                     WHERE due IS NOT NULL AND repo IN (%s)
+                                     ORDER BY due LIMIT 1''' % ','.join('?' * len(repos)),
+                                  list(repos)).fetchone()
+        if not row:
+            return None
+        return row[0]
+
+    # Move an item's timer (e.g. to try again later), or clear it with None.
+    def set_due(self, repo, number, due):
+        with self.lock:
+            self.db.execute('UPDATE triage SET due = ? WHERE repo = ? AND number = ?', (due, repo, int(number)))
+            self.db.commit()
+
+    #--------------------------------------------------------------------------------
+    # The comment summary we keep for an item (see commentsummary.py), or None.
+    #--------------------------------------------------------------------------------
+    def get_summary(self, repo, number):
+        with self.lock:
+            row = self.db.execute('SELECT summary FROM comment_summary WHERE repo = ? AND number = ?',
+                                  (repo, int(number))).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0])
+
+    def save_summary(self, repo, number, summary):
+        with self.lock:
+            self.db.execute('INSERT OR REPLACE INTO comment_summary VALUES (?, ?, ?)',
+                            (repo, int(number), json.dumps(summary)))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,31 @@
+#------------------------------------------------------------------------------------
+# Running the bots end to end, as separate processes, against a FakeGithub.
+#------------------------------------------------------------------------------------
+
+import os, shutil, subprocess, sys, tempfile
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#------------------------------------------------------------------------------------
+# Run a bot against `server`, with its own state directory (a fresh one unless
+# given) and no response cache. Answers "n" to any prompt (or `answer`, if
+# given). Returns the exit status and everything it printed.
+#------------------------------------------------------------------------------------
+def run_bot(bot, server, *args, **kwargs):
+    statedir = kwargs.get('statedir') or tempfile.mkdtemp()
+    argv = [sys.executable, os.path.join(ROOT, bot), 'triager', 'secret', 'core',
+            '--api-url', server.url, '--statedir', statedir, '--no-cache'] + list(args)
+    proc = subprocess.Popen(argv, cwd=ROOT, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT)
+    output = proc.communicate((kwargs.get('answer', 'n') + '\n') * 100)[0]
+    if not kwargs.get('statedir'):
+        shutil.rmtree(statedir, ignore_errors=True)
+    return proc.returncode, output
+
+def read_plan(path):
+    f = open(path)
+    try:
+        return yaml.safe_load(f) or []
+    finally:
+        f.close()
@@ -0,0 +1,341 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------
+# A local stand-in for the GitHub API, serving canned data, for running the bots
+# end to end without the network.
+#
+# The data is a fixture file (see fixtures/) describing a repo's open PRs and
+# issues: titles, submitters, labels, files, mergeability and comments, with
+# times given in days before now. From that it answers, in GitHub's shapes:
+#
+#   GET  /rate_limit
+#   GET  /repos/OWNER/REPO/pulls, /issues          (listings, paged)
+#   GET  /repos/OWNER/REPO/pulls/N, /issues/N
+#   GET  /repos/OWNER/REPO/issues/N/comments       (paged, with since=)
+#   GET  /search/issues                            (is:, label:, -label:, updated:>=)
+#   GET  /diff/N                                   (each pull's diff_url)
+#   POST /graphql                                  (prbot's batch query)
+#   and the label and comment writes, which change the data
+#
+# A PR fixture with "mergeable": null can say "mergeable_after": N and
+# "resolves_to": true/false, for GitHub working mergeability out lazily: its
+# pull reads null for the first N GETs.
+#
+# Every request is logged (server.log). To run one by hand:
+#
+#   python tests/fakegithub.py [PORT] [FIXTURE]
+#   python prbot.py u p core --api-url http://127.0.0.1:PORT --no-cache ...
+#------------------------------------------------------------------------------------
+
+import BaseHTTPServer, SocketServer, copy, json, os, re, threading, time, urlparse
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+DEFAULT_FIXTURE = os.path.join(FIXTURES, 'ansible-modules-core.json')
+
+def ago(days):
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(time.time() - days * 86400))
+
+def load_fixture(path=DEFAULT_FIXTURE):
+    f = open(path)
+    try:
+        return json.load(f)
+    finally:
+        f.close()
+
+
+class FakeGithub(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, fixture=None, port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        data = copy.deepcopy(fixture or load_fixture())
+        self.repo = data['repo']
+        self.url = 'http://127.0.0.1:%d' % self.server_address[1]
+        self.lock = threading.Lock()
+        self.log = []
+        self.hooks = []
+        self.items = {}
+        for kind in ('pulls', 'issues'):
+            for item in data[kind]:
+                item['is_pull'] = (kind == 'pulls')
+                item['gets'] = 0
+                item['updated_at'] = ago(item['updated_days_ago'])
+                for c in item['comments']:
+                    c['created_at'] = ago(c['days_ago'])
+                self.items[item['number']] = item
+
+    #--------------------------------------------------------------------------------
+    # Serve from a background thread; for tests.
+    #--------------------------------------------------------------------------------
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    #--------------------------------------------------------------------------------
+    # Call hook(self) (under the lock) just before serving the first GET whose
+    # path matches pattern; e.g. to have a human change an item mid-sweep. If
+    # the hook returns (status, headers), that's the answer to the GET instead.
+    #--------------------------------------------------------------------------------
+    def on_get(self, pattern, hook):
+        self.hooks.append((pattern, hook))
+
+    def calls(self, method=None, pattern=None):
+        return [entry for entry in self.log
+                if (method is None or entry[0] == method) and (pattern is None or re.search(pattern, entry[1]))]
+
+    #--------------------------------------------------------------------------------
+    # The JSON GitHub would hand back.
+    #--------------------------------------------------------------------------------
+    def repo_path(self):
+        return '/repos/' + self.repo
+
+    def pull_json(self, item):
+        n = item['number']
+        mergeable = item['mergeable']
+        if (mergeable is None) and ('mergeable_after' in item) and (item['gets'] > item['mergeable_after']):
+            mergeable = item['resolves_to']
+        return {'number': n, 'title': item['title'], 'body': item['body'], 'state': 'open',
+                'user': {'login': item['login']}, 'base': {'ref': item['base_ref']}, 'mergeable': mergeable,
+                'html_url': '%s/%s/pull/%d' % (self.url, self.repo, n),
+                'url': '%s%s/pulls/%d' % (self.url, self.repo_path(), n),
+                'diff_url': '%s/diff/%d' % (self.url, n),
+                'issue_url': '%s%s/issues/%d' % (self.url, self.repo_path(), n),
+                'comments_url': '%s%s/issues/%d/comments' % (self.url, self.repo_path(), n),
+                'updated_at': item['updated_at']}
+
+    def issue_json(self, item):
+        n = item['number']
+        issue_url = '%s%s/issues/%d' % (self.url, self.repo_path(), n)
+        d = {'number': n, 'title': item['title'], 'body': item['body'], 'state': 'open',
+             'user': {'login': item['login']}, 'labels': [{'name': label} for label in item['labels']],
+             'url': issue_url, 'comments_url': issue_url + '/comments', 'labels_url': issue_url + '/labels{/name}',
+             'updated_at': item['updated_at']}
+        if item['is_pull']:
+            d['html_url'] = '%s/%s/pull/%d' % (self.url, self.repo, n)
+            d['pull_request'] = {'url': '%s%s/pulls/%d' % (self.url, self.repo_path(), n)}
+        else:
+            d['html_url'] = '%s/%s/issues/%d' % (self.url, self.repo, n)
+        return d
+
+    def comment_json(self, c):
+        return {'user': {'login': c['login']}, 'body': c['body'], 'created_at': c['created_at']}
+
+    def diff_text(self, item):
+        out = []
+        for f in item['files']:
+            path = f['path']
+            out.append('diff --git a/%s b/%s' % (path, path))
+            if f.get('new'):
+                out += ['new file mode 100644', '--- /dev/null']
+            else:
+                out.append('--- a/' + path)
+            out += ['+++ b/' + path, '@@ -1 +1 @@', '-x', '+y']
+        return '\n'.join(out) + '\n'
+
+    def graphql_node(self, item):
+        pull = self.pull_json(item)
+        return {'number': item['number'], 'title': item['title'], 'body': item['body'],
+                'url': pull['html_url'], 'updatedAt': item['updated_at'], 'state': 'OPEN',
+                'author': {'login': item['login']}, 'baseRefName': item['base_ref'],
+                'mergeable': {True: 'MERGEABLE', False: 'CONFLICTING', None: 'UNKNOWN'}[pull['mergeable']],
+                'labels': {'nodes': [{'name': label} for label in item['labels']]},
+                'files': {'nodes': [{'path': f['path'], 'changeType': f.get('new') and 'ADDED' or 'MODIFIED'}
+                                    for f in item['files']]},
+                'comments': {'nodes': [{'author': {'login': c['login']}, 'body': c['body'], 'createdAt': c['created_at']}
+                                       for c in item['comments'][-100:]]}}
+
+    def newest_first(self, pulls_only=False):
+        return [self.items[n] for n in sorted(self.items, reverse=True)
+                if self.items[n]['is_pull'] or not pulls_only]
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def reply(self, body, status=200, headers=None, ctype='application/json'):
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        elif not isinstance(body, str):
+            body = json.dumps(body)
+        self.send_response(status)
+        self.send_header('X-RateLimit-Limit', '5000')
+        self.send_header('X-RateLimit-Remaining', '4000')
+        self.send_header('X-RateLimit-Reset', str(int(time.time()) + 3600))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', ctype)
+        if ctype == 'text/plain':
+            # Diffs come without a length, as GitHub's usually do; the body
+            # runs to the end of the connection.
+            self.send_header('Connection', 'close')
+            self.close_connection = 1
+        else:
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def not_found(self):
+        self.reply({'message': 'Not Found'}, 404)
+
+    def paged(self, path, entries, query, headers=None):
+        per = int(query.get('per_page', 30))
+        page = int(query.get('page', 1))
+        last = max(1, (len(entries) + per - 1) // per)
+        headers = dict(headers or {})
+        if last > 1:
+            headers['Link'] = '<%s%s?per_page=%d&page=%d>; rel="last"' % (self.server.url, path, per, last)
+        return entries[(page - 1) * per: page * per], headers
+
+    def item(self, number):
+        return self.server.items.get(int(number))
+
+    def do_GET(self):
+        gh = self.server
+        u = urlparse.urlparse(self.path)
+        query = dict(urlparse.parse_qsl(u.query))
+        path = u.path
+        with gh.lock:
+            gh.log.append(('GET', self.path))
+            for pattern, hook in list(gh.hooks):
+                if re.search(pattern, path):
+                    gh.hooks.remove((pattern, hook))
+                    refusal = hook(gh)
+                    if refusal is not None:
+                        return self.reply({'message': 'Refused'}, *refusal)
+            return self.get(gh, path, query)
+
+    def get(self, gh, path, query):
+        repo = gh.repo_path()
+        if path == '/rate_limit':
+            return self.reply({'resources': {}})
+
+        if path == repo + '/pulls':
+            entries, headers = self.paged(path, [gh.pull_json(i) for i in gh.newest_first(True)], query)
+            return self.reply(entries, headers=headers)
+        if path == repo + '/issues':
+            entries, headers = self.paged(path, [gh.issue_json(i) for i in gh.newest_first()], query)
+            return self.reply(entries, headers=headers)
+
+        if path == '/search/issues':
+            items = [gh.issue_json(i) for i in gh.newest_first()]
+            for term in query['q'].split():
+                if term == 'is:pr':
+                    items = [i for i in items if 'pull_request' in i]
+                elif term == 'is:issue':
+                    items = [i for i in items if 'pull_request' not in i]
+                elif term.startswith('label:'):
+                    items = [i for i in items if term[6:] in [l['name'] for l in i['labels']]]
+                elif term.startswith('-label:'):
+                    items = [i for i in items if term[7:] not in [l['name'] for l in i['labels']]]
+                elif term.startswith('updated:>='):
+                    items = [i for i in items if i['updated_at'] >= term[10:]]
+            entries, headers = self.paged(path, items, query, {'X-RateLimit-Resource': 'search'})
+            return self.reply({'total_count': len(items), 'incomplete_results': False, 'items': entries},
+                              headers=headers)
+
+        m = re.match(re.escape(repo) + r'/pulls/(\d+)$', path)
+        if m:
+            item = self.item(m.group(1))
+            if (item is None) or not item['is_pull']:
+                return self.not_found()
+            item['gets'] += 1
+            return self.reply(gh.pull_json(item))
+
+        m = re.match(r'/diff/(\d+)$', path)
+        if m:
+            return self.reply(gh.diff_text(self.item(m.group(1))), ctype='text/plain')
+
+        m = re.match(re.escape(repo) + r'/issues/(\d+)$', path)
+        if m:
+            item = self.item(m.group(1))
+            if item is None:
+                return self.not_found()
+            return self.reply(gh.issue_json(item))
+
+        m = re.match(re.escape(repo) + r'/issues/(\d+)/comments$', path)
+        if m:
+            item = self.item(m.group(1))
+            if item is None:
+                return self.not_found()
+            comments = [c for c in item['comments'] if c['created_at'] >= query.get('since', '')]
+            entries, headers = self.paged(path, [gh.comment_json(c) for c in comments], query)
+            return self.reply(entries, headers=headers)
+
+        self.not_found()
+
+    def do_POST(self):
+        gh = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with gh.lock:
+            gh.log.append(('POST', self.path, body))
+            if self.path == '/graphql':
+                query = json.loads(body)['query']
+                repository = {}
+                for alias, number in re.findall(r'(pr\d+): pullRequest\(number: (\d+)\)', query):
+                    item = self.item(number)
+                    if (item is not None) and item['is_pull']:
+                        item['gets'] += 1
+                        repository[alias] = gh.graphql_node(item)
+                    else:
+                        repository[alias] = None
+                return self.reply({'data': {'repository': repository}}, headers={'X-RateLimit-Resource': 'graphql'})
+
+            m = re.match(re.escape(gh.repo_path()) + r'/issues/(\d+)/(comments|labels)$', self.path)
+            if m and self.item(m.group(1)):
+                item = self.item(m.group(1))
+                if m.group(2) == 'comments':
+                    item['comments'].append({'login': 'triager', 'body': json.loads(body)['body'],
+                                             'created_at': ago(0)})
+                else:
+                    for label in json.loads(body):
+                        if label not in item['labels']:
+                            item['labels'].append(label)
+                return self.reply({}, 201)
+            self.not_found()
+
+    def do_PUT(self):
+        gh = self.server
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        with gh.lock:
+            gh.log.append(('PUT', self.path, body))
+            m = re.match(re.escape(gh.repo_path()) + r'/issues/(\d+)/labels$', self.path)
+            if m and self.item(m.group(1)):
+                self.item(m.group(1))['labels'] = list(json.loads(body))
+                return self.reply([{'name': label} for label in json.loads(body)])
+            self.not_found()
+
+    def do_DELETE(self):
+        gh = self.server
+        with gh.lock:
+            gh.log.append(('DELETE', self.path))
+            m = re.match(re.escape(gh.repo_path()) + r'/issues/(\d+)/labels/(.+)$', self.path)
+            if m and self.item(m.group(1)):
+                item = self.item(m.group(1))
+                item['labels'] = [label for label in item['labels'] if label != m.group(2)]
+                return self.reply([{'name': label} for label in item['labels']])
+            self.not_found()
+
+    def log_message(self, format, *args):
+        pass
+
+if __name__ == '__main__':
+    import sys
+    port = 8765
+    if len(sys.argv) > 1:
+        port = int(sys.argv[1])
+    fixture = None
+    if len(sys.argv) > 2:
+        fixture = load_fixture(sys.argv[2])
+    server = FakeGithub(fixture, port)
+    print "Serving", server.repo, "on", server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
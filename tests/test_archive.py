@@ -0,0 +1,58 @@
+import os, shutil, subprocess, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive
+from tests.botrun import ROOT, run_bot
+from tests.fakegithub import FakeGithub
+
+
+class ArchiveTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp, 'run.jsonl.gz')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def run_bot(self, bot, *args):
+        status, output = run_bot(bot, self.server, '--archive', self.path, *args)
+        self.assertEqual(status, 0, output)
+
+    def test_rest(self):
+        self.run_bot('prbot.py', '--pr', '3')
+        item = archive.load_item(self.path, 3)
+        self.assertEqual(sorted(item), ['archived_at', 'comment_pages', 'files', 'issue', 'number', 'pull', 'repo'])
+        # 151 comments, so two pages; the listing fetches the first and last up front.
+        self.assertEqual(sorted(item['comment_pages']), ['1', '2'])
+        self.assertEqual(item['comment_pages']['2'][-1]['user']['login'], 'gregdek')
+
+    def test_graphql(self):
+        self.run_bot('prbot.py', '--graphql')
+        item = archive.load_item(self.path, 3)
+        self.assertEqual(item['graphql']['number'], 3)
+        self.assertEqual(len(item['graphql']['comments']['nodes']), 100)
+        self.assertEqual(sorted(archive.load_item(self.path, n)['graphql']['number'] for n in range(1, 8)),
+                         range(1, 8))
+
+    def test_incremental(self):
+        self.run_bot('prbot.py', '--pr', '3', '--incremental')
+        self.assertEqual(len(archive.load_item(self.path, 3)['comment_pages']), 2)
+
+    def test_issues(self):
+        self.run_bot('issuebot.py')
+        item = archive.load_item(self.path, 100)
+        self.assertEqual(item['issue']['number'], 100)
+        self.assertEqual(sorted(item['comment_pages']), ['1'])
+
+    def test_listing(self):
+        self.run_bot('prbot.py', '--pr', '3')
+        output = subprocess.check_output([sys.executable, os.path.join(ROOT, 'archive.py'), self.path])
+        self.assertEqual(output.splitlines(), ['ansible/ansible-modules-core 3 (3 records, %d bytes)'
+                                               % os.path.getsize(self.path)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+import os, sys, threading, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fetchpool import paged_listing, ordered_map
+
+class Page(object):
+
+    def __init__(self, n, last):
+        self.n = n
+        self.links = {}
+        if last > 1:
+            self.links['last'] = {'url': 'https://api.github.com/x?page=%d' % last}
+
+    def json(self):
+        return [(self.n, i) for i in range(3)]
+
+
+class PagedListingTest(unittest.TestCase):
+
+    def test_later_pages_start_before_page_one_is_handed_out(self):
+        asked = []
+        all_asked = threading.Event()
+        def get_page(n):
+            asked.append(n)
+            if len(asked) == 4:
+                all_asked.set()
+            return Page(n, 4)
+        listing = paged_listing(get_page, workers=4)
+        self.assertEqual(next(listing), (1, 0))
+        # Nothing more has been taken from the listing, but the rest is on its way.
+        self.assertTrue(all_asked.wait(10))
+        self.assertEqual(sorted(asked), [1, 2, 3, 4])
+        self.assertEqual(list(listing), [(1, 1), (1, 2)] + [(n, i) for n in (2, 3, 4) for i in range(3)])
+
+    def test_ordered_map_keeps_order(self):
+        self.assertEqual(list(ordered_map(lambda n: n * 2, range(50), workers=3)), range(0, 100, 2))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.botrun import run_bot, read_plan
+from tests.fakegithub import FakeGithub, ago
+
+
+class GraphQLModeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def plan(self, *args):
+        path = os.path.join(self.tmp, 'plan%d.yml' % len(os.listdir(self.tmp)))
+        status, output = run_bot('prbot.py', self.server, '--plan', path, *args)
+        self.assertEqual(status, 0, output)
+        return read_plan(path)
+
+    def test_same_plan_as_rest(self):
+        rest = self.plan()
+        batched = self.plan('--graphql', '--batch-size', '3')
+        self.assertTrue(rest)
+        self.assertEqual(sorted(rest), sorted(batched))
+        self.assertTrue(self.server.calls('POST', '^/graphql$'))
+
+    def test_missing_pr(self):
+        for mode in ([], ['--graphql']):
+            status, output = run_bot('prbot.py', self.server, '--pr', '999', *mode)
+            self.assertEqual(status, 1)
+            self.assertIn('GitHub has no such PR', output)
+            self.assertNotIn('Traceback', output)
+
+    def test_failed_pr_in_sweep(self):
+        everything = [entry['number'] for entry in self.plan()]
+        self.assertIn(5, everything)
+        self.server.on_get(r'/pulls/5$', lambda gh: (404, {}))
+        path = os.path.join(self.tmp, 'failed.yml')
+        status, output = run_bot('prbot.py', self.server, '--plan', path)
+        self.assertEqual(status, 0, output)
+        self.assertIn('FAILED ansible/ansible-modules-core 5', output)
+        self.assertNotIn('Traceback', output)
+        self.assertEqual(sorted(entry['number'] for entry in read_plan(path)), sorted(n for n in everything if n != 5))
+
+    def test_failed_comment_page_in_triage(self):
+        # Enough chatter on PR 5 that the rules walk back past its last page,
+        # and the page before that (fetched only then) isn't there.
+        for i in range(401):
+            self.server.items[5]['comments'].append({'login': 'bystander', 'body': 'me too', 'created_at': ago(1)})
+        def page(n):
+            def hook(gh):
+                if n < 3:
+                    gh.on_get(r'/issues/5/comments$', page(n + 1))
+                else:
+                    return 404, {}
+            return hook
+        self.server.on_get(r'/issues/5/comments$', page(1))
+        path = os.path.join(self.tmp, 'failed.yml')
+        status, output = run_bot('prbot.py', self.server, '--plan', path)
+        self.assertEqual(status, 0, output)
+        self.assertIn('FAILED ansible/ansible-modules-core 5 : HTTPError', output)
+        self.assertNotIn('Traceback', output)
+        self.assertEqual(sorted(entry['number'] for entry in read_plan(path)), [1, 2, 3, 4, 6, 7])
+
+if __name__ == '__main__':
+    unittest.main()
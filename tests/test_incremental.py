@@ -0,0 +1,48 @@
+import os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from statestore import TriageState
+from tests.botrun import run_bot
+from tests.fakegithub import FakeGithub
+
+#------------------------------------------------------------------------------------
+# What a sweep records as each PR's updated_at is what the /issues listing said,
+# which is what --incremental compares against, even when the pull (or the
+# GraphQL node) says something else.
+#------------------------------------------------------------------------------------
+class RecordedUpdatedAtTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+        pull_json, graphql_node = self.server.pull_json, self.server.graphql_node
+        self.server.pull_json = lambda item: dict(pull_json(item), updated_at='2000-01-01T00:00:00Z')
+        self.server.graphql_node = lambda item: dict(graphql_node(item), updatedAt='2000-01-01T00:00:00Z')
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def recorded(self, *args):
+        statedir = tempfile.mkdtemp(dir=self.tmp)
+        status, output = run_bot('prbot.py', self.server, '--plan', os.path.join(statedir, 'plan.yml'),
+                                 *args, statedir=statedir)
+        self.assertEqual(status, 0, output)
+        state = TriageState(os.path.join(statedir, 'triage.db'))
+        repo = 'ansible/ansible-modules-core'
+        pulls = [item for item in self.server.items.values() if item['is_pull']]
+        self.assertEqual([state.get(repo, item['number'])['updated_at'] for item in pulls],
+                         [item['updated_at'] for item in pulls])
+
+    def test_sweep(self):
+        self.recorded()
+
+    def test_graphql_sweep(self):
+        self.recorded('--graphql', '--batch-size', '3')
+
+    def test_sharded_graphql_sweep(self):
+        self.recorded('--graphql', '--queue', os.path.join(self.tmp, 'queue.db'), '--shards', '2')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.botrun import run_bot
+from tests.fakegithub import FakeGithub
+
+#------------------------------------------------------------------------------------
+# Labels a human changes between the bot fetching an item and writing to it
+# survive the write.
+#------------------------------------------------------------------------------------
+class LabelWriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def relabel(self, number, labels):
+        def hook(gh):
+            gh.items[number]['labels'] = labels
+        return hook
+
+    def test_prbot_keeps_new_labels(self):
+        self.server.on_get(r'/issues/7/comments$', self.relabel(7, ['bug', 'community_review']))
+        status, output = run_bot('prbot.py', self.server, '--pr', '7', answer='y')
+        self.assertEqual(status, 0, output)
+        self.assertEqual(self.server.items[7]['labels'], ['bug', 'needs_rebase', 'cloud'])
+
+    def test_issuebot_keeps_new_labels(self):
+        self.server.on_get(r'/issues/100/comments$', self.relabel(100, ['P3', 'bug']))
+        status, output = run_bot('issuebot.py', self.server, answer='y')
+        self.assertEqual(status, 0, output)
+        self.assertEqual(self.server.items[100]['labels'], ['bug'])
+
+if __name__ == '__main__':
+    unittest.main()
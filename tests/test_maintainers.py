@@ -0,0 +1,69 @@
+import os, sys, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from maintainers import MaintainerIndex, mentions
+from commentsummary import empty_summary, merge, summary_comments
+
+LINES = ['cloud/amazon/_ec2_ami_search.py: DEPRECATED\n',
+         'cloud/amazon/ec2.py: ansible\n',
+         'cloud/amazon/ec2_ami.py: scicoin-project\n',
+         'cloud/cloudstack/: resmo\n',
+         'files/copy.py: ansible\n',
+         'windows/copy.py: trondhindenes\n']
+
+
+class MentionTest(unittest.TestCase):
+
+    def test_forms(self):
+        self.assertEqual(mentions('[module: ec2]'), ['ec2'])
+        self.assertEqual(mentions('It breaks. [Module: ec2.py] Thanks'), ['ec2.py'])
+        self.assertEqual(mentions('[ filename : cloud/amazon/ec2.py ]'), ['cloud/amazon/ec2.py'])
+        self.assertEqual(mentions('[module: a.py, b.py]'), ['a.py', 'b.py'])
+        self.assertEqual(mentions('[module: a.py] and [module: b.py c.py]'), ['a.py', 'b.py', 'c.py'])
+
+    def test_no_mentions(self):
+        self.assertEqual(mentions('[module]'), [])
+        self.assertEqual(mentions('[module: ]'), [])
+        self.assertEqual(mentions('module: ec2.py'), [])
+        self.assertEqual(mentions(None), [])
+
+
+class LookupTest(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MaintainerIndex.parse(LINES)
+
+    def test_paths(self):
+        self.assertEqual(self.index.lookup('cloud/amazon/ec2.py'), ['ansible'])
+        self.assertEqual(self.index.lookup('cloud/cloudstack/cs_instance.py'), ['resmo'])
+        self.assertEqual(self.index.lookup('cloud/amazon/new_thing.py'), [])
+
+    def test_lookup_is_by_path_or_filename_only(self):
+        self.assertEqual(self.index.lookup('ec2_ami.py'), ['scicoin-project'])
+        self.assertEqual(self.index.lookup('ec2'), [])
+
+    def test_mention_names(self):
+        self.assertEqual(self.index.lookup_mention('ec2'), ['ansible'])
+        self.assertEqual(self.index.lookup_mention('ec2.py'), ['ansible'])
+        self.assertEqual(self.index.lookup_mention('ec2_ami_search'), ['DEPRECATED'])
+        self.assertEqual(self.index.lookup_mention('_ec2_ami_search.py'), ['DEPRECATED'])
+        self.assertEqual(self.index.lookup_mention('ec2_ami_search.py'), ['DEPRECATED'])
+        # Two modules called copy: ambiguous, so nobody.
+        self.assertEqual(self.index.lookup_mention('copy'), [])
+
+
+class SummaryTest(unittest.TestCase):
+
+    def comment(self, n, login, body):
+        return {'id': n, 'user': {'login': login}, 'body': body, 'created_at': '2016-03-%02dT10:00:00Z' % n}
+
+    def test_keeps_newest_mention_in_any_form(self):
+        comments = [self.comment(1, 'u2', 'broken [filename: cloud/amazon/ec2.py]'),
+                    self.comment(2, 'u2', 'any news?'),
+                    self.comment(3, 'u3', '+1')]
+        kept = summary_comments(merge(empty_summary(), comments, ['gregdek']))
+        self.assertEqual([c['id'] for c in kept], [1, 2, 3])
+
+if __name__ == '__main__':
+    unittest.main()
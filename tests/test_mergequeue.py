@@ -0,0 +1,101 @@
+import os, sys, threading, time, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from mergequeue import MergeQueue
+
+class PR(object):
+
+    def __init__(self, number, answers):
+        self.number = number
+        self.mergeable = None
+        # What GitHub says each time it's asked; the last answer sticks.
+        self.answers = list(answers)
+        self.asked = 0
+
+    def __repr__(self):
+        return 'PR %d' % self.number
+
+def refresh(pr):
+    pr.asked += 1
+    answer = pr.answers[min(pr.asked, len(pr.answers)) - 1]
+    if isinstance(answer, Exception):
+        raise answer
+    return answer
+
+
+class MergeQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.mergeq = MergeQueue(refresh, workers=2, backoff=(0, 0, 0))
+
+    def tearDown(self):
+        self.mergeq.close()
+
+    def test_resolves(self):
+        pr = PR(1, [None, False])
+        self.mergeq.defer(pr)
+        self.assertEqual(list(self.mergeq.drain()), [pr])
+        self.assertEqual((pr.mergeable, pr.asked), (False, 2))
+        self.assertEqual(len(self.mergeq), 0)
+
+    def test_gives_up(self):
+        pr = PR(2, [None])
+        self.mergeq.defer(pr)
+        self.assertEqual(list(self.mergeq.drain()), [pr])
+        self.assertEqual((pr.mergeable, pr.asked), (None, 3))
+
+    def test_refresh_failing(self):
+        pr = PR(3, [IOError('connection reset')])
+        self.mergeq.defer(pr)
+        self.assertEqual(list(self.mergeq.drain()), [pr])
+        self.assertEqual((pr.mergeable, pr.asked), (None, 1))
+
+    def test_drain_keeps_order(self):
+        prs = [PR(n, [None] * (5 - n) + [True]) for n in range(1, 5)]
+        for pr in prs:
+            self.mergeq.defer(pr)
+        self.assertEqual(list(self.mergeq.drain()), prs)
+
+    def test_ready_doesnt_wait(self):
+        answered = threading.Event()
+        def slow(pr):
+            answered.wait()
+            return True
+        mergeq = MergeQueue(slow, workers=1, backoff=(0,))
+        try:
+            pr = PR(4, [])
+            mergeq.defer(pr)
+            self.assertEqual(mergeq.ready(), [])
+            self.assertEqual(len(mergeq), 1)
+            answered.set()
+            deadline = time.time() + 10
+            ready = []
+            while (not ready) and (time.time() < deadline):
+                ready = mergeq.ready()
+                time.sleep(0.01)
+            self.assertEqual(ready, [pr])
+            self.assertTrue(pr.mergeable)
+            self.assertEqual(len(mergeq), 0)
+        finally:
+            answered.set()
+            mergeq.close()
+
+    def test_replaying(self):
+        # Real backoff, which a replay mustn't wait through.
+        mergeq = MergeQueue(refresh, workers=2, replaying=True)
+        try:
+            prs = [PR(n, [None] * (3 - n) + [True]) for n in range(1, 3)] + [PR(3, [None])]
+            started = time.time()
+            for pr in prs:
+                mergeq.defer(pr)
+            time.sleep(0.1)
+            self.assertEqual(mergeq.ready(), [])
+            self.assertEqual(list(mergeq.drain()), prs)
+            self.assertLess(time.time() - started, 5)
+            self.assertEqual([pr.mergeable for pr in prs], [True, True, None])
+        finally:
+            mergeq.close()
+
+if __name__ == '__main__':
+    unittest.main()
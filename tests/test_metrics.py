@@ -0,0 +1,33 @@
+import json, os, shutil, sys, tempfile, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.botrun import run_bot
+from tests.fakegithub import FakeGithub
+
+
+class MetricsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def test_streamed_diff_bytes(self):
+        prefix = os.path.join(self.tmp, 'run')
+        status, output = run_bot('prbot.py', self.server, '--plan', os.path.join(self.tmp, 'plan.yml'),
+                                 '--metrics', prefix)
+        self.assertEqual(status, 0, output)
+        f = open(prefix + '.json')
+        try:
+            endpoints = json.load(f)['endpoints']
+        finally:
+            f.close()
+        diffs = [self.server.diff_text(item) for item in self.server.items.values() if item['is_pull']]
+        self.assertEqual(endpoints['GET /diff/:n']['bytes'], sum(len(diff) for diff in diffs))
+
+if __name__ == '__main__':
+    unittest.main()
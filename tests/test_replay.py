@@ -0,0 +1,73 @@
+import gzip, json, os, shutil, sys, tempfile, unittest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cassette import Cassette
+from ghclient import GithubClient
+from tests.botrun import run_bot, read_plan
+from tests.fakegithub import FakeGithub
+
+def recorded_statuses(path):
+    f = gzip.open(path, 'rb')
+    try:
+        f.readline()
+        return [json.loads(line)['status'] for line in f]
+    finally:
+        f.close()
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def path(self, name):
+        return os.path.join(self.tmp, name)
+
+    def test_replay_leaves_state_alone(self):
+        # One rate limit refusal along the way, which the recording run waits out.
+        self.server.on_get(r'/pulls/7$', lambda gh: (403, {'Retry-After': '0'}))
+        status, output = run_bot('prbot.py', self.server, '--record', self.path('run.cassette'),
+                                 '--plan', self.path('recorded.yml'))
+        self.assertEqual(status, 0, output)
+        self.assertIn('Asked to back off', output)
+        self.assertNotIn(403, recorded_statuses(self.path('run.cassette')))
+
+        os.mkdir(self.path('state'))
+        calls = len(self.server.log)
+        status, output = run_bot('prbot.py', self.server, '--replay', self.path('run.cassette'),
+                                 '--plan', self.path('replayed.yml'), statedir=self.path('state'))
+        self.assertEqual(status, 0, output)
+        self.assertEqual(len(self.server.log), calls)
+        self.assertFalse(os.path.exists(self.path('state/triage.db')))
+        self.assertEqual(read_plan(self.path('replayed.yml')), read_plan(self.path('recorded.yml')))
+
+        # And the same again, in the same order, every time.
+        status, output = run_bot('prbot.py', self.server, '--replay', self.path('run.cassette'),
+                                 '--plan', self.path('again.yml'), statedir=self.path('state'))
+        self.assertEqual(status, 0, output)
+        self.assertEqual(read_plan(self.path('again.yml')), read_plan(self.path('replayed.yml')))
+
+    def test_replayed_refusal_is_returned(self):
+        # As an older cassette might have one.
+        url = self.server.url + '/rate_limit'
+        refusal = requests.Response()
+        refusal.status_code = 403
+        refusal.url = url
+        refusal.headers['X-RateLimit-Remaining'] = '0'
+        refusal._content = '{"message": "API rate limit exceeded"}'
+        cassette = Cassette(self.path('old.cassette'), 'record')
+        cassette.record('GET', url, refusal)
+        cassette.close()
+
+        gh = GithubClient('triager', 'secret', cassette=Cassette(self.path('old.cassette'), 'replay'))
+        self.assertEqual(gh.get(url).status_code, 403)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os, shutil, socket, subprocess, sys, tempfile, threading, time, unittest
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import webhook
+from tests.botrun import ROOT, read_plan
+from tests.fakegithub import FakeGithub, FIXTURES
+
+PAYLOADS = os.path.join(FIXTURES, 'webhooks')
+REPO = 'ansible/ansible-modules-core'
+
+def payload(name):
+    f = open(os.path.join(PAYLOADS, name))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+def wait_for(check, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if check():
+            return True
+        time.sleep(0.1)
+    return False
+
+
+class ListenerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.triaged = []
+        self.listener = webhook.Listener(0, 's3cret', self.triage, lambda item: item[0] == REPO,
+                                         debounce=0, bind='127.0.0.1')
+        self.url = 'http://127.0.0.1:%d/' % self.listener.server.server_address[1]
+        thread = threading.Thread(target=self.listener.run)
+        thread.daemon = True
+        thread.start()
+
+    def tearDown(self):
+        self.listener.server.shutdown()
+
+    def triage(self, item):
+        self.triaged.append(item)
+        if item[1] == 100:
+            # What triage does on a write error or a missing maintainer.
+            sys.exit(1)
+
+    def send(self, event, name, secret='s3cret'):
+        return webhook.send(self.url, event, payload(name), secret)
+
+    def test_recorded_payloads(self):
+        r = self.send('issue_comment', 'issue_comment-pull.json')
+        self.assertEqual((r.status_code, r.text), (202, 'queued\n'))
+        r = self.send('pull_request', 'pull_request-closed.json')
+        self.assertEqual((r.status_code, r.text), (202, 'ignored\n'))
+        self.assertTrue(wait_for(lambda: self.triaged == [(REPO, 4, True)]))
+
+    def test_bad_signature(self):
+        r = self.send('issues', 'issues-opened.json', secret='wrong')
+        self.assertEqual(r.status_code, 401)
+        r = self.send('issues', 'issues-opened.json', secret=None)
+        self.assertEqual(r.status_code, 401)
+
+    def test_duplicate_delivery(self):
+        body = payload('pull_request-synchronize.json')
+        headers = {'X-GitHub-Event': 'pull_request', 'X-GitHub-Delivery': 'abc',
+                   'X-Hub-Signature-256': 'sha256=' + webhook.sign('s3cret', body)}
+        self.assertEqual(requests.post(self.url, data=body, headers=headers).text, 'queued\n')
+        self.assertEqual(requests.post(self.url, data=body, headers=headers).text, 'duplicate delivery\n')
+
+    def test_survives_triage_exiting(self):
+        self.send('issues', 'issues-opened.json')
+        self.assertTrue(wait_for(lambda: len(self.triaged) == 1))
+        self.send('pull_request', 'pull_request-synchronize.json')
+        self.assertTrue(wait_for(lambda: len(self.triaged) == 2))
+        self.assertEqual(self.triaged, [(REPO, 100, False), (REPO, 4, True)])
+
+
+class ListenModeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = FakeGithub().start()
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.stop()
+        shutil.rmtree(self.tmp)
+
+    def argv(self, bot, *args):
+        return [sys.executable, os.path.join(ROOT, bot), 'triager', 'secret', 'core',
+                '--api-url', self.server.url, '--statedir', self.tmp, '--no-cache'] + list(args)
+
+    def test_needs_plan(self):
+        for bot in ('prbot.py', 'issuebot.py'):
+            proc = subprocess.Popen(self.argv(bot, '--listen', str(free_port())), cwd=ROOT,
+                                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            output = proc.communicate()[0]
+            self.assertEqual(proc.returncode, 2)
+            self.assertIn('needs a --plan', output)
+
+    def test_triages_into_plan(self):
+        port = free_port()
+        plan = os.path.join(self.tmp, 'plan.yml')
+        log = open(os.path.join(self.tmp, 'listener.log'), 'w')
+        proc = subprocess.Popen(self.argv('prbot.py', '--listen', str(port), '--webhook-secret', 's3cret',
+                                          '--debounce', '0', '--plan', plan),
+                                cwd=ROOT, stdout=log, stderr=subprocess.STDOUT)
+        try:
+            url = 'http://127.0.0.1:%d/' % port
+            def listening():
+                try:
+                    return webhook.send(url, 'ping', '{}', 's3cret').status_code == 200
+                except requests.exceptions.ConnectionError:
+                    return False
+            self.assertTrue(wait_for(listening))
+            r = webhook.send(url, 'issue_comment', payload('issue_comment-pull.json'), 's3cret')
+            self.assertEqual(r.status_code, 202)
+            self.assertTrue(wait_for(lambda: [entry['number'] for entry in read_plan(plan)] == [4]),
+                            open(log.name).read())
+        finally:
+            proc.terminate()
+            proc.wait()
+            log.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import os, shutil, sys, tempfile, time, unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from tests.botrun import run_bot, read_plan
+from tests.fakegithub import FakeGithub
+from workqueue import WorkQueue
+
+REPO = 'ansible/ansible-modules-core'
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.queue = WorkQueue(os.path.join(self.tmp, 'queue.db'), lease=0.3)
+        self.queue.fill([(REPO, 1, '2016-01-01T00:00:00Z')])
+
+    def tearDown(self):
+        self.queue.close()
+        shutil.rmtree(self.tmp)
+
+    def test_lease_runs_out(self):
+        self.assertEqual(tuple(self.queue.claim('a')), (REPO, 1))
+        time.sleep(0.5)
+        self.assertEqual(tuple(self.queue.claim('b')), (REPO, 1))
+        self.assertFalse(self.queue.finish(REPO, 1, 'a', {}))
+        self.assertTrue(self.queue.finish(REPO, 1, 'b', {}))
+
+    def test_held_lease_is_renewed(self):
+        self.queue.claim('a')
+        with self.queue.held(REPO, 1, 'a'):
+            # Several leases' worth, as when waiting out the rate limit.
+            time.sleep(1.2)
+            self.assertIsNone(self.queue.claim('b'))
+        self.assertTrue(self.queue.finish(REPO, 1, 'a', {}))
+        self.assertEqual(self.queue.counts()['done'], 1)
+
+    def test_renew_needs_the_lease(self):
+        self.queue.claim('a')
+        self.assertFalse(self.queue.renew(REPO, 1, 'b'))
+        self.assertTrue(self.queue.renew(REPO, 1, 'a'))
+
+
+class ShardedSweepTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp)
+
+    # Each run gets a server of its own, so GitHub hasn't worked out whether
+    # PRs are mergeable for either of them yet.
+    def plan(self, name, *args):
+        server = FakeGithub().start()
+        try:
+            path = os.path.join(self.tmp, name + '.yml')
+            status, output = run_bot('prbot.py', server, '--plan', path, *args)
+            self.assertEqual(status, 0, output)
+            return sorted((entry['number'], entry['actions']) for entry in read_plan(path))
+        finally:
+            server.stop()
+
+    def test_same_plan_as_a_sweep(self):
+        sweep = self.plan('sweep')
+        self.assertTrue([number for number, actions in sweep if 'newlabel: needs_rebase' in actions])
+        sharded = self.plan('sharded', '--queue', os.path.join(self.tmp, 'queue.db'), '--shards', '3')
+        self.assertEqual(sharded, sweep)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+#------------------------------------------------------------------------------------
+# Webhook listener for event-driven triage.
+#
+# Instead of sweeping every open item, a bot can sit and wait for GitHub to tell
+# it what changed: point a repo webhook (content type application/json, events
+# "Issues", "Issue comments" and "Pull requests") at the listener, and each
+# delivery names the one item it's about.
+#
+# Deliveries are checked against the webhook secret (X-Hub-Signature-256), and
+# repeats of the same delivery are dropped. Bursts of events for one item (say a
+# push followed by three comments) are debounced: the item is triaged once, when
+# it has been quiet for a few seconds. Triage runs one item at a time, in a
+# single worker thread, in the order items went quiet.
+#
+# Recorded payloads can be replayed at a listener with this script:
+#
+#   python webhook.py http://127.0.0.1:8000/ issue_comment payload.json --secret s3cret
+#------------------------------------------------------------------------------------
+
+import BaseHTTPServer, SocketServer, hashlib, hmac, json, threading, time, uuid
+from collections import deque
+
+#------------------------------------------------------------------------------------
+# Signatures. GitHub signs the raw body with HMAC-SHA256 (and, for old hooks,
+# HMAC-SHA1) using the webhook secret.
+#------------------------------------------------------------------------------------
+def sign(secret, body, digest=hashlib.sha256):
+    return hmac.new(secret, body, digest).hexdigest()
+
+def verify_signature(secret, body, headers):
+    if 'X-Hub-Signature-256' in headers:
+        expected = 'sha256=' + sign(secret, body, hashlib.sha256)
+        return hmac.compare_digest(expected, headers['X-Hub-Signature-256'])
+    if 'X-Hub-Signature' in headers:
+        expected = 'sha1=' + sign(secret, body, hashlib.sha1)
+        return hmac.compare_digest(expected, headers['X-Hub-Signature'])
+    return False
+
+#------------------------------------------------------------------------------------
+# Work out which item an event is about. Returns (repo, number, is_pull), or
+# None for events that don't call for triage (other event types, and items
+# that have been closed).
+#------------------------------------------------------------------------------------
+def event_item(event, payload):
+    repo = payload.get('repository', {}).get('full_name')
+    if event == 'pull_request':
+        item = payload['pull_request']
+        is_pull = True
+    elif event in ('issues', 'issue_comment'):
+        item = payload['issue']
+        is_pull = 'pull_request' in item
+    else:
+        return None
+    if (payload.get('action') == 'closed') or (item.get('state') == 'closed'):
+        return None
+    return repo, int(item['number']), is_pull
+
+#------------------------------------------------------------------------------------
+# The debouncer. note() says an item has had an event; the item becomes due
+# `delay` seconds after its most recent event, and next_due() hands out due
+# items, oldest first, blocking until there is one.
+#------------------------------------------------------------------------------------
+class Debouncer(object):
+
+    def __init__(self, delay=5, remember=1000):
+        self.delay = delay
+        self.cond = threading.Condition()
+        self.quiet_at = {}
+        self.deliveries = set()
+        self.delivery_order = deque()
+        self.remember = remember
+
+    #--------------------------------------------------------------------------------
+    # Returns False if this delivery has been seen before (GitHub redelivers on
+    # timeouts, and anyone can hit "Redeliver" in the UI).
+    #--------------------------------------------------------------------------------
+    def note(self, item, delivery=None, now=None):
+        if now is None:
+            now = time.time()
+        with self.cond:
+            if delivery is not None:
+                if delivery in self.deliveries:
+                    return False
+                self.deliveries.add(delivery)
+                self.delivery_order.append(delivery)
+                if len(self.delivery_order) > self.remember:
+                    self.deliveries.discard(self.delivery_order.popleft())
+            self.quiet_at[item] = now + self.delay
+            self.cond.notify()
+        return True
+
+    def next_due(self):
+        with self.cond:
+            while True:
+                now = time.time()
+                if self.quiet_at:
+                    item = min(self.quiet_at, key=self.quiet_at.get)
+                    wait = self.quiet_at[item] - now
+                    if wait <= 0:
+                        del self.quiet_at[item]
+                        return item
+                else:
+                    wait = 60
+                self.cond.wait(wait)
+
+    def pending(self):
+        with self.cond:
+            return len(self.quiet_at)
+
+
+class WebhookServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class WebhookHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def reply(self, status, message):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Content-Length', str(len(message)))
+        self.end_headers()
+        self.wfile.write(message)
+
+    def do_POST(self):
+        listener = self.server.listener
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+        if listener.secret and not verify_signature(listener.secret, body, self.headers):
+            return self.reply(401, 'bad signature\n')
+
+        event = self.headers.get('X-GitHub-Event')
+        if event == 'ping':
+            return self.reply(200, 'pong\n')
+        try:
+            item = event_item(event, json.loads(body))
+        except (ValueError, KeyError, TypeError):
+            return self.reply(400, 'not a payload we understand\n')
+        if (item is None) or not listener.wanted(item):
+            return self.reply(202, 'ignored\n')
+
+        if listener.debouncer.note(item, self.headers.get('X-GitHub-Delivery')):
+            return self.reply(202, 'queued\n')
+        return self.reply(202, 'duplicate delivery\n')
+
+    def log_message(self, format, *args):
+        if self.server.listener.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+#------------------------------------------------------------------------------------
+# Listener: serve webhooks on `port`, and call triage_item(item) for each item
+# as it comes due. `wanted(item)` filters out items this bot doesn't handle
+# (other repos, or PRs for issuebot and vice versa). Runs until interrupted.
+#------------------------------------------------------------------------------------
+class Listener(object):
+
+    def __init__(self, port, secret, triage_item, wanted, debounce=5, bind='', verbose=''):
+        self.secret = secret
+        self.triage_item = triage_item
+        self.wanted = wanted
+        self.verbose = verbose
+        self.debouncer = Debouncer(debounce)
+        self.server = WebhookServer((bind, port), WebhookHandler)
+        self.server.listener = self
+
+    def work(self):
+        while True:
+            item = self.debouncer.next_due()
+            try:
+                self.triage_item(item)
+            except (Exception, SystemExit) as e:
+                # One bad item mustn't take the listener down (triage exits on
+                # some errors, and this is the only worker).
+                print "ERROR triaging", item, ":", e.__class__.__name__, e
+
+    def run(self):
+        worker = threading.Thread(target=self.work)
+        worker.daemon = True
+        worker.start()
+        host, port = self.server.server_address
+        print "Listening for webhooks on port", port
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            print "Stopping;", self.debouncer.pending(), "items still waiting"
+        finally:
+            self.server.server_close()
+
+#------------------------------------------------------------------------------------
+# Replay a recorded payload at a listener, signed the way GitHub would sign it.
+#------------------------------------------------------------------------------------
+def send(url, event, body, secret=None):
+    import requests
+    headers = {'Content-Type': 'application/json',
+               'X-GitHub-Event': event,
+               'X-GitHub-Delivery': str(uuid.uuid4())}
+    if secret:
+        headers['X-Hub-Signature-256'] = 'sha256=' + sign(secret, body)
+    return requests.post(url, data=body, headers=headers)
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Send a recorded webhook payload to a listening bot.')
+    parser.add_argument("url", type=str, help="Listener url, e.g. http://127.0.0.1:8000/")
+    parser.add_argument("event", type=str, help="Event type (issue_comment, issues, pull_request, ...)")
+    parser.add_argument("payload", type=str, help="File holding the JSON payload")
+    parser.add_argument('--secret', type=str, help="Webhook secret to sign the payload with")
+    args=parser.parse_args()
+
+    r = send(args.url, args.event, open(args.payload).read(), args.secret)
+    print r.status_code, r.text.strip()
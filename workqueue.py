@@ -0,0 +1,204 @@
+#------------------------------------------------------------------------------------
+# A SQLite work queue for sharded sweeps.
+#
+# A coordinator puts every open item it wants triaged (from one or more repos)
+# into the queue. Any number of worker processes, on this host or on others that
+# share the file, then claim items one at a time and triage them. A claim is a
+# lease: if a worker dies, its item becomes claimable again once the lease runs
+# out, so nothing is lost; a worker that finishes an item after losing its lease
+# doesn't get to record it, so nothing is counted twice either. A live worker
+# keeps renewing its lease while it works (see keep()), however long that takes
+# (e.g. waiting out the rate limit), so only a dead one loses its item. Items that keep
+# failing are given up on after a few attempts. The results all end up in the
+# queue, from where they can be reported on together.
+#
+# Sharing the file between hosts relies on SQLite's file locking, so it needs a
+# filesystem where that works (not every NFS setup qualifies).
+#------------------------------------------------------------------------------------
+
+import json, os, socket, sqlite3, threading, time
+from contextlib import contextmanager
+
+
+def worker_id():
+    return '%s:%d' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+
+    def __init__(self, path, lease=600, max_attempts=3):
+        self.path = path
+        self.lease = lease
+        self.max_attempts = max_attempts
+        # Autocommit mode; the transactions that need to be atomic say so.
+        self.db = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.db.execute('''CREATE TABLE IF NOT EXISTS queue (
+                               repo TEXT,
+                               number INTEGER,
+                               updated_at TEXT,
+                               status TEXT,
+                               owner TEXT,
+                               lease_until REAL,
+                               attempts INTEGER,
+                               result TEXT,
+                               error TEXT,
+                               PRIMARY KEY (repo, number))''')
+
+    #--------------------------------------------------------------------------------
+    # Start a new sweep: forget everything from the last one, and queue up the
+    # given (repo, number, updated_at) items, all in one transaction.
+    #--------------------------------------------------------------------------------
+    def fill(self, items):
+        # Gather everything first, so the queue isn't locked while we wait on GitHub.
+        items = list(items)
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            self.db.execute('DELETE FROM queue')
+            count = 0
+            for repo, number, updated_at in items:
+                self.db.execute('''INSERT OR IGNORE INTO queue
+                                   VALUES (?, ?, ?, 'pending', NULL, NULL, 0, NULL, NULL)''',
+                                (repo, int(number), updated_at))
+                count += 1
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        return count
+
+    #--------------------------------------------------------------------------------
+    # Claim the next item: one nobody has, or one whose lease has run out. Items
+    # go out in the order they were added. Returns (repo, number), or None if
+    # there's nothing to claim right now.
+    #--------------------------------------------------------------------------------
+    def claim(self, owner, now=None):
+        if now is None:
+            now = time.time()
+        self.db.execute('BEGIN IMMEDIATE')
+        try:
+            # Items whose workers keep dying on them are given up on too.
+            self.db.execute('''UPDATE queue SET status = 'failed', error = 'lease ran out too many times'
+                               WHERE status = 'leased' AND lease_until < ? AND attempts >= ?''',
+                            (now, self.max_attempts))
+            row = self.db.execute('''SELECT repo, number FROM queue
+                                     WHERE (status = 'pending')
+                                        OR (status = 'leased' AND lease_until < ?)
+                                     ORDER BY rowid LIMIT 1''', (now,)).fetchone()
+            if row is not None:
+                self.db.execute('''UPDATE queue SET status = 'leased', owner = ?, lease_until = ?,
+                                                    attempts = attempts + 1
+                                   WHERE repo = ? AND number = ?''',
+                                (owner, now + self.lease, row[0], row[1]))
+            self.db.execute('COMMIT')
+        except:
+            self.db.execute('ROLLBACK')
+            raise
+        return row
+
+    #--------------------------------------------------------------------------------
+    # The updated_at an item was queued with (None for an item not in the queue).
+    #--------------------------------------------------------------------------------
+    def updated_at(self, repo, number):
+        row = self.db.execute('SELECT updated_at FROM queue WHERE repo = ? AND number = ?',
+                              (repo, int(number))).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    #--------------------------------------------------------------------------------
+    # Extend our lease on an item by another full lease from now. Returns whether
+    # we still held it.
+    #--------------------------------------------------------------------------------
+    def renew(self, repo, number, owner, now=None):
+        if now is None:
+            now = time.time()
+        c = self.db.execute('''UPDATE queue SET lease_until = ?
+                               WHERE repo = ? AND number = ? AND owner = ? AND status = 'leased' ''',
+                            (now + self.lease, repo, int(number), owner))
+        return c.rowcount == 1
+
+    #--------------------------------------------------------------------------------
+    # Keep our lease on an item renewed while we work on it, until we call the
+    # function this hands back. A background thread renews it every third of a
+    # lease, over a connection of its own (SQLite connections stay in the thread
+    # that made them). held() does the same for the length of a with block:
+    #     with queue.held(repo, number, owner): ...
+    #--------------------------------------------------------------------------------
+    def keep(self, repo, number, owner):
+        done = threading.Event()
+        thread = threading.Thread(target=self.keep_renewing, args=(repo, number, owner, done))
+        thread.daemon = True
+        thread.start()
+        def stop():
+            done.set()
+            thread.join()
+        return stop
+
+    @contextmanager
+    def held(self, repo, number, owner):
+        stop = self.keep(repo, number, owner)
+        try:
+            yield
+        finally:
+            stop()
+
+    def keep_renewing(self, repo, number, owner, done):
+        queue = WorkQueue(self.path, lease=self.lease, max_attempts=self.max_attempts)
+        try:
+            while not done.wait(self.lease / 3.0):
+                try:
+                    if not queue.renew(repo, number, owner):
+                        return
+                except sqlite3.Error as e:
+                    # Busy, most likely; there's time to try again before it runs out.
+                    print "WARN: could not renew the lease on", repo, number, ":", e
+        finally:
+            queue.close()
+
+    #--------------------------------------------------------------------------------
+    # Record the result of an item. Only counts if we still hold its lease;
+    # returns whether it did.
+    #--------------------------------------------------------------------------------
+    def finish(self, repo, number, owner, result):
+        c = self.db.execute('''UPDATE queue SET status = 'done', result = ?, error = NULL
+                               WHERE repo = ? AND number = ? AND owner = ? AND status = 'leased' ''',
+                            (json.dumps(result), repo, int(number), owner))
+        return c.rowcount == 1
+
+    #--------------------------------------------------------------------------------
+    # An item failed. It goes back in the queue for another worker to try, unless
+    # it has used up its attempts.
+    #--------------------------------------------------------------------------------
+    def fail(self, repo, number, owner, error):
+        self.db.execute('''UPDATE queue SET status = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END,
+                                            error = ?, owner = NULL, lease_until = NULL
+                           WHERE repo = ? AND number = ? AND owner = ? AND status = 'leased' ''',
+                        (self.max_attempts, error, repo, int(number), owner))
+
+    #--------------------------------------------------------------------------------
+    # How many items are in each state.
+    #--------------------------------------------------------------------------------
+    def counts(self):
+        counts = {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0}
+        for status, count in self.db.execute('SELECT status, COUNT(*) FROM queue GROUP BY status'):
+            counts[status] = count
+        return counts
+
+    def unfinished(self):
+        counts = self.counts()
+        return counts['pending'] + counts['leased']
+
+    #--------------------------------------------------------------------------------
+    # Every item, with its outcome, in the order they were added.
+    #--------------------------------------------------------------------------------
+    def items(self):
+        for row in self.db.execute('''SELECT repo, number, status, attempts, result, error
+                                      FROM queue ORDER BY rowid'''):
+            repo, number, status, attempts, result, error = row
+            if result is not None:
+                result = json.loads(result)
+            yield {'repo': repo, 'number': number, 'status': status, 'attempts': attempts,
+                   'result': result, 'error': error}
+
+    def close(self):
+        self.db.close()